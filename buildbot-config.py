@@ -38,6 +38,10 @@ slaves = [
 ]
 
 
+# processes that run the unit tests on each buildslave
+testWorkers = 2
+
+
 # LIBRARIES
 sqlalchemy = Library(name='SQLAlchemy',
                      src=libFolder + 'sqlalchemy-%s.tar.gz',
@@ -47,7 +51,9 @@ sqlalchemy = Library(name='SQLAlchemy',
 twisted = Library(name='Twisted',
                   src=libFolder + 'twisted-%s.tar.gz',
                   versions=['2.5.0', '8.2.0', '9.0.0'],
-                  slaves=slaves)
+                  slaves=slaves,
+                  # Twisted 9.0 dropped Python 2.3
+                  exclude=[{'version': '9.0.0', 'python': '2.3'}])
 
 django = Library('Django',
                  src=libFolder + 'django-%s.tar.gz',
@@ -59,7 +65,9 @@ django = Library('Django',
 libraries = [sqlalchemy, twisted, django]
 farm = BuildFarm(name='PyAMF Buildfarm', libraries=libraries,
                  scm=svn_step, distFolder=distFolder,
-                 webFolder=webFolder, libFolder=libFolder)
+                 webFolder=webFolder, libFolder=libFolder,
+                 coverage='pairwise', shareCompile=True,
+                 testWorkers=testWorkers)
 builders = farm.run()
 
 # THIS IS IMPORTED IN THE BUILDBOT MASTER CONFIG FILE
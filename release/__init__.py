@@ -7,8 +7,15 @@ from ConfigParser import RawConfigParser
 
 from twisted.python._release import Project as TwistedProject
 
+from release.staging import replaceFile
 
-__all__ = ["sizeof_fmt", "Project"]
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+__all__ = ["sizeof_fmt", "lockFile", "Project"]
 
 
 def sizeof_fmt(num):
@@ -21,6 +28,30 @@ def sizeof_fmt(num):
         num /= 1024.0
 
 
+def lockFile(path):
+    """
+    Take an exclusive lock on a file, waiting for other processes that hold
+    it. Without `fcntl`, eg. on Windows, nothing is locked.
+
+    :type path: `str`
+    :param path: The lock file, created when it doesn't exist.
+    :rtype: `file`
+    :return: The open lock file; closing it releases the lock.
+    """
+    lock = open(path, "a")
+
+    if fcntl is None:
+        return lock
+
+    try:
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except IOError:
+        logging.info("\tWaiting for another build to release %s..." % path)
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+
+    return lock
+
+
 class Project(TwistedProject):
     """
     A representation of a PyAMF project that has a version.
@@ -69,9 +100,13 @@ class Project(TwistedProject):
 
             newlines.append(line)
 
-        # create updated change log file
-        outputFile = open(change_log.path, "wb")
+        changelog.close()
+
+        # create updated change log file, replacing the old one so files
+        # shared with the tree cache aren't changed
+        outputFile = replaceFile(change_log.path)
         outputFile.writelines(newlines)
+        outputFile.close()
 
         # remove the egg_info metadata from setup.cfg
         logging.info("\tUpdating setup.cfg...")
@@ -83,5 +118,5 @@ class Project(TwistedProject):
             config.remove_section('egg_info')
 
         # save updated configuration file
-        with open(setup_cfg.path, 'wb') as configfile:
+        with replaceFile(setup_cfg.path) as configfile:
             config.write(configfile)
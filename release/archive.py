@@ -0,0 +1,621 @@
+# Copyright (c) The PyAMF Project.
+# See LICENSE.txt for details.
+
+"""
+Release archive writers.
+
+The tree that goes into the release archives is walked once into a
+L{Manifest}; every file is then read a single time and handed to all open
+archive writers.
+"""
+
+import os
+import copy
+import stat
+from fnmatch import fnmatch
+import struct
+import logging
+from time import localtime, gmtime
+from tarfile import TarFile, TarInfo, ExtractError, REGTYPE, DIRTYPE, SYMTYPE
+from tarfile import BLOCKSIZE, NUL
+from binascii import crc32
+from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED, ZIP_STORED, ZIP64_LIMIT
+try:
+    import zlib
+    compression = ZIP_DEFLATED
+except:
+    compression = ZIP_STORED
+
+try:
+    import pwd, grp
+except ImportError:
+    pwd = grp = None
+
+from release.checksum import HashingFile
+
+
+__all__ = ["BUFFER_SIZE", "ZIP_EPOCH", "DEFAULT_EXCLUDE", "Entry", "Filter",
+           "Manifest", "ArchiveWriter", "TarWriter", "ZipWriter",
+           "extractStream"]
+
+
+#: Size of the chunks copied from the release tree into the archives.
+BUFFER_SIZE = 256 * 1024
+
+#: Earliest time a ZIP archive can store, 1980-01-01 00:00:00 UTC.
+ZIP_EPOCH = 315532800
+
+#: Hidden files and directories and backup files are left out by default.
+DEFAULT_EXCLUDE = (".*", "*~")
+
+
+class Entry(object):
+    """
+    A file, directory or symlink that goes into a release archive.
+
+    :ivar path: Location of the entry on disk.
+    :ivar name: Name of the entry in the archive, using `/` as separator.
+    :ivar stat: `os.lstat` result for `path`.
+    """
+
+    def __init__(self, path, name, stat):
+        self.path = path
+        self.name = name
+        self.stat = stat
+
+    def isdir(self):
+        return stat.S_ISDIR(self.stat.st_mode)
+
+    def islink(self):
+        return stat.S_ISLNK(self.stat.st_mode)
+
+    def isfile(self):
+        return stat.S_ISREG(self.stat.st_mode)
+
+
+class Filter(object):
+    """
+    Include and exclude rules for the entries of the release archives.
+
+    Rules are `fnmatch` patterns. A pattern without a `/` is matched against
+    the last component of a name, eg. `*~`; other patterns are matched
+    against the name relative to the release directory, eg.
+    `doc/tutorials/*`. Excluded directories aren't walked at all. When
+    include patterns are given, only files that match one of them are kept.
+
+    :ivar include: Patterns of the files to keep, all files when empty.
+    :ivar exclude: Patterns of the files and directories to leave out.
+    """
+
+    def __init__(self, include=(), exclude=DEFAULT_EXCLUDE):
+        self.include = list(include or ())
+        self.exclude = list(exclude or ())
+
+
+    def accepts(self, name, isdir=False):
+        """
+        :param name: Name in the archive, starting with the release
+            directory.
+        :type name: `str`
+        :param isdir: The name is a directory.
+        :type isdir: `bool`
+        :rtype: `bool`
+        """
+        if self._matches(name, self.exclude):
+            return False
+
+        if isdir or not self.include:
+            return True
+
+        return self._matches(name, self.include)
+
+
+    def _matches(self, name, patterns):
+        base = name.rsplit("/", 1)[-1]
+        relative = name.split("/", 1)[-1]
+
+        for pattern in patterns:
+            if "/" in pattern:
+                if fnmatch(relative, pattern):
+                    return True
+            elif fnmatch(base, pattern):
+                return True
+
+        return False
+
+
+class Manifest(object):
+    """
+    Ordered list of L{Entry} objects collected in a single walk.
+
+    :ivar filter: L{Filter} applied while walking, `None` to keep all
+        entries.
+    """
+
+    def __init__(self, filter=None):
+        self.entries = []
+        self.filter = filter
+
+
+    def add(self, path, name):
+        """
+        Add a file or a directory tree.
+
+        :param path: Location of the file or directory on disk.
+        :type path: `str`
+        :param name: Name in the archive.
+        :type name: `str`
+        """
+        name = name.replace(os.sep, "/")
+        st = os.lstat(path)
+
+        if not self._accepts(name, st):
+            return
+
+        if not stat.S_ISDIR(st.st_mode):
+            self.entries.append(Entry(path, name, st))
+            return
+
+        for root, dirs, files in os.walk(path):
+            prefix = name + root[len(path):].replace(os.sep, "/")
+            self.entries.append(Entry(root, prefix, os.lstat(root)))
+            walk = []
+
+            for f in dirs + files:
+                src = os.path.join(root, f)
+                st = os.lstat(src)
+
+                if not self._accepts(prefix + "/" + f, st):
+                    continue
+
+                # os.walk doesn't descend into symlinked directories
+                if f in dirs and not stat.S_ISLNK(st.st_mode):
+                    walk.append(f)
+                    continue
+
+                self.entries.append(Entry(src, prefix + "/" + f, st))
+
+            # excluded directories are never walked
+            dirs[:] = walk
+
+
+    def _accepts(self, name, st):
+        if self.filter is None:
+            return True
+
+        return self.filter.accepts(name, stat.S_ISDIR(st.st_mode))
+
+
+    def sort(self):
+        """
+        Sort the entries by name, independent of the order the file system
+        returns them in. Directories still come before their contents.
+        """
+        self.entries.sort(key=lambda entry: entry.name.split("/"))
+
+
+    def write(self, writers, bufferSize=BUFFER_SIZE):
+        """
+        Read every file once and add it to all writers that accept it.
+
+        Files are copied in chunks of `bufferSize` bytes, so memory use
+        doesn't depend on the size of the largest file.
+
+        :param writers: Open archive writers.
+        :type writers: `list`
+        :param bufferSize: Size of the chunks in bytes.
+        :type bufferSize: `int`
+        """
+        for entry in self.entries:
+            targets = [w for w in writers if w.accepts(entry)]
+
+            if not targets:
+                continue
+
+            readers = targets
+            if not entry.isfile():
+                readers = []
+                if entry.islink() and os.path.isfile(entry.path):
+                    readers = [w for w in targets if w.dereference]
+
+            for writer in targets:
+                if writer not in readers:
+                    writer.add(entry)
+
+            if not readers:
+                continue
+
+            size = entry.stat.st_size
+            if not entry.isfile():
+                size = os.stat(entry.path).st_size
+
+            for writer in readers:
+                writer.startFile(entry, size)
+
+            fd = open(entry.path, "rb")
+            try:
+                while True:
+                    chunk = fd.read(bufferSize)
+                    if not chunk:
+                        break
+                    for writer in readers:
+                        writer.write(chunk)
+            finally:
+                fd.close()
+
+            for writer in readers:
+                writer.finishFile()
+
+
+class ArchiveWriter(object):
+    """
+    Base class for archive writers.
+
+    The archive is written through a L{HashingFile}, so its checksums are
+    available as soon as it is closed.
+
+    :ivar output: The L{HashingFile} the archive is written to.
+    :ivar mtime: Modification time of every entry for reproducible archives,
+        the owners and permissions are normalized as well. The times and
+        owners on disk are used when `None`.
+    """
+
+    dereference = False
+
+    def __init__(self, path, mtime=None):
+        self.path = path
+        self.mtime = mtime
+        self.output = HashingFile(open(path, "wb"))
+
+
+    def accepts(self, entry):
+        return True
+
+
+    def add(self, entry):
+        """
+        Add a directory or symlink.
+        """
+
+
+    def startFile(self, entry, size):
+        """
+        Start adding a file of `size` bytes, the data follows in `write`
+        calls and ends with `finishFile`.
+        """
+        raise NotImplementedError
+
+
+    def write(self, data):
+        raise NotImplementedError
+
+
+    def finishFile(self):
+        raise NotImplementedError
+
+
+    def getChecksums(self):
+        """
+        :rtype: `dict`
+        :return: Hex digest for each algorithm of the archive written so far.
+        """
+        return self.output.getChecksums()
+
+
+    def _getMode(self, entry):
+        """
+        Permission bits of an entry, `0755` for directories and executables
+        and `0644` for other files in reproducible archives.
+        """
+        mode = stat.S_IMODE(entry.stat.st_mode)
+
+        if self.mtime is None:
+            return mode
+        if entry.islink():
+            return 0777
+        if entry.isdir() or mode & 0111:
+            return 0755
+
+        return 0644
+
+
+    def _abort(self):
+        """
+        Remove a partly created archive.
+        """
+        self.output.close()
+        os.unlink(self.path)
+
+
+class TarWriter(ArchiveWriter):
+    """
+    Writes entries to a tarball, compressed by one of the backends in
+    L{release.compress}.
+    """
+
+    def __init__(self, path, backend, level=9, threads=1, mtime=None):
+        """
+        :param path: Location of the tarball.
+        :type path: `str`
+        :param backend: Compression backend, a `Compressor` subclass.
+        :param level: Compression level.
+        :type level: `int`
+        :param threads: Number of threads the backend may use.
+        :type threads: `int`
+        :param mtime: Modification time of every entry, see `ArchiveWriter`.
+        :type mtime: `int`
+        """
+        ArchiveWriter.__init__(self, path, mtime)
+
+        # reproducible tarballs have no time in the compression header
+        headerTime = None
+        if mtime is not None:
+            headerTime = 0
+
+        try:
+            self.compressor = backend(self.output, level, threads,
+                                      os.path.basename(path), headerTime)
+            self.tar = TarFile.open(path, mode="w|", fileobj=self.compressor)
+        except:
+            self._abort()
+            raise
+
+        self._names = {}
+
+
+    def add(self, entry):
+        info = self._getInfo(entry)
+
+        if entry.isdir():
+            info.type = DIRTYPE
+        else:
+            info.type = SYMTYPE
+            info.linkname = os.readlink(entry.path)
+
+        self.tar.addfile(info)
+
+
+    def startFile(self, entry, size):
+        # same as TarFile.addfile, with the data pushed in by write()
+        self.tar._check("aw")
+
+        info = self._getInfo(entry)
+        info.type = REGTYPE
+        info.size = size
+
+        buf = info.tobuf(self.tar.format, self.tar.encoding, self.tar.errors)
+        self.tar.fileobj.write(buf)
+        self.tar.offset += len(buf)
+        self.tar.members.append(info)
+
+        self._info = info
+        self._written = 0
+
+
+    def write(self, data):
+        self.tar.fileobj.write(data)
+        self._written += len(data)
+
+
+    def finishFile(self):
+        info = self._info
+
+        if self._written != info.size:
+            raise IOError("%s changed size while being archived" % info.name)
+
+        blocks, remainder = divmod(info.size, BLOCKSIZE)
+        if remainder > 0:
+            self.tar.fileobj.write(NUL * (BLOCKSIZE - remainder))
+            blocks += 1
+        self.tar.offset += blocks * BLOCKSIZE
+
+
+    def _getInfo(self, entry):
+        st = entry.stat
+        info = TarInfo(entry.name)
+        info.mode = self._getMode(entry)
+
+        if self.mtime is not None:
+            # TarInfo defaults to uid and gid 0 without user names
+            info.mtime = self.mtime
+            return info
+
+        info.uid = st.st_uid
+        info.gid = st.st_gid
+        info.mtime = st.st_mtime
+        info.uname, info.gname = self._getOwner(st)
+
+        return info
+
+
+    def close(self):
+        self.tar.close()
+        self.compressor.close()
+        self.output.close()
+
+
+    def _getOwner(self, st):
+        """
+        User and group names, looked up once per uid/gid.
+        """
+        key = (st.st_uid, st.st_gid)
+
+        if key not in self._names:
+            uname = gname = ""
+            if pwd is not None:
+                try:
+                    uname = pwd.getpwuid(st.st_uid)[0]
+                except KeyError:
+                    pass
+                try:
+                    gname = grp.getgrgid(st.st_gid)[0]
+                except KeyError:
+                    pass
+            self._names[key] = (uname, gname)
+
+        return self._names[key]
+
+
+class ZipWriter(ArchiveWriter):
+    """
+    Writes files to a ZIP archive.
+
+    ZIP archives are flat: the release directory is left out of the names
+    and directories aren't stored.
+    """
+
+    dereference = True
+
+    def __init__(self, path, level=None, mtime=None):
+        """
+        :param path: Location of the zip file.
+        :type path: `str`
+        :param level: DEFLATE compression level, the `zlib` default when
+            `None`.
+        :type level: `int`
+        :param mtime: Modification time of every entry, see `ArchiveWriter`.
+            Times before 1980 are stored as `ZIP_EPOCH`.
+        :type mtime: `int`
+        """
+        ArchiveWriter.__init__(self, path, mtime)
+        self.zip = ZipFile(self.output, "w")
+        self.level = level
+        if level is None:
+            self.level = zlib.Z_DEFAULT_COMPRESSION
+
+
+    def accepts(self, entry):
+        return not entry.isdir() and "/" in entry.name
+
+
+    def startFile(self, entry, size):
+        # the CRC and compressed size follow the data in a data descriptor,
+        # so nothing has to be held in memory or rewritten afterwards
+        if self.mtime is None:
+            date_time = localtime(entry.stat.st_mtime)[:6]
+        else:
+            date_time = gmtime(max(self.mtime, ZIP_EPOCH))[:6]
+
+        info = ZipInfo(entry.name.split("/", 1)[1], date_time)
+        info.compress_type = compression
+
+        if self.mtime is not None:
+            info.create_system = 3
+            info.external_attr = (stat.S_IFREG | self._getMode(entry)) << 16
+        info.flag_bits |= 0x08
+        info.file_size = size
+        info.header_offset = self.output.tell()
+
+        self.zip._writecheck(info)
+        self._zip64 = size > ZIP64_LIMIT
+        self.output.write(info.FileHeader(self._zip64))
+
+        self._info = info
+        self._crc = 0
+        self._size = 0
+        self._compressed = 0
+        self._compressor = None
+
+        if compression == ZIP_DEFLATED:
+            self._compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+
+
+    def write(self, data):
+        self._crc = crc32(data, self._crc)
+        self._size += len(data)
+
+        if self._compressor is not None:
+            data = self._compressor.compress(data)
+
+        self.output.write(data)
+        self._compressed += len(data)
+
+
+    def finishFile(self):
+        info = self._info
+
+        if self._compressor is not None:
+            data = self._compressor.flush()
+            self.output.write(data)
+            self._compressed += len(data)
+
+        info.CRC = self._crc & 0xffffffff
+        info.file_size = self._size
+        info.compress_size = self._compressed
+
+        fmt = self._zip64 and "<4sLQQ" or "<4sLLL"
+        self.output.write(struct.pack(fmt, "PK\007\010", info.CRC,
+                                      info.compress_size, info.file_size))
+
+        self.zip.filelist.append(info)
+        self.zip.NameToInfo[info.filename] = info
+
+
+    def close(self):
+        self.zip.close()
+        self.output.close()
+
+
+def extractStream(fileobj, path, strip=1):
+    """
+    Extract a tarball while it is being read from a stream, eg. a download.
+
+    The stream is read once, front to back, and no copy of the archive is
+    kept. The first `strip` components of each member name are left out, eg.
+    the `hydralabs-pyamf-<sha>/` directory of GitHub tarballs.
+
+    :param fileobj: Stream with a (compressed) tarball.
+    :param path: Target directory.
+    :type path: `str`
+    :param strip: Number of leading path components to remove.
+    :type strip: `int`
+    """
+    tar = TarFile.open(fileobj=fileobj, mode="r|*")
+    directories = []
+
+    try:
+        for member in tar:
+            name = _stripName(member.name, strip)
+
+            if not name:
+                continue
+
+            if os.path.isabs(member.name) or ".." in name.split("/"):
+                logging.warn("\t - Warning! Skipping unsafe member: " + member.name)
+                continue
+
+            member.name = name
+
+            if member.islnk():
+                member.linkname = _stripName(member.linkname, strip)
+
+            if member.isdir():
+                # set the directory attributes once its files are extracted
+                directories.append(member)
+                member = copy.copy(member)
+                member.mode = 0700
+
+            tar.extract(member, path)
+
+        # deepest directories first, like TarFile.extractall
+        directories.sort(key=lambda d: d.name, reverse=True)
+
+        for member in directories:
+            target = os.path.join(path, member.name)
+            try:
+                tar.chown(member, target)
+                tar.utime(member, target)
+                tar.chmod(member, target)
+            except ExtractError, e:
+                logging.debug("tarfile: %s" % e)
+    finally:
+        tar.close()
+
+
+def _stripName(name, strip):
+    """
+    Remove the first `strip` components from an archive member name.
+    """
+    parts = [p for p in name.split("/") if p and p != "."]
+
+    return "/".join(parts[strip:])
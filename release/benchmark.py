@@ -0,0 +1,532 @@
+# Copyright (c) The PyAMF Project.
+# See LICENSE.txt for details.
+
+"""
+Benchmarks for the release packaging code.
+
+Everything runs offline on generated data; the same seed gives the same
+data, so results of different commits on the same machine can be
+compared.
+"""
+
+import os
+import sys
+import time
+import json
+import zlib
+import random
+import shutil
+import logging
+import platform
+from tempfile import mkdtemp
+from subprocess import Popen, PIPE
+from optparse import OptionParser
+from multiprocessing import cpu_count
+
+try:
+    import bz2
+except ImportError:
+    bz2 = None
+
+from twisted.python.filepath import FilePath
+
+from release import sizeof_fmt, Project
+from release.archive import BUFFER_SIZE
+from release import compress
+
+
+__all__ = ["makeData", "timeCompression", "benchmarkCompression", "makeTree",
+           "benchmarkPackaging", "compressionMain", "packagingMain"]
+
+
+#: Single-threaded and multi-threaded backends compared for each suffix.
+COMPRESSION_BACKENDS = {
+    "gz": [compress.GzipCompressor, compress.ParallelGzipCompressor,
+           compress.PigzCompressor],
+    "bz2": [compress.BZ2Compressor, compress.ParallelBZ2Compressor,
+            compress.PBzip2Compressor],
+}
+
+#: Default compression level for each suffix, like the release builders.
+LEVELS = {"gz": 9, "bz2": 9}
+
+#: Number of files of the generated trees.
+SCALES = {"1k": 1000, "10k": 10000, "100k": 100000}
+
+#: Number and size of the large files added to the `large` trees.
+LARGE_FILES = (4, 8 * 1024 * 1024)
+
+#: Export type, compression level and threads of each packaging run; `None`
+#: threads means one per CPU.
+PACKAGE_SETTINGS = [("zip", 6, 1), ("zip", 9, 1),
+                    ("tar.gz", 6, 1), ("tar.gz", 9, 1), ("tar.gz", 9, None),
+                    ("tar.bz2", 9, 1), ("tar.bz2", 9, None),
+                    ("tar.xz", 6, 1), ("tar.xz", 6, None)]
+
+#: Tokens the synthetic data is made of, so it compresses like source code.
+WORDS = ("def class self return import from if else for in while try except "
+         "raise None True False pyamf amf0 amf3 encoder decoder context "
+         "stream buffer write read bytes int str object type").split()
+
+
+class _Sink(object):
+    """
+    Collects the compressed output in memory.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+
+    def write(self, data):
+        self.chunks.append(data)
+        self.size += len(data)
+
+    def getvalue(self):
+        return "".join(self.chunks)
+
+
+def makeData(size, seed=0):
+    """
+    Generate `size` bytes of text that looks roughly like Python source.
+
+    :param size: Number of bytes.
+    :type size: `int`
+    :param seed: Seed for the random generator, the same seed gives the same
+        data.
+    :type seed: `int`
+    :rtype: `str`
+    """
+    rnd = random.Random(seed)
+    lines = []
+    total = 0
+
+    while total < size:
+        line = "    " * rnd.randint(0, 3) + " ".join(
+            [rnd.choice(WORDS) for i in xrange(rnd.randint(1, 12))])
+        line += " # %08x\n" % rnd.getrandbits(32)
+        lines.append(line)
+        total += len(line)
+
+    return "".join(lines)[:size]
+
+
+def timeCompression(backend, data, level, threads=1, chunkSize=BUFFER_SIZE):
+    """
+    Compress `data` with a backend, written in chunks like the archive
+    writers do.
+
+    :param backend: `Compressor` subclass.
+    :param data: Uncompressed data.
+    :type data: `str`
+    :rtype: `tuple`
+    :return: Seconds taken and the compressed data.
+    """
+    sink = _Sink()
+    start = time.time()
+
+    compressor = backend(sink, level, threads, "benchmark")
+    for offset in xrange(0, len(data), chunkSize):
+        compressor.write(data[offset:offset + chunkSize])
+    compressor.close()
+
+    return time.time() - start, sink.getvalue()
+
+
+def _decompress(suffix, data):
+    """
+    Decompress every gzip member or bzip2 stream in `data`.
+    """
+    output = []
+
+    while data:
+        if suffix == "gz":
+            decompressor = zlib.decompressobj(31)
+        else:
+            decompressor = bz2.BZ2Decompressor()
+
+        output.append(decompressor.decompress(data))
+        data = decompressor.unused_data
+
+    return "".join(output)
+
+
+def benchmarkCompression(data, suffixes=("gz", "bz2"), threads=None,
+                         levels=LEVELS):
+    """
+    Time each available backend for each suffix on the same data, and check
+    that the output decompresses to the input.
+
+    :param data: Uncompressed data.
+    :type data: `str`
+    :param suffixes: Tarball suffixes, eg. `gz`.
+    :type suffixes: `tuple`
+    :param threads: Number of threads for the multi-threaded backends, the
+        number of CPUs when `None`.
+    :type threads: `int`
+    :rtype: `list`
+    :return: A `dict` with the suffix, backend, threads, seconds, compressed
+        size and speedup over the single-threaded backend for each run.
+    :raise AssertionError: A backend produced corrupt output.
+    """
+    threads = threads or cpu_count()
+    results = []
+
+    for suffix in suffixes:
+        baseline = None
+
+        for backend in COMPRESSION_BACKENDS[suffix]:
+            if not backend.isAvailable():
+                continue
+
+            n = backend.threaded and threads or 1
+            seconds, output = timeCompression(backend, data, levels[suffix], n)
+
+            if _decompress(suffix, output) != data:
+                raise AssertionError("%s output doesn't match the input" %
+                                     backend.__name__)
+
+            if baseline is None:
+                baseline = seconds
+
+            results.append({"suffix": suffix, "backend": backend.__name__,
+                            "threads": n, "seconds": seconds,
+                            "size": len(output),
+                            "speedup": baseline / max(seconds, 1e-9)})
+
+    return results
+
+
+def _writeFile(path, data):
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    fd = open(path, "wb")
+    try:
+        fd.write(data)
+    finally:
+        fd.close()
+
+
+def makeTree(path, files, large=(0, 0), seed=0):
+    """
+    Generate a tree shaped like an extracted PyAMF source tarball with built
+    documentation: `pyamf` and `cpyamf` packages with byte code, HTML and
+    API documentation in `doc/_build/html`, and the top-level files.
+
+    :param path: Target directory.
+    :type path: `str`
+    :param files: Number of files, about half of them documentation.
+    :type files: `int`
+    :param large: Number and size of large files added to `_static`.
+    :type large: `tuple`
+    :param seed: Seed for the random generator.
+    :type seed: `int`
+    :rtype: `tuple`
+    :return: Number of files and their total size in bytes.
+    """
+    rnd = random.Random(seed)
+    text = makeData(1024 * 1024, seed)
+    count = size = 0
+
+    def chunk(low, high):
+        n = rnd.randint(low, high)
+        start = rnd.randint(0, len(text) - n)
+        return text[start:start + n]
+
+    top = {"LICENSE.txt": chunk(1000, 2000),
+           "setup.py": chunk(2000, 8000),
+           "ez_setup.py": chunk(4000, 10000),
+           "setup.cfg": "[egg_info]\ntag_build = dev\n\n"
+                        "[epydoc]\nname = PyAMF\n",
+           "pyamf/__init__.py": "version = (0, 6)\n" + chunk(2000, 8000),
+           "CHANGES.txt": "Change Log\n==========\n\n0.6 (unreleased)\n"
+                          "----------------\n\n" + chunk(20000, 40000)}
+
+    for name, data in top.items():
+        _writeFile(os.path.join(path, name), data)
+        count += 1
+        size += len(data)
+
+    # directories of 50 files, like the packages and doc sections
+    while count < files:
+        n = count / 50
+        kind = rnd.random()
+
+        if kind < 0.4:
+            name = "pyamf/sub%d/module%d.py" % (n, count)
+            data = chunk(1000, 12000)
+        elif kind < 0.45:
+            name = "pyamf/sub%d/module%d.pyc" % (n, count)
+            data = chunk(1000, 8000)
+        elif kind < 0.5:
+            name = "cpyamf/ext%d/codec%d.%s" % (n, count,
+                                                rnd.choice(["pyx", "c", "so"]))
+            data = chunk(2000, 20000)
+        elif kind < 0.8:
+            name = "doc/_build/html/section%d/page%d.html" % (n, count)
+            data = "<html><body><pre>%s</pre></body></html>" % chunk(2000, 16000)
+        else:
+            name = "doc/_build/html/api/pyamf.sub%d.module%d-class.html" % (n, count)
+            data = "<html><body><pre>%s</pre></body></html>" % chunk(1000, 6000)
+
+        _writeFile(os.path.join(path, name), data)
+        count += 1
+        size += len(data)
+
+    number, largeSize = large
+    for i in xrange(number):
+        data = makeData(largeSize, seed + i + 1)
+        _writeFile(os.path.join(path, "doc/_build/html/_static/large%d.bin" % i),
+                   data)
+        count += 1
+        size += len(data)
+
+    return count, size
+
+
+def _getCommit():
+    """
+    Commit of the release tools that is being benchmarked.
+    """
+    try:
+        process = Popen(["git", "rev-parse", "HEAD"], stdout=PIPE, stderr=PIPE,
+                        cwd=os.path.dirname(os.path.abspath(__file__)))
+    except OSError:
+        return
+
+    output = process.communicate()[0].strip()
+
+    if process.returncode == 0:
+        return output
+
+
+def _timeIt(function, repeat=1, setup=None):
+    """
+    Best time of `repeat` runs of `function`, after calling `setup`.
+    """
+    best = None
+
+    for i in xrange(repeat):
+        if setup is not None:
+            setup()
+
+        start = time.time()
+        function()
+        seconds = time.time() - start
+
+        if best is None or seconds < best:
+            best = seconds
+
+    return best
+
+
+def benchmarkPackaging(workPath, scales=("1k", "10k"), sizes=("small", "large"),
+                       settings=PACKAGE_SETTINGS, threads=None, repeat=1,
+                       seed=0):
+    """
+    Time the packaging paths of `DistributionBuilder` on generated trees.
+
+    The paths are: walking the tree into a manifest, writing each export type
+    with each compression setting, hashing the packages with `_getMD5`,
+    `_clean` and `Project.updateVersion`.
+
+    :param workPath: Directory for the generated trees and packages.
+    :type workPath: `str`
+    :param scales: Keys of `SCALES`.
+    :type scales: `tuple`
+    :param sizes: `small` for small files only, `large` for `LARGE_FILES`
+        extra large files.
+    :type sizes: `tuple`
+    :param settings: `(export type, level, threads)` for each package.
+    :type settings: `list`
+    :param repeat: Number of runs of each path, the best time is reported.
+    :type repeat: `int`
+    :rtype: `list`
+    :return: A `dict` with the scale, size, path, setting, seconds, bytes
+        and files for each run.
+    """
+    from release.package import TarballsBuilder
+
+    threads = threads or cpu_count()
+    results = []
+
+    for scale in scales:
+        for size in sizes:
+            large = (0, 0)
+            if size == "large":
+                large = LARGE_FILES
+
+            root = os.path.join(workPath, "tree")
+            output = os.path.join(workPath, "output")
+            logging.info("Generating %s tree with %s files..." % (scale, size))
+            files, total = makeTree(root, SCALES[scale], large, seed)
+
+            builder = TarballsBuilder(FilePath(root), FilePath(output))
+            builder.documentation = False
+            builder.releaseName = "PyAMF-0.6"
+            builder.docPath = builder.rootDirectory.child("doc")
+            builder.html_docs = builder.docPath.child("_build").child("html")
+            builder.api_docs = builder.html_docs.child("api")
+
+            def record(path, setting, seconds, nbytes=total, count=files):
+                results.append({"scale": scale, "size": size, "path": path,
+                                "setting": setting, "seconds": seconds,
+                                "bytes": nbytes, "files": count})
+                logging.info("\t%-14s %-22s %8.2fs" % (path, setting, seconds))
+
+            def buildManifest():
+                builder.manifest = builder._buildManifest()
+
+            record("manifest", "", _timeIt(buildManifest, repeat))
+
+            done = set()
+            for ext, level, n in settings:
+                n = n or threads
+
+                # one thread per CPU can be the same as a single thread
+                if (ext, level, n) in done:
+                    continue
+                done.add((ext, level, n))
+
+                builder.compression_levels = {ext: level}
+                builder.compression_threads = n
+
+                if not os.path.isdir(output):
+                    os.makedirs(output)
+
+                seconds = _timeIt(lambda: builder._buildPackage([ext]), repeat)
+                record("package", "%s -%d threads=%d" % (ext, level, n),
+                       seconds)
+
+                archive = os.path.join(output, "PyAMF-0.6." + ext)
+                if os.path.exists(archive):
+                    record("md5", "%s -%d threads=%d" % (ext, level, n),
+                           _timeIt(lambda: builder._getMD5(archive), repeat),
+                           os.path.getsize(archive), 1)
+                    os.unlink(archive)
+
+            record("updateVersion", "", _timeIt(
+                lambda: Project(builder.rootDirectory).updateVersion("0.6"),
+                repeat))
+
+            # _clean removes the byte code, run it once on a fresh tree
+            record("clean", "", _timeIt(builder._clean))
+
+            shutil.rmtree(root)
+            shutil.rmtree(output, True)
+
+    return results
+
+
+def packagingMain(args):
+    """
+    Run the packaging benchmark and write the results to a JSON file.
+
+    :type args: list of str
+    :param args: The command line arguments to process.
+    """
+    parser = OptionParser(usage="%prog [options] [REPORT]")
+    parser.add_option("--scales", default="1k,10k", metavar="LIST",
+                      help="number of files of the trees, from %s [%%default]"
+                      % ",".join(sorted(SCALES)))
+    parser.add_option("--sizes", default="small,large", metavar="LIST",
+                      help="small files only, or large files as well "
+                      "[%default]")
+    parser.add_option("--threads", type="int", default=cpu_count(),
+                      metavar="N", help="threads for the multi-threaded "
+                      "compression settings [%default]")
+    parser.add_option("--repeat", type="int", default=3, metavar="N",
+                      help="runs of each path, the best is reported [%default]")
+    parser.add_option("--seed", type="int", default=0,
+                      help="seed for the generated trees [%default]")
+    parser.add_option("--work-dir", dest="workDirectory", metavar="DIR",
+                      help="location of the generated trees, a temporary "
+                      "directory by default")
+    options, args = parser.parse_args(args)
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    workPath = mkdtemp(dir=options.workDirectory)
+    try:
+        results = benchmarkPackaging(workPath, options.scales.split(","),
+                                     options.sizes.split(","),
+                                     threads=options.threads,
+                                     repeat=options.repeat, seed=options.seed)
+    finally:
+        shutil.rmtree(workPath, True)
+
+    logging.info("")
+    logging.info("%-5s %-6s %-14s %-24s %9s %10s %12s" % ("Scale", "Size",
+                 "Path", "Setting", "Seconds", "MB/s", "Files/s"))
+
+    for result in results:
+        seconds = max(result["seconds"], 1e-9)
+        result["mbPerSecond"] = result["bytes"] / 1048576.0 / seconds
+        result["filesPerSecond"] = result["files"] / seconds
+        logging.info("%-5s %-6s %-14s %-24s %9.3f %10.1f %12.0f" % (
+                     result["scale"], result["size"], result["path"],
+                     result["setting"], result["seconds"],
+                     result["mbPerSecond"], result["filesPerSecond"]))
+
+    report = {"commit": _getCommit(), "python": sys.version.split()[0],
+              "platform": platform.platform(), "cpus": cpu_count(),
+              "seed": options.seed, "repeat": options.repeat,
+              "threads": options.threads, "results": results}
+
+    if args:
+        fd = open(args[0], "wb")
+        try:
+            json.dump(report, fd, indent=1, sort_keys=True)
+        finally:
+            fd.close()
+        logging.info("")
+        logging.info("Report: %s" % args[0])
+
+
+def compressionMain(args):
+    """
+    Run the compression benchmark and log a table with the results.
+
+    :type args: list of str
+    :param args: The command line arguments to process.
+    """
+    parser = OptionParser(usage="%prog [options] [FILE]")
+    parser.add_option("--size", type="int", default=32, metavar="MB",
+                      help="size of the generated data [%default]")
+    parser.add_option("--threads", type="int", default=cpu_count(),
+                      metavar="N", help="threads for the multi-threaded "
+                      "backends [%default]")
+    parser.add_option("--seed", type="int", default=0,
+                      help="seed for the generated data [%default]")
+    options, args = parser.parse_args(args)
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    if args:
+        # eg. an uncompressed release tarball
+        fd = open(args[0], "rb")
+        try:
+            data = fd.read()
+        finally:
+            fd.close()
+    else:
+        data = makeData(options.size * 1024 * 1024, options.seed)
+
+    logging.info("Compressing %s..." % sizeof_fmt(len(data)))
+    logging.info("")
+    logging.info("%-6s %-24s %7s %9s %10s %7s %8s" % ("Type", "Backend",
+                 "Threads", "Seconds", "MB/s", "Ratio", "Speedup"))
+
+    for result in benchmarkCompression(data, threads=options.threads):
+        logging.info("%-6s %-24s %7d %9.2f %10.1f %6.1f%% %7.2fx" % (
+                     result["suffix"], result["backend"], result["threads"],
+                     result["seconds"],
+                     len(data) / 1048576.0 / max(result["seconds"], 1e-9),
+                     100.0 * result["size"] / max(len(data), 1),
+                     result["speedup"]))
+
+
+if __name__ == "__main__":
+    packagingMain(sys.argv[1:])
@@ -7,25 +7,41 @@ Buildbot utils.
 
 import re
 import os
+from fnmatch import fnmatch
+from itertools import combinations
 
 try:
     from buildbot.process.factory import BuildFactory
     from buildbot.process.properties import WithProperties
     from buildbot.status.builder import SUCCESS, FAILURE
-    from buildbot.steps.shell import Compile, Test, ShellCommand
+    from buildbot.steps.shell import Compile, Test, ShellCommand, SetProperty
     from buildbot.steps.master import MasterShellCommand
     from buildbot.steps.transfer import FileDownload, FileUpload
     from buildbot.steps.python import PyFlakes
 except ImportError:
     raise ImportError('This script requires Buildbot 0.7.11 or newer')
 
+from release.builds.libcache import getChecksum
+from release.builds.results import UnitTest
+
+
+#: Directory of the scripts that are downloaded to the buildslaves.
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
 
 class Builder(object):
     """
     Builder.
+
+    @cvar libraryCache: Location of the library cache on the buildslaves.
+    @cvar libraryCacheSize: Maximum size of the library cache, in MB.
     """
 
-    def __init__(self, name, slaveName, scm_step=None, os=None, **kwargs):
+    libraryCache = '~/.pyamf-libraries'
+    libraryCacheSize = 512
+
+    def __init__(self, name, slaveName, scm_step=None, os=None, testWorkers=1,
+                 **kwargs):
         """
         @param name: Name of the builder.
         @type name: C{str}
@@ -35,14 +51,18 @@ class Builder(object):
         @type scm_step: L{buildbot.steps.source.*}
         @param os: String containing the operating system name.
         @type os: C{str}
+        @param testWorkers: Number of processes that run the unit tests.
+        @type testWorkers: C{int}
         """
         self.name = name
         self.slaveName = slaveName
         self.scm_step = scm_step
-        self.version = '%s.%s' % (slaveName[-2], slaveName[-1])
+        self.version = getPythonVersion(slaveName)
         self.os = os
         self.command = []
         self.factory = BuildFactory()
+        self.testWorkers = testWorkers
+        self.scripts = {}
 
         ext = ""
         if self.extension:
@@ -88,15 +108,23 @@ class Builder(object):
         self.factory.addStep(step)
 
 
-    def setup_step(self, action, **buildstep_kwargs):
+    def setup_step(self, action, label=None, **buildstep_kwargs):
         """
         Create Python setuptools step.
 
-        @param action: One of: build, install, test
+        @param action: One of: build, build_ext, install, test
         @type action: C{str}
+        @param label: Added to the step name, for builders that run the
+            same action more than once.
+        @type label: C{str}
         """
         self.stepName = 'python%s-%s' % (self.version, action)
         self.descriptionDone = 'python%s %s' % (self.version, action)
+
+        if label is not None:
+            self.stepName += '-' + label
+            self.descriptionDone += ' ' + label
+
         self.command = getInterpreter(self.os, self.version) + ['./setup.py', action] + self.command
 
         if self.ext is not True:
@@ -107,7 +135,7 @@ class Builder(object):
 
     def decompress(self, file, **buildstep_kwargs):
         """
-        Decompress a tar file.
+        Decompress a tar file, in the C{workdir} of the step if given.
 
         @param file: Name of the tarball file.
         @type file: C{str}
@@ -117,7 +145,7 @@ class Builder(object):
         self.type = ShellCommand
         self.stepName = 'Decompressing %s' % file
         self.descriptionDone = 'Decompressed %s' % file
-        self.command = ['tar', 'xvf', file]
+        self.command = ['tar', 'xf', file]
         
         return self.slave_step(**buildstep_kwargs)
 
@@ -153,12 +181,15 @@ class Builder(object):
         return self.slave_step(**buildstep_kwargs)
 
 
-    def compile(self, ext=False, **buildstep_kwargs):
+    def compile(self, ext=False, inplace=False, **buildstep_kwargs):
         """
         Build the code.
         
         @param ext: Enable C-extension build.
         @type ext: C{bool}
+        @param inplace: Build the C-extension next to the sources, so the
+            test steps that follow find it up to date.
+        @type inplace: C{bool}
         """
         self.type = Compile
         self.ext = ext
@@ -166,24 +197,55 @@ class Builder(object):
         self.descriptionDone = 'Compiled code'
         self.command = []
 
+        if inplace and ext:
+            self.command = ['--inplace']
+
+            return self.setup_step('build_ext', **buildstep_kwargs)
+
         return self.setup_step('build', **buildstep_kwargs)
 
 
-    def test(self, ext=False, **buildstep_kwargs):
+    def test(self, ext=False, label=None, **buildstep_kwargs):
         """
         Test the code.
+
+        With more than one L{testWorkers} the suite is run by C{runtests.py}
+        in that many processes, balanced by the durations of earlier runs;
+        the C-extension must then be built in place. The runner writes a
+        JUnit XML report with the result and duration of every test, that is
+        added to the build by L{UnitTest}.
         
         @param ext: Enable C-extension build.
         @type ext: C{bool}
+        @param label: Added to the step name, eg. the library tested.
+        @type label: C{str}
         """
-        self.type = Test
+        self.type = UnitTest
         self.ext = ext
         self.stepName = 'Running unit tests'
         self.descriptionDone = 'Completed unit tests'
         self.command = []
-        #step.evaluateCommand = evaluateCommand
 
-        return self.setup_step('test', **buildstep_kwargs)
+        if self.testWorkers > 1:
+            script = self.slave_script('runtests.py')
+            junit = 'test-results.xml'
+
+            self.stepName = 'python%s-test' % self.version
+            self.descriptionDone = 'python%s test' % self.version
+
+            if label is not None:
+                self.stepName += '-' + label
+                self.descriptionDone += ' ' + label
+
+                # every step needs a new file to follow
+                junit = 'test-results-%s.xml' % re.sub(r'\W', '_', label)
+
+            self.command = getInterpreter(self.os, self.version) + [script,
+                '--workers=%d' % self.testWorkers, '--junit=' + junit]
+
+            return self.slave_step(junit=junit, **buildstep_kwargs)
+
+        return self.setup_step('test', label, **buildstep_kwargs)
 
 
     def install(self, dest, ext=False, **buildstep_kwargs):
@@ -276,6 +338,71 @@ class Builder(object):
         self.factory.addStep(FileDownload(mastersrc=src, slavedest=dest, **buildstep_kwargs))
 
 
+    def cache_library(self, src, **buildstep_kwargs):
+        """
+        Put a library in place through the library cache of the buildslave.
+
+        The slave looks the tarball up by its SHA-1 first; it is only
+        transferred and unpacked when it isn't cached. Without a checksum,
+        when the tarball isn't on the master yet, it is unpacked in
+        C{lib/<label>} in the build directory.
+
+        @param src: Location of the library tarball on the master.
+        @type src: C{str}
+        @return: Location of the unpacked library, for the C{PYTHONPATH}.
+        """
+        dest = os.path.basename(src)
+        label = dest.split('.tar')[0]
+
+        try:
+            checksum = getChecksum(src)
+        except IOError:
+            print "Library %s not found, not caching it" % src
+
+            path = 'lib/' + label
+            self.download(src, path + '/' + dest)
+            self.decompress(dest, workdir='build/' + path, **buildstep_kwargs)
+
+            return path
+
+        prop = 'library_' + re.sub(r'\W', '_', label)
+        script = self.slave_script('libcache.py')
+        command = getInterpreter(self.os, self.version) + [script,
+                  '--cache-dir=' + self.libraryCache,
+                  '--cache-size=%d' % self.libraryCacheSize]
+        missing = lambda step, prop=prop: not step.getProperty(prop)
+
+        self.factory.addStep(SetProperty(name='lookup %s' % label,
+                                         command=command + ['lookup', label,
+                                                            checksum],
+                                         property=prop, **buildstep_kwargs))
+        self.download(src, dest, doStepIf=missing)
+        self.factory.addStep(SetProperty(name='unpack %s' % label,
+                                         command=command + ['store', label,
+                                                            checksum, dest],
+                                         property=prop, doStepIf=missing,
+                                         **buildstep_kwargs))
+
+        return WithProperties('%(' + prop + ')s')
+
+
+    def slave_script(self, name):
+        """
+        Download one of the scripts in L{SCRIPTS_DIR} to the buildslave,
+        once per build.
+
+        @param name: File name of the script.
+        @type name: C{str}
+        @return: Location of the script on the buildslave.
+        @rtype: C{str}
+        """
+        if name not in self.scripts:
+            self.scripts[name] = name
+            self.download(os.path.join(SCRIPTS_DIR, name), name)
+
+        return self.scripts[name]
+
+
     def pyflakes(self, src, **buildstep_kwargs):
         """
         Run pyflakes on a Python package or module.
@@ -295,7 +422,7 @@ class Builder(object):
         """
         Checkout the code.
         """
-        self.factory.addStep(self.scm)
+        self.factory.addStep(self.scm_step)
 
 
 class LibraryBuilder(Builder):
@@ -313,12 +440,14 @@ class LibraryBuilder(Builder):
         @param version:
         """
         self.src = src
-        self.version = version
         self.slave = slave
         self.extension = extension
 
         Builder.__init__(self, name, slave, scm, slave, **kwargs)
 
+        # Builder uses version for the Python version
+        self.libraryVersion = version
+
 
     def start(self, **kwargs):
         """
@@ -329,66 +458,206 @@ class LibraryBuilder(Builder):
         # Checkout source code
         self.checkout()
        
-        # grab the library and unpack it
-        dest = os.path.filename(self.src % self.version)
-        self.download(self.src % self.version, dest)
-        self.unpack_library(dest)
-
-        # run the build
-        self.compile(self.extension)
-        self.test(self.extension)
+        # grab the library from the cache of the slave
+        path = self.cache_library(self.src % self.libraryVersion)
+
+        # run the build, parallel tests import the extension in place
+        self.compile(self.extension, inplace=self.testWorkers > 1)
+        self.test(self.extension, env={'PYTHONPATH': path})
         self.install('./install')
 
         return Builder.start(self, **kwargs)
 
 
-    def unpack_library(self, src, **buildstep_kwargs):
+class LibrarySuiteBuilder(Builder):
+    """
+    Compile PyAMF once and test it against several library versions.
+
+    Only the third-party library differs between the tests, so the
+    C-extension is built in place and installed once, and every library
+    version is taken from the library cache of the slave and put on the
+    C{PYTHONPATH} of its test step.
+    """
+
+    def __init__(self, name, slave, scm, extension, libraries, **kwargs):
         """
-        Put library source files in place on the buildslave.
+        @param name: Name of the builder.
+        @type name: C{str}
+        @param slave: Name of the buildslave.
+        @type slave: C{str}
+        @param scm: Source control buildstep.
+        @type scm: L{buildbot.steps.source.*}
+        @param extension: Enable C-extension build.
+        @type extension: C{bool}
+        @param libraries: L{Library} and version tuples to test against.
+        @type libraries: C{list}
+        """
+        self.slave = slave
+        self.extension = extension
+        self.libraries = libraries
+
+        Builder.__init__(self, name, slave, scm, slave, **kwargs)
 
-        @param src: Location of the library tarball.
-        @type src: C{src}
+
+    def start(self, **kwargs):
         """
-        self.stepName = 'unpack-%s-%s' % (self.name, self.version)
-        self.descriptionDone = 'Unpacked %s %s' % (self.name, self.version)
+        Run the builder.
+        
+        @return: Add the buildsteps and return the builder dict.
+        """
+        # Checkout source code
+        self.checkout()
+
+        # the only compile, the tests find the extension up to date
+        self.compile(self.extension, inplace=True)
+
+        # the install doesn't depend on the library, check it once
+        self.install('./install', self.extension)
+
+        for lib, version in self.libraries:
+            label = '%s-%s' % (lib.name, version)
+
+            # grab the library from the cache of the slave
+            path = self.cache_library(lib.src % version)
 
-        return self.decompress(src, **buildstep_kwargs)
+            self.test(self.extension, label, env={'PYTHONPATH': path})
+
+        return Builder.start(self, **kwargs)
 
 
 class Library(object):
     """
+    Third-party library that PyAMF is tested against.
     """
 
-    def __init__(self, name, src, versions, slaves, extension=True):
+    def __init__(self, name, src, versions, slaves, extension=True,
+                 include=None, exclude=None, cost=1.0):
         """
+        @param name: Name of the library.
+        @type name: C{str}
+        @param src: Location of the library tarballs on the master, with a
+            C{%s} for the version.
+        @type src: C{str}
+        @param versions: Versions of the library to test.
+        @type versions: C{list}
+        @param slaves: Names of the buildslaves to test on.
+        @type slaves: C{list}
+        @param extension: Also test without the C-extension.
+        @type extension: C{bool}
+        @param include: Only build combinations that match one of these
+            rules, see L{matchRule}.
+        @type include: C{list}
+        @param exclude: Never build combinations that match one of these
+            rules.
+        @type exclude: C{list}
+        @param cost: Estimated duration of a build, relative to the other
+            libraries.
+        @type cost: C{float}
         """
         self.name = name
         self.extension = extension
         self.src = src
         self.slaves = slaves
         self.versions = versions
+        self.include = include or []
+        self.exclude = exclude or []
+        self.cost = cost
+
+
+    def getCombinations(self):
+        """
+        Every build of the library, before any rule is applied.
+
+        @return: A C{dict} for each build with the C{library}, C{version},
+            C{slave}, C{platform}, C{python} and C{ext} axes.
+        @rtype: C{list}
+        """
+        combinations = []
+
+        for slave in self.slaves:
+            for version in self.versions:
+                exts = [True]
+
+                # add a pure python build if extension is enabled
+                if self.extension is True:
+                    exts.append(False)
+
+                for ext in exts:
+                    combinations.append({'library': self.name,
+                                         'version': version,
+                                         'slave': slave,
+                                         'platform': getPlatform(slave),
+                                         'python': getPythonVersion(slave),
+                                         'ext': ext})
+
+        return combinations
 
 
 class BuildFarm(object):
     """
     Collection of build slaves.
+
+    With C{coverage='pairwise'} the full matrix of library versions,
+    interpreters, platforms and C-extension settings is reduced to a set of
+    builds in which every pair of values of the C{axes} is tested at least
+    once, so every library version and interpreter is still covered. Axes
+    that are left out are not distinguished: a build can then run on any
+    slave that matches its values, and the builds are spread over those
+    slaves by estimated cost.
     """
 
-    def __init__(self, name, libraries, scm, distFolder, webFolder, libFolder):
+    #: Axes of the build matrix.
+    axes = ('version', 'python', 'platform', 'ext')
+
+    #: Cost of a build with the C-extension, relative to a pure Python one.
+    extensionCost = 2.0
+
+    def __init__(self, name, libraries, scm, distFolder, webFolder, libFolder,
+                 include=None, exclude=None, coverage='full', axes=None,
+                 shareCompile=False, testWorkers=1):
         """
         @param libraries: List of L{Library} instances
         @type libraries: C{list}
         @param scm: SCM system
         @type scm: C{buildbot.steps.source.*}
-        """
+        @param include: Only build combinations that match one of these
+            rules, for all libraries. See L{matchRule}.
+        @type include: C{list}
+        @param exclude: Never build combinations that match one of these
+            rules.
+        @type exclude: C{list}
+        @param coverage: C{full} for every combination, C{pairwise} for
+            pairwise coverage of the C{axes}.
+        @type coverage: C{str}
+        @param axes: Axes that distinguish builds, defaults to L{axes}.
+        @type axes: C{tuple}
+        @param shareCompile: Create one L{LibrarySuiteBuilder} per slave and
+            C-extension setting, that compiles once and tests all library
+            versions, instead of a L{LibraryBuilder} for each build.
+        @type shareCompile: C{bool}
+        @param testWorkers: Number of processes that run the unit tests, or
+            a C{dict} with the number for each slave.
+        @type testWorkers: C{int} or C{dict}
+        """
+        if coverage not in ('full', 'pairwise'):
+            raise ValueError('Unknown coverage %r' % (coverage,))
+
         self.name = name
         self.libraries = libraries
         self.scm = scm
         self.distFolder = distFolder
         self.webFolder = webFolder
         self.libFolder = libFolder
+        self.include = include or []
+        self.exclude = exclude or []
+        self.coverage = coverage
+        self.shareCompile = shareCompile
+        self.testWorkers = testWorkers
         self.builders = []
 
+        if axes is not None:
+            self.axes = tuple(axes)
+
         print 80 * "="
         print self.name
         print 80 * "="
@@ -402,31 +671,227 @@ class BuildFarm(object):
         print "\nTHIRD-PARTY LIBRARIES\n"
         self.header()
 
+        total = 0
+        builds = []
+
         for lib in self.libraries:
-            # create process on selected slaves
-            for slave in lib.slaves:
-                # run a build on every version of the library
-                for version in lib.versions:
-                    self.addSlave(lib, version, slave)
-                    
-                    # add a pure python build if extension is enabled
-                    if lib.extension is True:
-                        self.addSlave(lib, version, slave, False)
+            matrix = lib.getCombinations()
+            total += len(matrix)
+
+            candidates = [c for c in matrix
+                          if self.accepts(c, lib.include, lib.exclude)]
+
+            builds.extend(self.select(lib, candidates))
+
+        loads = self.assignSlaves(builds)
+
+        if self.shareCompile:
+            self.addSuites(builds)
+        else:
+            for build in builds:
+                lib = build['lib']
+                self.addSlave(lib, build['version'], build['slave'],
+                              build['ext'])
+
+        print 80 * "-"
+        print "%d of %d builds in %d builders, estimated cost per " \
+              "buildslave:" % (len(builds), total, len(self.builders))
+
+        for slave in sorted(loads):
+            print "  %-20s %6.1f" % (slave, loads[slave])
 
         print 80 * "-"
 
         return self.builders
 
+
+    def accepts(self, combination, include=(), exclude=()):
+        """
+        Check a combination against the rules of a library and the farm.
+
+        @param combination: A build, see L{Library.getCombinations}.
+        @type combination: C{dict}
+        @rtype: C{bool}
+        """
+        for rules in (include, self.include):
+            if rules and not [r for r in rules if matchRule(r, combination)]:
+                return False
+
+        for rule in list(exclude) + self.exclude:
+            if matchRule(rule, combination):
+                return False
+
+        return True
+
+
+    def getCost(self, lib, ext):
+        """
+        Estimated cost of a build.
+
+        @param lib: The library.
+        @type lib: L{Library}
+        @param ext: Build the C-extension.
+        @type ext: C{bool}
+        @rtype: C{float}
+        """
+        if ext:
+            return lib.cost * self.extensionCost
+
+        return lib.cost
+
+
+    def select(self, lib, candidates):
+        """
+        Pick the builds of a library from the accepted combinations.
+
+        Combinations with the same values on all C{axes} are merged into one
+        build that may run on any of their slaves. For pairwise coverage the
+        builds are then chosen greedily: each time the build that covers the
+        most pairs not covered yet, the cheapest one on a tie, the first one
+        in the configuration order after that.
+
+        @param lib: The library.
+        @type lib: L{Library}
+        @param candidates: Accepted combinations of the library.
+        @type candidates: C{list}
+        @return: A C{dict} for each build, with the candidate C{slaves}.
+        @rtype: C{list}
+        """
+        groups = {}
+        builds = []
+
+        for combination in candidates:
+            key = tuple([combination[axis] for axis in self.axes])
+
+            if key not in groups:
+                build = dict(combination)
+                build['lib'] = lib
+                build['slaves'] = []
+                build['cost'] = self.getCost(lib, combination['ext'])
+                groups[key] = build
+                builds.append(build)
+
+            groups[key]['slaves'].append(combination['slave'])
+
+        if self.coverage == 'full':
+            return builds
+
+        size = min(2, len(self.axes))
+
+        def getPairs(build):
+            values = [(axis, build[axis]) for axis in self.axes]
+            return set(combinations(values, size))
+
+        pairs = [getPairs(build) for build in builds]
+        uncovered = set().union(*pairs)
+        selected = []
+
+        while uncovered:
+            best = None
+
+            for i, build in enumerate(builds):
+                score = (len(pairs[i] & uncovered), -build['cost'])
+
+                if best is None or score > best[0]:
+                    best = (score, i)
+
+            uncovered -= pairs[best[1]]
+            selected.append(best[1])
+
+        return [builds[i] for i in sorted(selected)]
+
+
+    def assignSlaves(self, builds):
+        """
+        Run each build on one of its candidate slaves, balancing the
+        estimated cost per slave.
+
+        The builds are assigned most expensive first, each to the least
+        loaded of its slaves (longest processing time first). Ties are
+        broken by the configuration order, so the assignment only changes
+        when the configuration does.
+
+        @param builds: Builds returned by L{select}, updated with the
+            C{slave} they run on.
+        @type builds: C{list}
+        @return: Estimated cost for each slave.
+        @rtype: C{dict}
+        """
+        loads = {}
+
+        for build in builds:
+            for slave in build['slaves']:
+                loads.setdefault(slave, 0.0)
+
+        order = sorted(range(len(builds)), key=lambda i: -builds[i]['cost'])
+
+        for i in order:
+            build = builds[i]
+            slave = min(build['slaves'], key=lambda s: loads[s])
+            build['slave'] = slave
+            build['platform'] = getPlatform(slave)
+            loads[slave] += build['cost']
+
+        return loads
+
     
     def addSlave(self, lib, version, slave, ext=True):
         """
+        Add a builder that tests a library version on a slave.
         """
-        name = '%s-%s' % (lib.name, version)
-        builder = LibraryBuilder(name, slave, self.scm,
-                                 lib.src, ext, version)
+        name = '%s-%s-%s' % (lib.name, version, slave)
+
+        if not ext:
+            name += '-pure'
+
+        builder = LibraryBuilder(name, slave, self.scm, lib.src, ext, version,
+                                 testWorkers=self.getTestWorkers(slave))
         self.builders.append(builder)
 
 
+    def addSuites(self, builds):
+        """
+        Add a builder for each slave and C-extension setting that tests all
+        the library versions assigned to it.
+
+        @param builds: Builds returned by L{assignSlaves}.
+        @type builds: C{list}
+        """
+        suites = {}
+        order = []
+
+        for build in builds:
+            key = (build['slave'], build['ext'])
+
+            if key not in suites:
+                suites[key] = []
+                order.append(key)
+
+            suites[key].append((build['lib'], build['version']))
+
+        for slave, ext in order:
+            name = '%s-libraries' % slave
+
+            if not ext:
+                name += '-pure'
+
+            builder = LibrarySuiteBuilder(name, slave, self.scm, ext,
+                                          suites[(slave, ext)],
+                                          testWorkers=self.getTestWorkers(slave))
+            self.builders.append(builder)
+
+
+    def getTestWorkers(self, slave):
+        """
+        @return: Number of test processes on a slave.
+        @rtype: C{int}
+        """
+        if isinstance(self.testWorkers, dict):
+            return self.testWorkers.get(slave, 1)
+
+        return self.testWorkers
+
+
     def header(self):
         print 80 * "-"
         print "%-25s %-20s %-10s %-10s" % (
@@ -434,6 +899,52 @@ class BuildFarm(object):
         print 80 * "-"
 
 
+def matchRule(rule, combination):
+    """
+    Check if a build matches a rule.
+
+    A rule is a C{dict} that maps axes to values, eg.
+    C{{'platform': 'winxp32', 'version': '0.4.*'}}. String values are
+    C{fnmatch} patterns; a build matches when all axes of the rule match.
+
+    @param rule: The rule.
+    @type rule: C{dict}
+    @param combination: A build, see L{Library.getCombinations}.
+    @type combination: C{dict}
+    @rtype: C{bool}
+    """
+    for axis, expected in rule.items():
+        value = combination[axis]
+
+        if isinstance(expected, basestring):
+            if not fnmatch(str(value), expected):
+                return False
+        elif value != expected:
+            return False
+
+    return True
+
+
+def getPlatform(slaveName):
+    """
+    Get the platform of a buildslave, eg. C{ubuntu} for C{ubuntu-py25}.
+
+    @param slaveName: Name of the buildslave.
+    @type slaveName: C{str}
+    """
+    return re.sub(r'-py\d\d$', '', slaveName)
+
+
+def getPythonVersion(slaveName):
+    """
+    Get the Python version of a buildslave, eg. C{2.5} for C{ubuntu-py25}.
+
+    @param slaveName: Name of the buildslave.
+    @type slaveName: C{str}
+    """
+    return '%s.%s' % (slaveName[-2], slaveName[-1])
+
+
 def getInterpreter(os='unix', version='2.5'):
     """
     Get Python or Jython interpreter string.
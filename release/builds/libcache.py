@@ -0,0 +1,236 @@
+# Copyright (c) The PyAMF Project.
+# See LICENSE.txt for details.
+
+"""
+Cache of unpacked third-party libraries on a buildslave.
+
+This script is downloaded to the buildslaves and run with the interpreter
+being tested, so it sticks to what Python 2.3 offers.
+
+Each library tarball is unpacked once, in a directory named after the
+library and the SHA-1 of the tarball, that is put on the C{PYTHONPATH} of
+the test steps. The C{lookup} command prints the directory when the tarball
+is cached, so the master only sends tarballs that are missing; C{store}
+unpacks a downloaded tarball, prints the directory and removes the least
+recently used libraries when the cache grows too big.
+"""
+
+import os
+import sys
+import shutil
+import tarfile
+import tempfile
+from optparse import OptionParser
+
+try:
+    from hashlib import sha1
+except ImportError:
+    from sha import new as sha1
+
+
+#: Default location of the cache.
+CACHE_DIR = '~/.pyamf-libraries'
+
+#: Default maximum size of the cache, in MB.
+CACHE_SIZE = 512
+
+BLOCK_SIZE = 64 * 1024
+
+
+def getChecksum(path):
+    """
+    @return: SHA-1 hex digest of a file.
+    @rtype: C{str}
+    """
+    digest = sha1()
+    fd = open(path, 'rb')
+
+    try:
+        while True:
+            block = fd.read(BLOCK_SIZE)
+            if not block:
+                break
+            digest.update(block)
+    finally:
+        fd.close()
+
+    return digest.hexdigest()
+
+
+def getEntry(cache, label, checksum):
+    """
+    @return: Location of an unpacked library in the cache.
+    @rtype: C{str}
+    """
+    return os.path.join(cache, '%s-%s' % (label, checksum))
+
+
+def getSize(path):
+    """
+    @return: Total size of the files in a directory, in bytes.
+    @rtype: C{int}
+    """
+    size = 0
+
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+
+    return size
+
+
+def unpack(tarball, dest):
+    """
+    Extract a tarball without listing its members.
+
+    @param tarball: Location of the tarball.
+    @type tarball: C{str}
+    @param dest: Target directory.
+    @type dest: C{str}
+    """
+    tar = tarfile.open(tarball, 'r')
+
+    try:
+        for member in tar.getmembers():
+            name = member.name.replace('\\', '/')
+
+            if name.startswith('/') or '..' in name.split('/'):
+                raise ValueError('Unsafe path in %s: %s' % (tarball,
+                                                             member.name))
+
+            tar.extract(member, dest)
+    finally:
+        tar.close()
+
+
+def evict(cache, maxSize, keep):
+    """
+    Remove the least recently used libraries until the cache fits in
+    C{maxSize}.
+
+    @param cache: Location of the cache.
+    @type cache: C{str}
+    @param maxSize: Maximum size in bytes.
+    @type maxSize: C{int}
+    @param keep: Entry that is never removed, the one being used.
+    @type keep: C{str}
+    """
+    entries = []
+    total = 0
+
+    for name in os.listdir(cache):
+        path = os.path.join(cache, name)
+
+        # entries being unpacked start with a dot
+        if name.startswith('.') or not os.path.isdir(path):
+            continue
+
+        size = getSize(path)
+        total += size
+        entries.append((os.stat(path).st_mtime, path, size))
+
+    entries.sort()
+
+    for used, path, size in entries:
+        if total <= maxSize:
+            break
+
+        if path == keep:
+            continue
+
+        sys.stderr.write('Removing %s\n' % path)
+        shutil.rmtree(path, True)
+        total -= size
+
+
+def lookup(cache, label, checksum):
+    """
+    Find a cached library and mark it as used.
+
+    @return: Location of the library, or C{None}.
+    @rtype: C{str}
+    """
+    entry = getEntry(cache, label, checksum)
+
+    if not os.path.isdir(entry):
+        return None
+
+    os.utime(entry, None)
+
+    return entry
+
+
+def store(cache, label, checksum, tarball, maxSize):
+    """
+    Unpack a downloaded library into the cache and remove the tarball.
+
+    @return: Location of the library.
+    @rtype: C{str}
+    """
+    if getChecksum(tarball) != checksum:
+        raise ValueError('Checksum mismatch for %s' % tarball)
+
+    entry = getEntry(cache, label, checksum)
+
+    if not os.path.isdir(entry):
+        tmp = tempfile.mkdtemp(prefix='.%s-' % label, dir=cache)
+
+        try:
+            unpack(tarball, tmp)
+
+            if os.path.isdir(entry):
+                # unpacked by another build in the meantime
+                shutil.rmtree(tmp)
+            else:
+                os.rename(tmp, entry)
+        except:
+            shutil.rmtree(tmp, True)
+            raise
+
+    os.remove(tarball)
+    os.utime(entry, None)
+    evict(cache, maxSize, entry)
+
+    return entry
+
+
+def main(args=None):
+    parser = OptionParser(usage='%prog lookup LABEL SHA1\n'
+                          '       %prog store LABEL SHA1 TARBALL')
+    parser.add_option('--cache-dir', dest='cache', default=CACHE_DIR,
+                      help='location of the cache [default: %s]' % CACHE_DIR)
+    parser.add_option('--cache-size', dest='size', type='int',
+                      default=CACHE_SIZE,
+                      help='maximum size of the cache in MB '
+                           '[default: %d]' % CACHE_SIZE)
+
+    options, args = parser.parse_args(args)
+
+    if not args or (args[0], len(args)) not in (('lookup', 3), ('store', 4)):
+        parser.error('Wrong number of arguments')
+
+    cache = os.path.expanduser(options.cache)
+
+    if not os.path.isdir(cache):
+        os.makedirs(cache)
+
+    if args[0] == 'lookup':
+        entry = lookup(cache, args[1], args[2])
+    else:
+        try:
+            entry = store(cache, args[1], args[2], args[3],
+                          options.size * 1024 * 1024)
+        except ValueError, e:
+            sys.stderr.write('%s\n' % e)
+            sys.exit(1)
+
+    # the output is stored in a build property
+    if entry is not None:
+        sys.stdout.write(entry + '\n')
+
+
+if __name__ == '__main__':
+    main()
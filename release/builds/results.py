@@ -0,0 +1,235 @@
+# Copyright (c) The PyAMF Project.
+# See LICENSE.txt for details.
+
+"""
+Test results of the unit test steps.
+
+The parallel test runner writes a JUnit XML file that is sent to the master
+as a log file of the step and parsed incrementally. Steps that run
+C{setup.py test} only have their output; it is scanned line by line for the
+summary that unittest and trial print at the end.
+"""
+
+import re
+
+try:
+    from xml.etree.cElementTree import iterparse
+except ImportError:
+    from xml.etree.ElementTree import iterparse
+
+try:
+    from buildbot.status.builder import SUCCESS, FAILURE, STDOUT, STDERR
+    from buildbot.status.builder import TestResult
+    from buildbot.steps.shell import Test
+except ImportError:
+    raise ImportError('This script requires Buildbot 0.7.11 or newer')
+
+
+#: Summary of unittest (C{OK}, C{FAILED (failures=1, errors=2)}) and trial
+#: (C{PASSED (successes=3)}, C{FAILED (failures=1, successes=2)}).
+SUMMARY = re.compile(r'^(OK|PASSED|FAILED)(?: \((.*)\))?\s*$')
+
+#: First line of the summary of unittest and trial.
+RAN = re.compile(r'^Ran (\d+) tests? in ')
+
+#: Counts in the summary, eg. C{failures=1}.
+COUNT = re.compile(r'(\w+(?: \w+)?)=(\d+)')
+
+
+class _ChunkReader(object):
+    """
+    File-like object that reads the text of a build log chunk by chunk.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = ''
+
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            try:
+                self.buffer += self.chunks.next()
+            except StopIteration:
+                break
+
+        if size < 0:
+            size = len(self.buffer)
+
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+
+        return data
+
+
+def iterLines(chunks):
+    """
+    Split the text of a build log into lines, without reading it all.
+
+    @param chunks: Text chunks of the log.
+    """
+    rest = ''
+
+    for chunk in chunks:
+        lines = (rest + chunk).split('\n')
+        rest = lines.pop()
+
+        for line in lines:
+            yield line
+
+    if rest:
+        yield rest
+
+
+def parseJUnit(fileobj):
+    """
+    Parse a JUnit XML report incrementally.
+
+    @param fileobj: The report.
+    @return: C{(classname, name, outcome, seconds, details)} for each test.
+    """
+    for event, elem in iterparse(fileobj):
+        if elem.tag != 'testcase':
+            continue
+
+        outcome, details = 'success', ''
+
+        for child in elem:
+            if child.tag in ('failure', 'error', 'skipped'):
+                outcome = child.tag
+                details = child.text or child.get('message', '')
+
+        yield (elem.get('classname', ''), elem.get('name', ''), outcome,
+               float(elem.get('time', 0) or 0), details)
+
+        elem.clear()
+
+
+def parseSummary(lines):
+    """
+    Find the counts in the summary of a unittest or trial run.
+
+    @param lines: Lines of the output.
+    @return: C{(total, failed, passed)}, or C{None} without a summary.
+    @rtype: C{tuple}
+    """
+    ran = summary = None
+
+    for line in lines:
+        match = RAN.match(line)
+        if match is not None:
+            ran = int(match.group(1))
+            continue
+
+        match = SUMMARY.match(line)
+        if match is not None:
+            summary = match
+
+    if summary is None:
+        return None
+
+    counts = dict([(name, int(value)) for name, value in
+                   COUNT.findall(summary.group(2) or '')])
+    failed = counts.get('failures', 0) + counts.get('errors', 0) + \
+             counts.get('unexpected successes', 0)
+
+    if 'successes' in counts:
+        passed = counts['successes']
+        total = ran or passed + failed
+    elif ran is not None:
+        total = ran
+        passed = ran - failed - counts.get('skipped', 0) - \
+                 counts.get('expected failures', 0)
+    else:
+        return None
+
+    return total, failed, passed
+
+
+class UnitTest(Test):
+    """
+    Test step that records the results of every test from a JUnit XML
+    report, or the totals from the summary in its output.
+    """
+
+    def __init__(self, junit=None, **kwargs):
+        """
+        @param junit: Location of the JUnit XML report on the buildslave.
+        @type junit: C{str}
+        """
+        self.junit = junit
+
+        if junit is not None:
+            logfiles = kwargs.setdefault('logfiles', {})
+            logfiles['junit'] = junit
+
+        Test.__init__(self, **kwargs)
+
+        self.addFactoryArguments(junit=junit)
+
+
+    def evaluateCommand(self, cmd):
+        counts = None
+
+        if self.junit is not None:
+            counts = self.addTestResults()
+
+        if counts is None:
+            log = self.getLog('stdio')
+            counts = parseSummary(iterLines(log.getChunks([STDOUT, STDERR],
+                                                          onlyText=True)))
+
+        if counts is None:
+            return Test.evaluateCommand(self, cmd)
+
+        total, failed, passed = counts
+        self.setTestResults(total=total, failed=failed, passed=passed)
+
+        if cmd.rc != 0 or failed:
+            return FAILURE
+
+        return SUCCESS
+
+
+    def addTestResults(self):
+        """
+        Add the result and duration of every test in the JUnit report to
+        the build.
+
+        @return: C{(total, failed, passed)}, or C{None} when the report is
+            missing or broken.
+        """
+        try:
+            log = self.getLog('junit')
+        except KeyError:
+            return None
+
+        total = failed = passed = 0
+        status = self.build.build_status
+        reader = _ChunkReader(log.getChunks([STDOUT], onlyText=True))
+
+        try:
+            for classname, name, outcome, seconds, details in \
+                    parseJUnit(reader):
+                total += 1
+
+                if outcome in ('failure', 'error'):
+                    failed += 1
+                    result = FAILURE
+                elif outcome == 'success':
+                    passed += 1
+                    result = SUCCESS
+                else:
+                    continue
+
+                status.addTestResult(TestResult(
+                    tuple(classname.split('.')) + (name,), result,
+                    [outcome, '%.3fs' % seconds],
+                    details and {'traceback': details} or {}))
+        except SyntaxError:
+            # truncated report, eg. the runner was killed
+            return None
+
+        if not total:
+            return None
+
+        return total, failed, passed
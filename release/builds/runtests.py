@@ -0,0 +1,500 @@
+# Copyright (c) The PyAMF Project.
+# See LICENSE.txt for details.
+
+"""
+Run the PyAMF test suite in several processes on a buildslave.
+
+This script is downloaded to the buildslaves and run with the interpreter
+being tested, so it sticks to what Python 2.3 offers.
+
+The suite is split by test class over the worker processes, longest classes
+first to the least loaded worker, using the durations of earlier runs. The
+results are merged into one report that ends with the summary line of
+Twisted's trial runner, eg. C{FAILED (failures=1, errors=0, successes=99)},
+which the buildbot test steps parse, and the result and duration of every
+test can be written to a JUnit XML report.
+"""
+
+import os
+import sys
+import time
+import pickle
+import shutil
+import tempfile
+import unittest
+import traceback
+from optparse import OptionParser
+from xml.sax.saxutils import escape, quoteattr
+
+
+#: Suite that `setup.py test` runs.
+TEST_SUITE = 'pyamf.tests.get_suite'
+
+#: Durations of the test classes in earlier runs, relative to the build
+#: directory, which is replaced by every checkout.
+TIMINGS = os.path.join(os.pardir, 'test-timings.txt')
+
+#: Estimated duration of a test class that hasn't run before, in seconds.
+DEFAULT_DURATION = 1.0
+
+
+def loadSuite(name):
+    """
+    Import a test suite, or a callable that returns one, by dotted name.
+    """
+    i = name.rfind('.')
+    module, attr = name[:i], name[i + 1:]
+    obj = getattr(__import__(module, {}, {}, [attr]), attr)
+
+    if callable(obj):
+        obj = obj()
+
+    return obj
+
+
+def flatten(suite, tests=None):
+    """
+    @return: The test cases in a suite, in order.
+    @rtype: C{list}
+    """
+    if tests is None:
+        tests = []
+
+    if hasattr(suite, '_tests'):
+        for test in suite._tests:
+            flatten(test, tests)
+    else:
+        tests.append(suite)
+
+    return tests
+
+
+def getUnit(test):
+    """
+    @return: The name of the class of a test, the unit that is distributed
+        over the workers.
+    @rtype: C{str}
+    """
+    klass = test.__class__
+
+    return '%s.%s' % (klass.__module__, klass.__name__)
+
+
+class RecordingResult(unittest.TestResult):
+    """
+    Test result that keeps the outcome and duration of every test.
+
+    @ivar records: C{(id, unit, outcome, seconds, details)} for each test.
+    """
+
+    def __init__(self):
+        unittest.TestResult.__init__(self)
+
+        self.records = []
+        self.outcome = None
+        self.details = ''
+        self.started = 0
+
+
+    def startTest(self, test):
+        unittest.TestResult.startTest(self, test)
+
+        self.outcome = 'success'
+        self.details = ''
+        self.started = time.time()
+
+
+    def stopTest(self, test):
+        unittest.TestResult.stopTest(self, test)
+
+        self.records.append((test.id(), getUnit(test), self.outcome,
+                             time.time() - self.started, self.details))
+
+
+    def addFailure(self, test, err):
+        unittest.TestResult.addFailure(self, test, err)
+
+        self.outcome = 'failure'
+        self.details = ''.join(traceback.format_exception(*err))
+
+
+    def addError(self, test, err):
+        unittest.TestResult.addError(self, test, err)
+
+        # errors in class or module fixtures have no test of their own
+        if not hasattr(test, 'id') or not isinstance(test, unittest.TestCase):
+            self.records.append((str(test), getUnit(test), 'error', 0.0,
+                                 ''.join(traceback.format_exception(*err))))
+            return
+
+        self.outcome = 'error'
+        self.details = ''.join(traceback.format_exception(*err))
+
+
+    def addSkip(self, test, reason):
+        self.outcome = 'skip'
+        self.details = reason
+
+
+    def addExpectedFailure(self, test, err):
+        self.outcome = 'expectedFailure'
+
+
+    def addUnexpectedSuccess(self, test):
+        self.outcome = 'unexpectedSuccess'
+
+
+def loadTimings(path):
+    """
+    @return: Duration in seconds for each test class.
+    @rtype: C{dict}
+    """
+    timings = {}
+
+    try:
+        fd = open(path, 'r')
+    except IOError:
+        return timings
+
+    try:
+        for line in fd:
+            try:
+                seconds, unit = line.split(None, 1)
+                timings[unit.strip()] = float(seconds)
+            except ValueError:
+                pass
+    finally:
+        fd.close()
+
+    return timings
+
+
+def saveTimings(path, timings):
+    """
+    Replace the timings file.
+    """
+    tmp = path + '.tmp'
+    units = timings.keys()
+    units.sort()
+
+    fd = open(tmp, 'w')
+
+    try:
+        for unit in units:
+            fd.write('%.3f %s\n' % (timings[unit], unit))
+    finally:
+        fd.close()
+
+    # os.rename doesn't replace files on Windows
+    if os.path.exists(path):
+        os.remove(path)
+
+    os.rename(tmp, path)
+
+
+def partition(units, timings, workers):
+    """
+    Spread the test classes over the workers, longest first to the least
+    loaded worker. Classes without timings get the mean duration.
+
+    @param units: Names of the test classes, in suite order.
+    @type units: C{list}
+    @param timings: Duration of each test class in earlier runs.
+    @type timings: C{dict}
+    @param workers: Number of workers.
+    @type workers: C{int}
+    @return: A list of test classes for each worker.
+    @rtype: C{list}
+    """
+    known = [timings[unit] for unit in units if unit in timings]
+    default = DEFAULT_DURATION
+
+    if known:
+        default = sum(known) / len(known)
+
+    # decorated, so units with the same duration keep the suite order
+    order = [(-timings.get(unit, default), i, unit)
+             for i, unit in enumerate(units)]
+    order.sort()
+
+    shards = [[] for i in range(workers)]
+    loads = [0.0] * workers
+
+    for duration, i, unit in order:
+        worker = loads.index(min(loads))
+        shards[worker].append((i, unit))
+        loads[worker] -= duration
+
+    # run the classes of each worker in suite order
+    for shard in shards:
+        shard.sort()
+
+    return [[unit for i, unit in shard] for shard in shards]
+
+
+def quoteArgument(arg):
+    """
+    Quote an argument for C{os.spawnv}, which joins the arguments with
+    spaces on Windows, following the rules of the Microsoft C runtime.
+
+    @return: The argument, quoted when it is empty or has whitespace or
+        double quotes.
+    @rtype: C{str}
+    """
+    if arg and not [c for c in arg if c in ' \t"']:
+        return arg
+
+    result = []
+    backslashes = 0
+
+    for c in arg:
+        if c == '\\':
+            backslashes += 1
+            continue
+
+        if c == '"':
+            # backslashes before a quote are escaped, and the quote too
+            result.append('\\' * (backslashes * 2 + 1) + c)
+        else:
+            result.append('\\' * backslashes + c)
+
+        backslashes = 0
+
+    # the closing quote follows, so trailing backslashes are escaped
+    result.append('\\' * (backslashes * 2))
+
+    return '"%s"' % ''.join(result)
+
+
+def runWorker(suiteName, unitsFile, output):
+    """
+    Run the tests of some classes and pickle their records to C{output}.
+    """
+    fd = open(unitsFile, 'r')
+
+    try:
+        units = {}
+        for line in fd:
+            units[line.strip()] = True
+    finally:
+        fd.close()
+
+    tests = [test for test in flatten(loadSuite(suiteName))
+             if getUnit(test) in units]
+
+    result = RecordingResult()
+    unittest.TestSuite(tests).run(result)
+
+    fd = open(output, 'wb')
+
+    try:
+        pickle.dump(result.records, fd, 2)
+    finally:
+        fd.close()
+
+
+def writeJUnit(path, records, elapsed):
+    """
+    Write the results as a JUnit XML report.
+
+    @param path: Location of the report.
+    @type path: C{str}
+    @param records: Records of all tests, see L{RecordingResult}.
+    @type records: C{list}
+    @param elapsed: Duration of the run in seconds.
+    @type elapsed: C{float}
+    """
+    tags = {'failure': 'failure', 'error': 'error',
+            'unexpectedSuccess': 'failure', 'skip': 'skipped'}
+    counts = {}
+
+    for record in records:
+        tag = tags.get(record[2])
+        counts[tag] = counts.get(tag, 0) + 1
+
+    fd = open(path, 'w')
+
+    try:
+        fd.write('<?xml version="1.0" encoding="utf-8"?>\n')
+        fd.write('<testsuite name="pyamf" tests="%d" failures="%d" '
+                 'errors="%d" skipped="%d" time="%.3f">\n' % (len(records),
+                 counts.get('failure', 0), counts.get('error', 0),
+                 counts.get('skipped', 0), elapsed))
+
+        for id, unit, outcome, seconds, details in records:
+            name = id
+
+            if id.startswith(unit + '.'):
+                name = id[len(unit) + 1:]
+
+            fd.write('  <testcase classname=%s name=%s time="%.3f"' % (
+                     quoteattr(unit), quoteattr(name), seconds))
+
+            tag = tags.get(outcome)
+
+            if tag is None:
+                fd.write('/>\n')
+                continue
+
+            if isinstance(details, unicode):
+                details = details.encode('utf-8')
+
+            fd.write('>\n    <%s>%s</%s>\n  </testcase>\n' % (tag,
+                     escape(details), tag))
+
+        fd.write('</testsuite>\n')
+    finally:
+        fd.close()
+
+
+def runParallel(suiteName, workers, timingsFile, junit=None):
+    """
+    Run the suite in worker processes and print the merged results.
+
+    @return: Exit status, 0 when all tests passed.
+    @rtype: C{int}
+    """
+    started = time.time()
+    units = []
+    seen = {}
+
+    for test in flatten(loadSuite(suiteName)):
+        unit = getUnit(test)
+
+        if unit not in seen:
+            seen[unit] = True
+            units.append(unit)
+
+    timings = loadTimings(timingsFile)
+    shards = [shard for shard in partition(units, timings, workers) if shard]
+    # in the build directory, the system temp directory may have spaces
+    tmp = tempfile.mkdtemp(prefix='runtests-', dir=os.getcwd())
+
+    try:
+        processes = []
+
+        for i, shard in enumerate(shards):
+            unitsFile = os.path.join(tmp, 'units-%d.txt' % i)
+            output = os.path.join(tmp, 'results-%d.pickle' % i)
+
+            fd = open(unitsFile, 'w')
+            try:
+                fd.write('\n'.join(shard) + '\n')
+            finally:
+                fd.close()
+
+            args = [sys.executable, os.path.abspath(__file__),
+                    '--suite=' + suiteName, '--worker=' + unitsFile, output]
+
+            if os.name == 'nt':
+                args = [quoteArgument(arg) for arg in args]
+
+            pid = os.spawnv(os.P_NOWAIT, sys.executable, args)
+            processes.append((pid, shard, output))
+
+        records = []
+
+        for pid, shard, output in processes:
+            status = os.waitpid(pid, 0)[1]
+
+            try:
+                fd = open(output, 'rb')
+                try:
+                    records.extend(pickle.load(fd))
+                finally:
+                    fd.close()
+            except (IOError, EOFError):
+                # the worker died, blame all its classes
+                for unit in shard:
+                    records.append((unit, unit, 'error', 0.0,
+                                    'Worker exited with status %d\n' % status))
+    finally:
+        shutil.rmtree(tmp, True)
+
+    elapsed = time.time() - started
+
+    if junit is not None:
+        writeJUnit(junit, records, elapsed)
+
+    return report(records, timings, timingsFile, elapsed)
+
+
+def report(records, timings, timingsFile, elapsed):
+    """
+    Print the failures and the summary of all workers and store the new
+    durations of the test classes.
+
+    @return: Exit status, 0 when all tests passed.
+    @rtype: C{int}
+    """
+    counts = {}
+    durations = {}
+    separator = '=' * 70
+
+    for id, unit, outcome, seconds, details in records:
+        counts[outcome] = counts.get(outcome, 0) + 1
+        durations[unit] = durations.get(unit, 0.0) + seconds
+
+        if outcome in ('failure', 'error'):
+            print separator
+            print '%s: %s' % (outcome.upper(), id)
+            print '-' * 70
+            print details
+
+    timings.update(durations)
+
+    try:
+        saveTimings(timingsFile, timings)
+    except (IOError, OSError), e:
+        sys.stderr.write('Could not save the test timings: %s\n' % e)
+
+    print '-' * 70
+    print 'Ran %d tests in %.3fs' % (len(records), elapsed)
+    print
+
+    failures = counts.get('failure', 0) + counts.get('unexpectedSuccess', 0)
+    errors = counts.get('error', 0)
+    successes = counts.get('success', 0)
+
+    if failures or errors:
+        print 'FAILED (failures=%d, errors=%d, successes=%d)' % (
+            failures, errors, successes)
+
+        return 1
+
+    print 'PASSED (successes=%d)' % successes
+
+    return 0
+
+
+def main(args=None):
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--suite', default=TEST_SUITE,
+                      help='dotted name of the test suite [default: %s]' %
+                           TEST_SUITE)
+    parser.add_option('--workers', type='int', default=2,
+                      help='number of worker processes [default: 2]')
+    parser.add_option('--timings', default=TIMINGS,
+                      help='durations of earlier runs [default: %s]' %
+                           TIMINGS)
+    parser.add_option('--junit', metavar='FILE',
+                      help='write a JUnit XML report to FILE')
+    parser.add_option('--worker', metavar='UNITS',
+                      help='run the test classes listed in UNITS (internal)')
+
+    options, args = parser.parse_args(args)
+
+    # the code under test is in the current directory
+    sys.path.insert(0, os.getcwd())
+
+    if options.worker:
+        runWorker(options.suite, options.worker, args[0])
+
+        return 0
+
+    return runParallel(options.suite, max(1, options.workers),
+                       options.timings, options.junit)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
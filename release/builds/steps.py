@@ -8,44 +8,6 @@ from release.builds import Builder
 from release.builds import ShellCommand
 
 
-def evaluateCommand(cmd):
-    r = Test.evaluateCommand(self, cmd)
-
-    if r is FAILURE:
-        return r
-
-    lines = self.getLog('stdio').readlines()
-
-    re_test_result = re.compile("FAILED \((failures=(\d*), )?(errors=(\d*), )?successes=(\d*)\)")
-
-    mos = map(lambda line: re_test_result.search(line), lines)
-    test_result_lines = [mo.groups() for mo in mos if mo]
-
-    if not test_result_lines:
-        return cmd.rc
-
-    results = test_result_lines[0]
-
-    failures = errors = passed = 0
-
-    if results[1] is not None:
-        failures = int(results[1])
-
-    if results[3] is not None:
-        errors = int(results[3])
-
-    passed = int(results[4])
-
-    if [failures, errors] == [0, 0]:
-        rc = SUCCESS
-    else:
-        rc = FAILURE
-
-    self.setTestResults(total=failures + errors + passed, failed=failures + errors, passed=passed)
-
-    return rc
-
-
 class GAECompile(ShellCommand):
     """
     Google App Engine buildstep.
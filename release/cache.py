@@ -0,0 +1,250 @@
+# Copyright (c) The PyAMF Project.
+# See LICENSE.txt for details.
+
+"""
+Local cache for downloaded source and theme tarballs.
+"""
+
+import os
+import time
+import json
+import logging
+from hashlib import sha256
+from tempfile import mkstemp
+from urllib2 import Request, URLError, HTTPError, urlopen
+
+from release import sizeof_fmt, lockFile
+from release.download import BUFFER_SIZE, ProgressReader
+
+
+__all__ = ["DownloadCache", "OfflineError"]
+
+
+class OfflineError(URLError):
+    """
+    The file isn't cached and the cache is in offline mode.
+    """
+
+
+class DownloadCache(object):
+    """
+    Content-addressed cache of downloads.
+
+    Files are stored once per SHA-256 of their content in `objects/`. The
+    `index.json` file maps each URL to its content hash and to the `ETag`
+    and `Last-Modified` headers, which are used for conditional requests.
+    Least recently used files are evicted when the cache grows over
+    `maxSize`.
+
+    Builds on the same host share the cache, so every fetch holds the
+    `.lock` file of the cache while it reads and updates the index.
+
+    :cvar inUse: Seconds after its last use during which a file is never
+        evicted, another build may still be reading it.
+    :ivar directory: Location of the cache.
+    :ivar maxSize: Maximum size of the cached files in bytes.
+    :ivar offline: Only use cached files, never touch the network.
+    """
+
+    inUse = 3600
+
+    def __init__(self, directory, maxSize=512 * 1024 * 1024, offline=False):
+        self.directory = directory
+        self.maxSize = maxSize
+        self.offline = offline
+        self.indexPath = os.path.join(directory, "index.json")
+        self.lockPath = os.path.join(directory, ".lock")
+
+        objects = os.path.join(directory, "objects")
+        if not os.path.isdir(objects):
+            os.makedirs(objects)
+
+
+    def fetch(self, url):
+        """
+        Get the cached copy of `url`, downloading it when it is missing or
+        has changed on the server.
+
+        :param url: Location of the file.
+        :type url: `str`
+
+        :rtype: `str`
+        :return: Location of the cached file.
+        :raise OfflineError: The file isn't cached and `offline` is set.
+        :raise urllib2.URLError: The file couldn't be downloaded.
+        """
+        lock = lockFile(self.lockPath)
+
+        try:
+            return self._fetch(url)
+        finally:
+            lock.close()
+
+
+    def _fetch(self, url):
+        """
+        Fetch `url` while the cache is locked, see `fetch`.
+        """
+        index = self._loadIndex()
+        record = index.get(url)
+
+        if record is not None and not os.path.exists(self._blobPath(record["sha256"])):
+            record = None
+
+        if self.offline:
+            if record is None:
+                raise OfflineError("%s is not cached" % url)
+
+            logging.info("\tUsing cached copy (offline)")
+            return self._use(index, url, record)
+
+        request = Request(url)
+        if record is not None:
+            if record.get("etag"):
+                request.add_header("If-None-Match", record["etag"])
+            if record.get("lastModified"):
+                request.add_header("If-Modified-Since", record["lastModified"])
+
+        try:
+            response = urlopen(request)
+        except HTTPError, e:
+            if e.code == 304 and record is not None:
+                logging.info("\tUsing cached copy (not modified)")
+                return self._use(index, url, record)
+            raise
+
+        headers = response.info()
+        record = self._store(ProgressReader(response))
+        record["etag"] = headers.get("ETag")
+        record["lastModified"] = headers.get("Last-Modified")
+
+        path = self._use(index, url, record)
+        self._evict(index, keep=record["sha256"])
+
+        return path
+
+
+    def hashes(self):
+        """
+        :rtype: `set`
+        :return: Content hashes of the cached files.
+        """
+        return set([record["sha256"] for record in self._loadIndex().values()])
+
+
+    def _store(self, reader):
+        """
+        Copy a download into the cache, hashing it on the way.
+
+        :rtype: `dict`
+        :return: Index record with the content hash and size.
+        """
+        digest = sha256()
+        fd, tmp = mkstemp(dir=self.directory, suffix=".part")
+
+        try:
+            output = os.fdopen(fd, "wb")
+            try:
+                while True:
+                    chunk = reader.read(BUFFER_SIZE)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    output.write(chunk)
+            finally:
+                output.close()
+                reader.close()
+
+            reader.report()
+            blob = self._blobPath(digest.hexdigest())
+
+            if os.path.exists(blob):
+                # same content under another URL or validator
+                os.unlink(tmp)
+            else:
+                if not os.path.isdir(os.path.dirname(blob)):
+                    os.makedirs(os.path.dirname(blob))
+                os.rename(tmp, blob)
+        except:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+
+        return {"sha256": digest.hexdigest(), "size": reader.bytes}
+
+
+    def _use(self, index, url, record):
+        """
+        Mark `record` as used and save the index.
+        """
+        record["lastUsed"] = time.time()
+        index[url] = record
+        self._saveIndex(index)
+
+        return self._blobPath(record["sha256"])
+
+
+    def _evict(self, index, keep=None):
+        """
+        Remove the least recently used files until the cache fits in
+        `maxSize`.
+        """
+        blobs = {}
+        for url, record in index.items():
+            sha, used = record["sha256"], record.get("lastUsed", 0)
+            blobs[sha] = max(blobs.get(sha, (0, 0))[0], used), record["size"]
+
+        total = sum([size for used, size in blobs.values()])
+        lru = sorted([(used, sha) for sha, (used, size) in blobs.items()])
+        recent = time.time() - self.inUse
+
+        for used, sha in lru:
+            if total <= self.maxSize:
+                break
+            if sha == keep or used > recent:
+                continue
+
+            logging.debug("Evicting %s from cache" % sha)
+            total -= blobs[sha][1]
+            path = self._blobPath(sha)
+            if os.path.exists(path):
+                os.unlink(path)
+
+            for url in [u for u, r in index.items() if r["sha256"] == sha]:
+                del index[url]
+
+        self._saveIndex(index)
+        logging.debug("Cache size: %s" % sizeof_fmt(total))
+
+
+    def _blobPath(self, sha):
+        return os.path.join(self.directory, "objects", sha[:2], sha)
+
+
+    def _loadIndex(self):
+        if not os.path.exists(self.indexPath):
+            return {}
+
+        fd = open(self.indexPath, "rb")
+        try:
+            try:
+                return json.load(fd)
+            except ValueError:
+                logging.warn("Ignoring corrupt cache index: " + self.indexPath)
+                return {}
+        finally:
+            fd.close()
+
+
+    def _saveIndex(self, index):
+        """
+        Replace the index atomically, other builds may be reading it.
+        """
+        fd, tmp = mkstemp(dir=self.directory, suffix=".json")
+        output = os.fdopen(fd, "wb")
+        try:
+            json.dump(index, output, indent=1, sort_keys=True)
+        finally:
+            output.close()
+
+        os.rename(tmp, self.indexPath)
@@ -0,0 +1,133 @@
+# Copyright (c) The PyAMF Project.
+# See LICENSE.txt for details.
+
+"""
+Streaming file checksums.
+"""
+
+import hashlib
+
+
+__all__ = ["ALGORITHMS", "BLOCK_SIZE", "HashingFile", "getChecksums",
+           "getTextChecksums"]
+
+
+#: Digests computed by default.
+ALGORITHMS = ("md5", "sha1", "sha256")
+
+#: Size of the blocks read from disk.
+BLOCK_SIZE = 1024 * 1024
+
+
+def getChecksums(fileName, algorithms=ALGORITHMS, blockSize=BLOCK_SIZE):
+    """
+    Compute several digests of a file in a single pass.
+
+    The file is read in blocks of `blockSize` bytes, so memory use doesn't
+    depend on the size of the file.
+
+    :param fileName: Location of the file.
+    :type fileName: `str`
+    :param algorithms: Names of the `hashlib` algorithms.
+    :type algorithms: `tuple`
+    :param blockSize: Size of the blocks in bytes.
+    :type blockSize: `int`
+
+    :rtype: `dict`
+    :return: Hex digest for each algorithm.
+    :raise IOError: The file can't be read.
+    """
+    digests = [hashlib.new(name) for name in algorithms]
+    fd = open(fileName, "rb")
+
+    try:
+        while True:
+            block = fd.read(blockSize)
+            if not block:
+                break
+            for digest in digests:
+                digest.update(block)
+    finally:
+        fd.close()
+
+    return dict(zip(algorithms, [d.hexdigest() for d in digests]))
+
+
+def getTextChecksums(fileName, excludeLine="", includeLine="",
+                     algorithms=ALGORITHMS):
+    """
+    Compute several digests of a text file in a single pass, skipping lines
+    that start with `excludeLine` and adding `includeLine` at the end.
+
+    :param fileName: Location of the file.
+    :type fileName: `str`
+
+    :rtype: `dict`
+    :return: Hex digest for each algorithm.
+    :raise IOError: The file can't be read.
+    """
+    digests = [hashlib.new(name) for name in algorithms]
+    fd = open(fileName, "rb")
+
+    try:
+        for line in fd:
+            if excludeLine and line.startswith(excludeLine):
+                continue
+            for digest in digests:
+                digest.update(line)
+    finally:
+        fd.close()
+
+    for digest in digests:
+        digest.update(includeLine)
+
+    return dict(zip(algorithms, [d.hexdigest() for d in digests]))
+
+
+class HashingFile(object):
+    """
+    Write-only file wrapper that hashes the bytes on their way to disk, so
+    the checksums of a file are known as soon as it is written.
+
+    :ivar size: Number of bytes written.
+    """
+
+    def __init__(self, fileobj, algorithms=ALGORITHMS):
+        """
+        :param fileobj: File opened for writing.
+        :param algorithms: Names of the `hashlib` algorithms.
+        :type algorithms: `tuple`
+        """
+        self.fileobj = fileobj
+        self.name = getattr(fileobj, "name", None)
+        self.algorithms = algorithms
+        self.digests = [hashlib.new(name) for name in algorithms]
+        self.size = 0
+
+
+    def write(self, data):
+        self.fileobj.write(data)
+        self.size += len(data)
+
+        for digest in self.digests:
+            digest.update(data)
+
+
+    def tell(self):
+        return self.size
+
+
+    def flush(self):
+        self.fileobj.flush()
+
+
+    def close(self):
+        self.fileobj.close()
+
+
+    def getChecksums(self):
+        """
+        :rtype: `dict`
+        :return: Hex digest for each algorithm of the bytes written so far.
+        """
+        return dict(zip(self.algorithms, [d.hexdigest() for d in self.digests]))
@@ -0,0 +1,424 @@
+# Copyright (c) The PyAMF Project.
+# See LICENSE.txt for details.
+
+"""
+Compression backends for release tarballs.
+
+A backend is a write-only file-like object that compresses everything
+written to it into another file. Backends are registered per tarball
+suffix, eg. `gz` for `tar.gz`; backends that use several threads are only
+picked when more than one thread is requested.
+"""
+
+import sys
+import gzip
+import zlib
+from threading import Thread
+from multiprocessing.pool import ThreadPool
+from subprocess import Popen, PIPE
+from distutils.spawn import find_executable
+
+try:
+    import bz2
+except ImportError:
+    bz2 = None
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+
+__all__ = ["Compressor", "GzipCompressor", "BZ2Compressor", "LZMACompressor",
+           "PipeCompressor", "PigzCompressor", "PBzip2Compressor",
+           "XZCompressor", "BlockCompressor", "ParallelGzipCompressor",
+           "ParallelBZ2Compressor", "backends", "register", "getBackend"]
+
+
+class Compressor(object):
+    """
+    Base class for compression backends.
+
+    :cvar threaded: The backend uses more than one thread.
+    """
+
+    threaded = False
+
+    def __init__(self, fileobj, level, threads=1, name=None, mtime=None):
+        """
+        :param fileobj: File the compressed data is written to, it is not
+            closed by `close`.
+        :param level: Compression level.
+        :type level: `int`
+        :param threads: Number of threads the backend may use.
+        :type threads: `int`
+        :param name: Name of the compressed file.
+        :type name: `str`
+        :param mtime: Time stored in the header by formats that have one,
+            the current time when `None`.
+        :type mtime: `int`
+        """
+        self.fileobj = fileobj
+        self.level = level
+        self.threads = threads
+        self.name = name
+        self.mtime = mtime
+
+
+    @classmethod
+    def isAvailable(cls):
+        return True
+
+
+    def write(self, data):
+        raise NotImplementedError
+
+
+    def close(self):
+        """
+        Write the remaining compressed data.
+        """
+        raise NotImplementedError
+
+
+class GzipCompressor(Compressor):
+    """
+    Single-threaded gzip using the `gzip` module.
+    """
+
+    def __init__(self, fileobj, level=9, threads=1, name=None, mtime=None):
+        Compressor.__init__(self, fileobj, level, threads, name, mtime)
+        self.gzip = gzip.GzipFile(name, "wb", level, fileobj, mtime)
+
+
+    def write(self, data):
+        self.gzip.write(data)
+
+
+    def close(self):
+        self.gzip.close()
+
+
+class BZ2Compressor(Compressor):
+    """
+    Single-threaded bzip2 using the `bz2` module.
+    """
+
+    def __init__(self, fileobj, level=9, threads=1, name=None, mtime=None):
+        Compressor.__init__(self, fileobj, level, threads, name, mtime)
+        self.compressor = bz2.BZ2Compressor(level)
+
+
+    @classmethod
+    def isAvailable(cls):
+        return bz2 is not None
+
+
+    def write(self, data):
+        self.fileobj.write(self.compressor.compress(data))
+
+
+    def close(self):
+        self.fileobj.write(self.compressor.flush())
+
+
+class LZMACompressor(BZ2Compressor):
+    """
+    Single-threaded xz using the `lzma` module, or its `backports.lzma`
+    version on Python 2.
+    """
+
+    def __init__(self, fileobj, level=6, threads=1, name=None, mtime=None):
+        Compressor.__init__(self, fileobj, level, threads, name, mtime)
+        self.compressor = lzma.LZMACompressor(preset=level)
+
+
+    @classmethod
+    def isAvailable(cls):
+        return lzma is not None
+
+
+class PipeCompressor(Compressor):
+    """
+    Compresses with an external program that reads from stdin and writes
+    to stdout, eg. a multi-threaded compressor.
+
+    :cvar program: Name of the executable.
+    """
+
+    threaded = True
+    program = None
+    bufferSize = 64 * 1024
+
+    def __init__(self, fileobj, level, threads=1, name=None, mtime=None):
+        Compressor.__init__(self, fileobj, level, threads, name, mtime)
+        self.process = Popen(self.getCommand(), stdin=PIPE, stdout=PIPE)
+        self.error = None
+
+        # copy the compressed data while the program reads its input
+        self.pump = Thread(target=self._pump)
+        self.pump.setDaemon(True)
+        self.pump.start()
+
+
+    @classmethod
+    def isAvailable(cls):
+        return find_executable(cls.program) is not None
+
+
+    def getCommand(self):
+        """
+        :rtype: `list`
+        :return: The program and its arguments.
+        """
+        raise NotImplementedError
+
+
+    def write(self, data):
+        self._raiseError()
+        self.process.stdin.write(data)
+
+
+    def close(self):
+        self.process.stdin.close()
+        self.pump.join()
+        self.process.wait()
+
+        # a failed write of the output, eg. a full disk, leaves a truncated
+        # file even though the program succeeded
+        self._raiseError()
+
+        if self.process.returncode != 0:
+            raise IOError("%s exited with status %d" % (self.program,
+                                                         self.process.returncode))
+
+
+    def _pump(self):
+        while True:
+            data = self.process.stdout.read(self.bufferSize)
+            if not data:
+                break
+
+            if self.error is not None:
+                # keep reading, so the program doesn't block on a full pipe
+                continue
+
+            try:
+                self.fileobj.write(data)
+            except:
+                self.error = sys.exc_info()
+
+
+    def _raiseError(self):
+        """
+        Raise the exception of a failed write in the pump thread.
+        """
+        if self.error is not None:
+            raise self.error[0], self.error[1], self.error[2]
+
+
+class PigzCompressor(PipeCompressor):
+    """
+    Parallel gzip using `pigz`.
+    """
+
+    program = "pigz"
+
+    def getCommand(self):
+        command = [self.program, "-c", "-%d" % self.level,
+                   "-p", str(self.threads)]
+
+        if self.mtime is not None:
+            # pigz can't store a given time, leave it out
+            command.append("-n")
+
+        return command
+
+
+class PBzip2Compressor(PipeCompressor):
+    """
+    Parallel bzip2 using `pbzip2`.
+    """
+
+    program = "pbzip2"
+
+    def getCommand(self):
+        return [self.program, "-c", "-%d" % self.level, "-p%d" % self.threads]
+
+
+class XZCompressor(PipeCompressor):
+    """
+    Multi-threaded xz using `xz -T`.
+    """
+
+    program = "xz"
+
+    def getCommand(self):
+        return [self.program, "-c", "-%d" % self.level, "-T%d" % self.threads]
+
+
+class BlockCompressor(Compressor):
+    """
+    Splits the data into blocks that are compressed independently on a pool
+    of threads, `zlib` and `bz2` release the GIL while they compress.
+
+    Each block becomes a complete gzip member or bzip2 stream; the blocks
+    are written in order, and readers like `gzip -d` and `tar` decompress
+    the concatenation as a single file.
+
+    :cvar blockSize: Size of the uncompressed blocks in bytes.
+    """
+
+    threaded = True
+    blockSize = 1024 * 1024
+
+    def __init__(self, fileobj, level, threads=1, name=None, mtime=None):
+        Compressor.__init__(self, fileobj, level, threads, name, mtime)
+        self.pool = ThreadPool(threads)
+        self.buffer = []
+        self.buffered = 0
+
+        # blocks being compressed, bounded so memory use stays flat
+        self.pending = []
+        self.maxPending = threads * 2
+
+
+    def write(self, data):
+        self.buffer.append(data)
+        self.buffered += len(data)
+
+        if self.buffered >= self.blockSize:
+            data = "".join(self.buffer)
+            offset = 0
+
+            while len(data) - offset >= self.blockSize:
+                self._submit(data[offset:offset + self.blockSize])
+                offset += self.blockSize
+
+            self.buffer = [data[offset:]]
+            self.buffered = len(data) - offset
+
+
+    def close(self):
+        try:
+            if self.buffered or not self.pending:
+                # an empty input still needs one valid member
+                self._submit("".join(self.buffer))
+                self.buffer = []
+                self.buffered = 0
+
+            while self.pending:
+                self._flush()
+        finally:
+            self.pool.terminate()
+            self.pool.join()
+
+
+    def compressBlock(self, data):
+        """
+        :param data: An uncompressed block.
+        :type data: `str`
+        :rtype: `str`
+        :return: The block as a self-contained compressed stream.
+        """
+        raise NotImplementedError
+
+
+    def _submit(self, block):
+        if len(self.pending) >= self.maxPending:
+            self._flush()
+
+        self.pending.append(self.pool.apply_async(self.compressBlock, (block,)))
+
+
+    def _flush(self):
+        """
+        Write the oldest block, waiting for it when needed.
+        """
+        self.fileobj.write(self.pending.pop(0).get())
+
+
+class ParallelGzipCompressor(BlockCompressor):
+    """
+    Multi-member gzip compressed on a pool of threads. The members have no
+    name and no time in their headers.
+    """
+
+    def compressBlock(self, data):
+        # wbits 31 gives a gzip header and trailer around the deflate data
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, 31)
+
+        return compressor.compress(data) + compressor.flush()
+
+
+class ParallelBZ2Compressor(BlockCompressor):
+    """
+    Concatenated bzip2 streams compressed on a pool of threads.
+
+    Blocks match the bzip2 block size of the compression level, so the
+    output is hardly larger than that of a single stream.
+    """
+
+    def __init__(self, fileobj, level, threads=1, name=None, mtime=None):
+        BlockCompressor.__init__(self, fileobj, level, threads, name, mtime)
+        self.blockSize = level * 100 * 1000
+
+
+    @classmethod
+    def isAvailable(cls):
+        return bz2 is not None
+
+
+    def compressBlock(self, data):
+        return bz2.compress(data, self.level)
+
+
+#: Compression backends for each tarball suffix, in order of preference.
+backends = {
+    "gz": [PigzCompressor, ParallelGzipCompressor, GzipCompressor],
+    "bz2": [PBzip2Compressor, ParallelBZ2Compressor, BZ2Compressor],
+    "xz": [XZCompressor, LZMACompressor],
+}
+
+
+def register(suffix, backend, preferred=False):
+    """
+    Register a compression backend.
+
+    :param suffix: Tarball suffix, eg. `gz`.
+    :type suffix: `str`
+    :param backend: `Compressor` subclass.
+    :param preferred: Try this backend before the registered ones.
+    :type preferred: `bool`
+    """
+    candidates = backends.setdefault(suffix, [])
+
+    if preferred:
+        candidates.insert(0, backend)
+    else:
+        candidates.append(backend)
+
+
+def getBackend(suffix, threads=1):
+    """
+    Pick the backend for a tarball suffix.
+
+    Multi-threaded backends are preferred when `threads` is more than one,
+    single-threaded backends otherwise; either kind is used when it is the
+    only one available.
+
+    :param suffix: Tarball suffix, eg. `gz`.
+    :type suffix: `str`
+    :param threads: Number of threads the backend may use.
+    :type threads: `int`
+
+    :return: `Compressor` subclass or `None` when no backend is available.
+    """
+    candidates = [b for b in backends.get(suffix, []) if b.isAvailable()]
+    preferred = [b for b in candidates if b.threaded == (threads > 1)]
+
+    for backend in preferred + candidates:
+        return backend
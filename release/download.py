@@ -0,0 +1,126 @@
+# Copyright (c) The PyAMF Project.
+# See LICENSE.txt for details.
+
+"""
+Streaming downloads of source and theme tarballs.
+"""
+
+import time
+import logging
+from urllib2 import urlopen
+
+from release import sizeof_fmt
+
+
+__all__ = ["BUFFER_SIZE", "ProgressReader", "download", "openStream"]
+
+
+#: Size of the chunks read from the network and written to disk.
+BUFFER_SIZE = 64 * 1024
+
+
+class ProgressReader(object):
+    """
+    File-like wrapper around a download that logs progress and throughput.
+
+    :ivar total: Size of the download in bytes, `None` when the server
+        doesn't send a `Content-Length` header.
+    :ivar bytes: Number of bytes read so far.
+    """
+
+    def __init__(self, response, interval=2.0):
+        """
+        :param response: Response returned by `urlopen`.
+        :param interval: Seconds between progress messages.
+        :type interval: `float`
+        """
+        self.response = response
+        self.interval = interval
+        self.bytes = 0
+        self.started = self._reported = time.time()
+
+        try:
+            self.total = int(response.info().get("Content-Length"))
+        except (TypeError, ValueError, AttributeError):
+            self.total = None
+
+
+    def read(self, size=-1):
+        data = self.response.read(size)
+        self.bytes += len(data)
+
+        now = time.time()
+        if data and now - self._reported >= self.interval:
+            self._reported = now
+            self.report()
+
+        return data
+
+
+    def report(self):
+        """
+        Log the number of bytes read so far and the throughput.
+        """
+        elapsed = max(time.time() - self.started, 1e-6)
+        done = sizeof_fmt(self.bytes)
+
+        if self.total:
+            done = "%s of %s (%d%%)" % (done, sizeof_fmt(self.total),
+                                        100 * self.bytes / self.total)
+
+        logging.info("\t%s, %s/s" % (done, sizeof_fmt(self.bytes / elapsed)))
+
+
+    def close(self):
+        self.response.close()
+
+
+def openStream(url):
+    """
+    Open `url` for reading in a single pass, eg. by `tarfile` in stream mode.
+
+    :param url: Location of the file.
+    :type url: `str`
+
+    :rtype: `ProgressReader`
+    :raise urllib2.URLError: The file couldn't be opened.
+    """
+    return ProgressReader(urlopen(url))
+
+
+def download(url, path, bufferSize=BUFFER_SIZE):
+    """
+    Download `url` to `path` in chunks of `bufferSize` bytes, so memory
+    use doesn't depend on the size of the download.
+
+    Any URL supported by `urllib2` works, including `file://` URLs.
+
+    :param url: Location of the file.
+    :type url: `str`
+    :param path: Target location on disk.
+    :type path: `str`
+    :param bufferSize: Size of the chunks in bytes.
+    :type bufferSize: `int`
+
+    :rtype: `int`
+    :return: Number of bytes downloaded.
+    :raise urllib2.URLError: The file couldn't be downloaded.
+    """
+    reader = openStream(url)
+
+    try:
+        output = open(path, "wb")
+        try:
+            while True:
+                chunk = reader.read(bufferSize)
+                if not chunk:
+                    break
+                output.write(chunk)
+        finally:
+            output.close()
+    finally:
+        reader.close()
+
+    reader.report()
+
+    return reader.bytes
@@ -0,0 +1,181 @@
+# Copyright (c) The PyAMF Project.
+# See LICENSE.txt for details.
+
+"""
+Timing and resource usage of the release build stages.
+"""
+
+import os
+import sys
+import time
+import json
+import logging
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from release import sizeof_fmt
+
+
+__all__ = ["Recorder", "measure"]
+
+
+def _getIO():
+    """
+    Bytes read and written by this process, from `/proc/self/io` on Linux.
+
+    :rtype: `tuple`
+    """
+    try:
+        fd = open("/proc/self/io", "rb")
+    except IOError:
+        return 0, 0
+
+    try:
+        fields = dict([line.split(":") for line in fd if ":" in line])
+    finally:
+        fd.close()
+
+    return int(fields.get("rchar", 0)), int(fields.get("wchar", 0))
+
+
+def _getUsage():
+    """
+    CPU seconds, peak RSS in bytes and block I/O of this process and its
+    waited for children.
+    """
+    if resource is None:
+        return 0.0, 0, 0, 0
+
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+    # ru_maxrss is in KB on Linux, blocks are 512 bytes
+    return (cpu, max(own.ru_maxrss, children.ru_maxrss) * 1024,
+            children.ru_inblock * 512, children.ru_oublock * 512)
+
+
+class Recorder(object):
+    """
+    Collects the wall time, CPU time, peak RSS and bytes read and written
+    of each build stage.
+
+    Reads and writes of the build process are counted at the system call
+    level, those of child processes like `sphinx-build` at the block level.
+    The peak RSS is the largest of the process and its children so far.
+
+    :ivar stages: A `dict` for each stage, in the order they finished.
+    """
+
+    def __init__(self):
+        self.stages = []
+        self.started = time.time()
+
+
+    @contextmanager
+    def measure(self, name):
+        """
+        Record the code run in a `with` block as stage `name`.
+
+        :param name: Name of the stage, eg. `download`.
+        :type name: `str`
+        """
+        started = time.time()
+        cpu, rss, read, written = _getUsage()
+        ownRead, ownWritten = _getIO()
+
+        try:
+            yield
+        finally:
+            stop = _getUsage()
+            ownStop = _getIO()
+
+            self.stages.append({
+                "name": name, "pid": os.getpid(),
+                "start": started - self.started,
+                "wall": time.time() - started,
+                "cpu": stop[0] - cpu, "maxrss": stop[1],
+                "read": stop[2] - read + ownStop[0] - ownRead,
+                "written": stop[3] - written + ownStop[1] - ownWritten})
+
+
+    def addProcess(self, name, started, rusage):
+        """
+        Record a child process as stage `name`, using the resource usage
+        returned by `os.wait4`.
+
+        :param started: When the process was started, from `time.time()`.
+        :type started: `float`
+        """
+        self.stages.append({
+            "name": name, "pid": os.getpid(),
+            "start": started - self.started,
+            "wall": time.time() - started,
+            "cpu": rusage.ru_utime + rusage.ru_stime,
+            "maxrss": rusage.ru_maxrss * 1024,
+            "read": rusage.ru_inblock * 512,
+            "written": rusage.ru_oublock * 512})
+
+
+    def extend(self, stages):
+        """
+        Add stages recorded by another process, eg. a package worker.
+
+        :param stages: Stages of another `Recorder`.
+        :type stages: `list`
+        """
+        self.stages.extend(stages)
+
+
+    def logSummary(self):
+        """
+        Log a table with all stages.
+        """
+        logging.info("%-48s %9s %9s %10s %10s %10s" % ("Stage", "Wall (s)",
+                     "CPU (s)", "Peak RSS", "Read", "Written"))
+
+        for stage in self.stages:
+            logging.info("%-48s %9.2f %9.2f %10s %10s %10s" % (
+                         stage["name"][:48], stage["wall"], stage["cpu"],
+                         sizeof_fmt(stage["maxrss"]), sizeof_fmt(stage["read"]),
+                         sizeof_fmt(stage["written"])))
+
+        logging.info("%-48s %9.2f" % ("Total", time.time() - self.started))
+
+
+    def writeReport(self, path, **info):
+        """
+        Write the stages to a JSON file.
+
+        :param path: Location of the report.
+        :type path: `str`
+        :param info: Extra keys for the report, eg. the version built.
+        """
+        report = {"started": self.started,
+                  "wall": time.time() - self.started,
+                  "python": sys.version.split()[0],
+                  "argv": sys.argv,
+                  "stages": self.stages}
+        report.update(info)
+
+        fd = open(path, "wb")
+        try:
+            json.dump(report, fd, indent=1, sort_keys=True)
+        finally:
+            fd.close()
+
+
+@contextmanager
+def measure(recorder, name):
+    """
+    Like `Recorder.measure`, doing nothing when `recorder` is `None`.
+    """
+    if recorder is None:
+        yield
+    else:
+        with recorder.measure(name):
+            yield
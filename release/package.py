@@ -6,22 +6,28 @@ Scripts for basic release building in the PyAMF project.
 """
 
 import os, sys
+import time
 import logging
 from glob import glob
-from hashlib import md5
-from time import localtime
-from tempfile import mkdtemp
-from urllib2 import urlopen, HTTPError
-from tarfile import TarFile, CompressionError, open as opentar
-from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED, ZIP_STORED
-try:
-    import zlib
-    compression = ZIP_DEFLATED
-except:
-    compression = ZIP_STORED
+from multiprocessing import Pool
+from tempfile import mkdtemp, TemporaryFile
+from subprocess import Popen, PIPE, STDOUT
+from optparse import OptionParser
+from urllib2 import urlopen, HTTPError, URLError
+from tarfile import open as opentar
 
 from release import Project
-from release import sizeof_fmt
+from release import sizeof_fmt, lockFile
+from release.archive import Manifest, TarWriter, ZipWriter, ZIP_EPOCH
+from release.archive import Filter, DEFAULT_EXCLUDE
+from release.archive import extractStream
+from release.cache import DownloadCache
+from release.checksum import getChecksums, getTextChecksums
+from release.compress import getBackend
+from release.download import download, openStream
+from release.state import BuildState, hashTree
+from release.instrument import Recorder, measure
+from release.staging import makeWorkDirectory, TreeCache, cloneTree
 
 from twisted.python.filepath import FilePath
 from twisted.python._release import runCommand, CommandFailed
@@ -31,6 +37,107 @@ from twisted.python._release import DistributionBuilder as TwistedDistributionBu
 logging.basicConfig(level=logging.INFO,
                format='%(message)s')
 
+#: Compression levels each archive type accepts; bzip2 has no level 0.
+COMPRESSION_LEVELS = {"tar.gz": (0, 9), "tar.bz2": (1, 9), "tar.xz": (0, 9),
+                      "zip": (0, 9)}
+
+
+def startCommand(args, cwd=None, env=None):
+    """
+    Start a command without waiting for it, unlike `runCommand`.
+
+    The output is collected in a temporary file, so commands running at the
+    same time can't block on a full pipe.
+
+    :type args: `list` of `str`
+    :param args: The executable followed by its arguments.
+    :type cwd: `str`
+    :param cwd: Working directory of the command.
+    :type env: `dict`
+    :param env: Environment of the command, the current one when `None`.
+    :rtype: `subprocess.Popen`
+    """
+    output = TemporaryFile()
+    process = Popen(args, stdout=output, stderr=STDOUT, cwd=cwd, env=env)
+    process.output = output
+    process.started = time.time()
+
+    return process
+
+
+def waitCommand(process):
+    """
+    Wait for a command started with `startCommand`.
+
+    The resource usage of the command is stored in `process.rusage` where
+    `os.wait4` is available, `None` otherwise.
+
+    :rtype: `str`
+    :return: All of the standard output and error.
+    :raise CommandFailed: The command exited with a non-0 exit code, like
+        `runCommand`.
+    """
+    process.rusage = None
+
+    if hasattr(os, "wait4"):
+        pid, status, process.rusage = os.wait4(process.pid, 0)
+
+        if os.WIFSIGNALED(status):
+            process.returncode = -os.WTERMSIG(status)
+        else:
+            process.returncode = os.WEXITSTATUS(status)
+
+    exitCode = process.wait()
+    process.output.seek(0)
+    stdout = process.output.read()
+    process.output.close()
+
+    if exitCode < 0:
+        raise CommandFailed(None, -exitCode, stdout)
+    elif exitCode > 0:
+        raise CommandFailed(exitCode, None, stdout)
+
+    return stdout
+
+
+def stopCommand(process):
+    """
+    Kill a command started with `startCommand`, when it is still running,
+    and wait for it.
+    """
+    if process.poll() is None:
+        process.kill()
+
+    process.wait()
+    process.output.close()
+
+
+def mergeTree(src, dest):
+    """
+    Move the contents of directory `src` into `dest`, replacing existing
+    files, and remove `src`.
+
+    :type src: `FilePath`
+    :type dest: `FilePath`
+    """
+    if not dest.exists():
+        if not dest.parent().exists():
+            dest.parent().makedirs()
+        src.moveTo(dest)
+        return
+
+    for name in src.listdir():
+        child, target = src.child(name), dest.child(name)
+
+        if child.isdir() and target.isdir():
+            mergeTree(child, target)
+        else:
+            if target.exists():
+                target.remove()
+            child.moveTo(target)
+
+    src.remove()
+
 
 class DistributionBuilder(TwistedDistributionBuilder):
     """
@@ -48,8 +155,26 @@ class DistributionBuilder(TwistedDistributionBuilder):
     source = True
     checksums = False
     export_types = []
+    html_docs = None
+    api_docs = None
+    cache = None
+    workers = 1
+    worker_timeout = 3600
+    sphinx_jobs = None
+    doctree_cache = None
+    compression_levels = {"tar.gz": 9, "tar.bz2": 9, "tar.xz": 6, "zip": 6}
+    compression_threads = 1
+    deterministic = False
+    incremental = False
+    input_hash = None
+    recorder = None
+    write_bytecode = False
+    include_patterns = []
+    exclude_patterns = list(DEFAULT_EXCLUDE)
     checksums_url = 'http://download.pyamf.org/MD5SUMS'
     theme_url = 'https://github.com/collab-project/sphinx-themes/tarball/master'
+    theme_archive = None
+    theme_hash = None
     files = ["LICENSE.txt", "CHANGES.txt", "setup.py", "setup.cfg",
              "ez_setup.py", "pyamf", "cpyamf"]
 
@@ -67,90 +192,482 @@ class DistributionBuilder(TwistedDistributionBuilder):
         :rtype: :class:`twisted.python.filepath.FilePath`
         """
         self.releaseName = "%s-%s" % (title, version)
-        self.buildPath = lambda *args: os.sep.join((self.releaseName,) + args)
+        self.docPath = self.rootDirectory.child("doc")
+        export_types = self.export_types
 
-        if self.documentation:
-            # build documentation
-            self.docPath = self.rootDirectory.child("doc")
-            self.html_docs = self._buildMainDocumentation()
-            self.api_docs = self._buildAPIDocumentation()
+        if self.incremental:
+            export_types = self._getChangedTypes()
 
-            # clean up pycs
-            self._clean()
+            if not export_types:
+                logging.info("\tNo changes since the last build...")
+
+        if self.needsDocumentation(export_types):
+            self.buildDocumentation()
 
         # create package(s)
-        packages = self._buildPackages(version)
+        packages = self._buildPackages(version, export_types)
 
         if self.source and self.checksums:
             # update md5 checksums file
             self._updateChecksums(packages)
 
 
-    def _clean(self):
+    def needsDocumentation(self, export_types=None):
+        """
+        Whether `build` has to build the documentation: it goes into the
+        archives and isn't shared by another builder yet.
+
+        :param export_types: Export types that will be built, the changed
+            ones in incremental mode when `None`.
+        :type export_types: `list`
+        :rtype: `bool`
+        """
+        if not self.documentation or self.html_docs is not None:
+            return False
+
+        if export_types is None:
+            export_types = self.export_types
+            if self.incremental:
+                export_types = self._getChangedTypes()
+
+        return len([ext for ext in export_types if ext != "egg"]) > 0
+
+
+    def buildDocumentation(self):
+        """
+        Build the main and API documentation.
+
+        Builders that share a source tree can reuse the result by copying
+        `html_docs` and `api_docs`; `build` skips the documentation when
+        `html_docs` is already set.
+        """
+        self.docPath = self.rootDirectory.child("doc")
+        compiled = None
+
+        if self.write_bytecode:
+            # only remove what the documentation tools leave behind
+            compiled = self._findCompiled()
+
+        with measure(self.recorder, "theme"):
+            self._setupTheme()
+
+        # Sphinx and Epydoc run at the same time
+        sphinx = self._startMainDocumentation()
+
+        try:
+            epydoc = self._startAPIDocumentation()
+        except:
+            # don't leave Sphinx running, or the doctree cache locked
+            stopCommand(sphinx)
+            if sphinx.lock is not None:
+                sphinx.lock.close()
+            raise
+
+        try:
+            self.html_docs = self._finishMainDocumentation(sphinx)
+        except:
+            # don't leave Epydoc running when Sphinx failed
+            stopCommand(epydoc)
+            raise
+
+        self.api_docs = self._finishAPIDocumentation(epydoc)
+
+        if compiled is not None:
+            # clean up pycs
+            with measure(self.recorder, "clean"):
+                self._clean(self._findCompiled() - compiled)
+
+
+    def buildPath(self, *args):
+        """
+        Path of an archive member, relative to the release directory.
+        """
+        return os.sep.join((self.releaseName,) + args)
+
+
+    def _clean(self, files=None):
         """
         Clean .pyc and .so files.
+
+        :param files: Locations of the files to remove, all .pyc and .so
+            files in the tree when `None`.
+        :type files: `set`
         """
-        for files in os.walk(self.rootDirectory.path):
-            for f in files[2]:
+        if files is None:
+            files = self._findCompiled(prune=False)
+
+        for path in files:
+            logging.debug("\t\tRemoving %s" % path)
+            os.unlink(path)
+
+
+    def _findCompiled(self, prune=True):
+        """
+        Find the .pyc and .so files in the tree.
+
+        :param prune: Skip the generated documentation in `doc/_build`,
+            which doesn't contain any.
+        :type prune: `bool`
+        :rtype: `set`
+        :return: Locations of the files.
+        """
+        doc = os.path.join(self.rootDirectory.path, "doc")
+        found = set()
+
+        for root, dirs, files in os.walk(self.rootDirectory.path):
+            if prune and root == doc and "_build" in dirs:
+                dirs.remove("_build")
+
+            for f in files:
                 if f.endswith('.pyc') or f.endswith('.so'):
-                    os.unlink(os.path.join(files[0], f))
+                    found.add(os.path.join(root, f))
+
+        return found
 
 
-    def _buildPackages(self, version):
+    def _getDocumentationEnvironment(self):
+        """
+        Environment of Sphinx and Epydoc, which don't write byte code for
+        the modules they import unless `write_bytecode` is set.
+
+        :rtype: `dict`
+        """
+        env = os.environ.copy()
+
+        if not self.write_bytecode:
+            env["PYTHONDONTWRITEBYTECODE"] = "1"
+
+        return env
+
+
+    def _buildPackages(self, version, export_types=None):
         """
         Build packages(s).
 
+        In incremental mode the output directory is kept and only the
+        packages of `export_types` are replaced; the others are reused.
+
         :param version: Distribution version nr.
         :type version: `str`
+        :param export_types: Export types to build, `export_types` when
+            `None`.
+        :type export_types: `list`
 
         :rtype: `list`
         :return: file checksum(s)
         """
         checksums = []
 
-        if self.outputDirectory.exists():
+        if export_types is None:
+            export_types = self.export_types
+
+        if self.outputDirectory.exists() and not self.incremental:
             self.outputDirectory.remove()
 
-        logging.debug("\tCreating output directory...")
-        self.outputDirectory.createDirectory()
+        if not self.outputDirectory.exists():
+            logging.debug("\tCreating output directory...")
+            self.outputDirectory.createDirectory()
 
         logging.info("\tCreating package(s)...")
 
+        if [ext for ext in export_types if ext != "egg"]:
+            with measure(self.recorder, "manifest"):
+                self.manifest = self._buildManifest()
+
+        if self.incremental:
+            for ext in export_types:
+                self._removePackage(ext)
+
+        workers = min(self._getWorkerCount(), len(export_types))
+
+        if workers > 1:
+            # one export type per job, each worker reads the tree itself
+            jobs = [(self, [ext]) for ext in export_types]
+            logging.debug("\tUsing %d worker processes..." % workers)
+            pool = Pool(workers)
+            try:
+                # use a timeout so KeyboardInterrupt reaches the main process
+                results = pool.map_async(_buildPackage, jobs).get(
+                    self.worker_timeout)
+            except:
+                pool.terminate()
+                pool.join()
+                raise
+            pool.close()
+            pool.join()
+
+            for result, stages in results:
+                if self.recorder is not None:
+                    self.recorder.extend(stages)
+            results = [result for result, stages in results]
+        elif export_types:
+            # all archives are written in a single pass over the tree
+            results = [self._buildPackage(export_types)]
+        else:
+            results = []
+
+        packages = []
+        for result in results:
+            packages.extend(result)
+
+        if self.incremental:
+            packages = self._updateState(export_types, packages)
+
+        for outputFile, digests in packages:
+            if outputFile is None or not outputFile.exists():
+                continue
+
+            # filename
+            logging.info("\t - %s%s%s" % (os.path.basename(self.outputDirectory.path),
+                                          os.sep, os.path.basename(outputFile.path)))
+
+            # size
+            size = sizeof_fmt(os.path.getsize(outputFile.path))
+            logging.info("\t   Size: %s" % size)
+
+            if self.source:
+                if digests is None:
+                    # md5, sha1 and sha256 in one pass
+                    with measure(self.recorder, "checksum " + outputFile.basename()):
+                        digests = self._getChecksums(outputFile.path)
+                checksum = digests["md5"]
+                checksum_entry = "%s  ./%s/%s\n" % (checksum, version,
+                                            os.path.basename(outputFile.path))
+                checksums.append(checksum_entry)
+                logging.info("\t   MD5: " + checksum)
+                logging.info("\t   SHA256: " + digests["sha256"])
+
+        return checksums
+
+
+    def _getStatePath(self):
+        """
+        :rtype: `str`
+        :return: Location of the build state, next to the output directory.
+        """
+        return self.outputDirectory.sibling(
+            self.outputDirectory.basename() + ".state.json").path
+
+
+    def _getInputs(self, ext):
+        """
+        Everything the package of an export type is built from.
+
+        :param ext: Export type, eg. `tar.gz`.
+        :type ext: `str`
+        :rtype: `dict`
+        """
+        if self.input_hash is None:
+            self.input_hash = hashTree(self.rootDirectory.path)
+
+        inputs = {"tree": self.input_hash,
+                  "builder": self.__class__.__name__,
+                  "release": self.releaseName,
+                  "documentation": self.documentation,
+                  "examples": self.examples,
+                  "source": self.source,
+                  "export_type": ext,
+                  "compression_level": self.compression_levels.get(ext),
+                  "include": self.include_patterns,
+                  "exclude": self.exclude_patterns,
+                  "tools": self._getToolVersions()}
+
+        if self.deterministic:
+            inputs["mtime"] = self._getArchiveTime()
+
+        if self.documentation and ext != "egg":
+            inputs["theme_url"] = self.theme_url
+            inputs["theme"] = self._getThemeHash()
+
+        return inputs
+
+
+    def _getThemeHash(self):
+        """
+        SHA-1 of the theme tarball, looked up once.
+
+        :rtype: `str`
+        """
+        if self.theme_hash is None:
+            archive = self._getThemeArchive()
+            self.theme_hash = getChecksums(archive.path, ("sha1",))["sha1"]
+
+        return self.theme_hash
+
+
+    def _getToolVersions(self):
+        """
+        Versions of the tools the packages are built with, looked up once.
+
+        :rtype: `dict`
+        """
+        if getattr(self, "_toolVersions", None) is None:
+            versions = {"python": sys.version.split()[0]}
+            tools = []
+
+            if self.documentation:
+                tools = ["sphinx-build", "epydoc"]
+
+            for tool in tools:
+                try:
+                    process = Popen([tool, "--version"], stdout=PIPE,
+                                    stderr=STDOUT)
+                except OSError:
+                    versions[tool] = None
+                    continue
+
+                output = process.communicate()[0].strip().splitlines()
+                versions[tool] = (output or [""])[0]
+
+            self._toolVersions = versions
+
+        return self._toolVersions
+
+
+    def _getChangedTypes(self):
+        """
+        Export types whose inputs changed since the last build, or whose
+        package is gone.
+
+        :rtype: `list`
+        """
+        self.state = BuildState(self._getStatePath())
+        changed = []
+
         for ext in self.export_types:
+            record = self.state.getPackage(ext, self._getInputs(ext),
+                                           self.outputDirectory.path)
+
+            if record is None:
+                changed.append(ext)
+            else:
+                logging.debug("\tKeeping %s, unchanged" % record["file"])
+
+        return changed
+
+
+    def _removePackage(self, ext):
+        """
+        Remove the package an export type got in the last build.
+        """
+        record = self.state.packages.get(ext)
+
+        if record is not None:
+            old = self.outputDirectory.child(record["file"])
+            if old.exists():
+                old.remove()
+
+        self.state.removePackage(ext)
+
+
+    def _updateState(self, export_types, packages):
+        """
+        Record the new packages and add the ones that were kept.
+
+        :param export_types: The export types that were built.
+        :type export_types: `list`
+        :param packages: `(location, checksums)` for each new package.
+        :type packages: `list`
+        :rtype: `list`
+        :return: `(location, checksums)` for every package of the builder.
+        """
+        result = []
+
+        for ext in self.export_types:
+            if ext not in export_types:
+                record = self.state.packages[ext]
+                result.append((self.outputDirectory.child(record["file"]),
+                               record["checksums"]))
+                continue
+
+            outputFile, digests = packages[export_types.index(ext)]
+
+            if outputFile is not None and outputFile.exists():
+                if digests is None:
+                    digests = self._getChecksums(outputFile.path)
+                self.state.setPackage(ext, self._getInputs(ext),
+                                      outputFile.path, digests)
+
+            result.append((outputFile, digests))
+
+        self.state.save()
+
+        return result
+
+
+    def _getWorkerCount(self):
+        """
+        Number of processes used to create the packages.
+
+        One process writes all archives in a single pass over the tree, so
+        every file is read once. With more processes each one builds a
+        single export type and reads the whole tree itself, which only pays
+        off when compression, not reading the tree, is the bottleneck; with
+        several compression threads, see `compression_threads`, the single
+        pass is usually faster.
+
+        :rtype: `int`
+        :return: `workers`, at least 1.
+        """
+        return max(1, self.workers or 1)
+
+
+    def _buildPackage(self, export_types):
+        """
+        Build the packages for one or more export types.
+
+        The archives are all open at the same time and receive every file
+        of the manifest from a single read. They are hashed while they are
+        written.
+
+        :param export_types: Export types, eg. `["tar.gz", "zip"]`.
+        :type export_types: `list`
+
+        :rtype: `list`
+        :return: `(location, checksums)` for each package. The location is
+                 `None` for export types that are not supported, the checksums
+                 are `None` when the package wasn't hashed while written.
+        """
+        packages = []
+        writers = []
+
+        for ext in export_types:
             outputFile = self.outputDirectory.child(".".join([
                                                     self.releaseName, ext]))
+            writer = None
+
             # create tarball or zip
             if ext == "zip":
-                self.package = self._createZip(outputFile)
+                writer = self._createZip(outputFile)
             elif ext != "egg":
-                self.package = self._createTarball(outputFile)
+                writer = self._createTarball(outputFile, ext)
 
-            if ext != "egg" and self.package != None:
-                self._addFiles()
-                self.package.close()
+            if writer is None:
+                outputFile = None
+            else:
+                writers.append(writer)
 
-            # create egg
-            if ext == "egg":
-                self.package = outputFile = self._createEgg()
+            packages.append([outputFile, writer])
 
-            if outputFile.exists():
-                # filename
-                logging.info("\t - %s%s%s" % (os.path.basename(self.outputDirectory.path),
-                                              os.sep, os.path.basename(outputFile.path)))
+        if writers:
+            names = ", ".join([os.path.basename(w.path) for w in writers])
 
-                # size
-                size = sizeof_fmt(os.path.getsize(outputFile.path))
-                logging.info("\t   Size: %s" % size)
+            with measure(self.recorder, "package " + names):
+                self._addFiles(writers)
 
-                if self.source:
-                    # md5
-                    checksum = self._getMD5(outputFile.path)
-                    checksum_entry = "%s  ./%s/%s\n" % (checksum, version,
-                                                os.path.basename(outputFile.path))
-                    checksums.append(checksum_entry)
-                    logging.info("\t   MD5: " + checksum)
+                for writer in writers:
+                    writer.close()
 
-        return checksums
+        for package in packages:
+            if package[1] is not None:
+                package[1] = package[1].getChecksums()
+
+        # create egg
+        if "egg" in export_types:
+            with measure(self.recorder, "egg"):
+                packages[export_types.index("egg")][0] = self._createEgg()
+
+        return [tuple(package) for package in packages]
 
 
     def _updateChecksums(self, checksums):
@@ -184,34 +701,130 @@ class DistributionBuilder(TwistedDistributionBuilder):
         return md5sums
 
 
-    def _buildMainDocumentation(self):
+    def _startMainDocumentation(self):
         """
-        Build main documentation with Sphinx.
+        Start building the main documentation with Sphinx.
 
-        :rtype: `FilePath`
-        :return: File path for HTML build output directory.
+        :rtype: `subprocess.Popen`
+        :return: The running `sphinx-build` process.
         """
-        self._setupTheme()
-
         logging.info("\tBuilding main documentation...")
 
         if self.examples:
             logging.info("\tIncluding examples...")
 
         html_output = self.docPath.child("_build").child('html')
-        sphinx_build = ["sphinx-build", "-b", "html", self.docPath.path,
-                        html_output.path]
+        sphinx_build = ["sphinx-build", "-b", "html"]
+
+        if self.sphinx_jobs:
+            sphinx_build += ["-j", str(self.sphinx_jobs)]
+
+        lock = None
+        sphinx_output = html_output
+
+        if self.doctree_cache:
+            # the pickled environment and the pages written from it survive
+            # the temporary build directory, so Sphinx only reads the
+            # documents that changed and only writes the pages that are out
+            # of date
+            cache = FilePath(self.doctree_cache).child(self.releaseName)
+            doctrees = cache.child("doctrees")
+            if not doctrees.exists():
+                doctrees.makedirs()
+            sphinx_build += ["-d", doctrees.path]
+            sphinx_output = cache.child("html")
+
+            # builds of the same release on this host take turns, so they
+            # don't write the environment and pages at the same time
+            lock = lockFile(cache.child(".lock").path)
+
+        sphinx_build += [self.docPath.path, sphinx_output.path]
 
         logging.debug(" ".join(sphinx_build))
-        
+
         try:
-            runCommand(sphinx_build)
-        except CommandFailed, e:
-            logging.info("")
-            print("Error building main documentation with Sphinx:\n\n%s" % e[2])
+            # run from the doc dir to fix issue with sphinx & themes
+            process = startCommand(sphinx_build, cwd=self.docPath.path,
+                                   env=self._getDocumentationEnvironment())
+        except:
+            if lock is not None:
+                lock.close()
+            raise
+
+        process.html_output = html_output
+        process.cached_output = sphinx_output
+        process.lock = lock
+
+        return process
+
+
+    def _finishMainDocumentation(self, process):
+        """
+        Wait for Sphinx to finish and copy the pages it wrote to the doctree
+        cache into the build directory, while the cache is still locked.
+
+        :rtype: `FilePath`
+        :return: File path for HTML build output directory.
+        """
+        try:
+            try:
+                waitCommand(process)
+            except CommandFailed, e:
+                logging.info("")
+                print("Error building main documentation with Sphinx:\n\n%s" % e[2])
+                sys.exit(1)
+
+            if process.cached_output != process.html_output:
+                # a copy, not links: the next build rewrites the cached pages
+                # in place while this one still archives them
+                if process.html_output.exists():
+                    process.html_output.remove()
+                elif not process.html_output.parent().exists():
+                    process.html_output.parent().makedirs()
+                cloneTree(process.cached_output.path,
+                          process.html_output.path, link=False)
+        finally:
+            if process.lock is not None:
+                process.lock.close()
+
+        self._recordCommand("sphinx", process)
+
+        return process.html_output
+
+
+    def _recordCommand(self, name, process):
+        """
+        Record a finished command as a stage, see `waitCommand`.
+        """
+        if self.recorder is not None and process.rusage is not None:
+            self.recorder.addProcess(name, process.started, process.rusage)
+
+
+    def _getThemeArchive(self):
+        """
+        Fetch the theme tarball, from the download cache when there is one.
+
+        Without the cache the tarball is downloaded once, to a hidden file
+        that is left out of the archives and removed by `_setupTheme`.
+
+        :rtype: `FilePath`
+        """
+        if self.theme_archive is not None:
+            return self.theme_archive
+
+        try:
+            if self.cache is not None:
+                archive = FilePath(self.cache.fetch(self.theme_url))
+            else:
+                archive = self.rootDirectory.child("doc").child(".theme.tar.gz")
+                download(self.theme_url, archive.path)
+        except URLError:
+            print("Error downloading theme from %s" % self.theme_url)
             sys.exit(1)
 
-        return html_output
+        self.theme_archive = archive
+
+        return archive
 
 
     def _setupTheme(self):
@@ -219,67 +832,94 @@ class DistributionBuilder(TwistedDistributionBuilder):
         Download and setup the theme.
         """
         logging.info("\tBuilding theme...")
-        
+
+        # extract next to the target, so the theme is moved with a rename
+        workPath = FilePath(mkdtemp(prefix=".theme-", dir=self.docPath.path))
+
         try:
-            tarball = urlopen(self.theme_url).read()
-        except HTTPError:
-            print("Error downloading theme from %s" % self.theme_url)
-            sys.exit(1)
+            sourceFile = self._getThemeArchive()
 
-        workPath = FilePath(mkdtemp())
-        sourceFile = workPath.child("theme.tar.gz")
+            tar = opentar(sourceFile.path, mode='r:*')
+            tar.extractall(workPath.path)
 
-        # change dir to fix issue with sphinx & themes
-        os.chdir(self.docPath.path)
+            theme = None
+            for d in workPath.listdir():
+                theme = workPath.child(d)
+                if theme.isdir():
+                    theme = theme.child("source").child("themes")
+                    dest = self.docPath.child("themes")
+                    theme.moveTo(dest)
+                    break
+        finally:
+            workPath.remove()
 
-        o = open(sourceFile.path , "w")
-        o.write(tarball)
-        o.close()
-        tar = opentar(sourceFile.path, mode='r:*')
-        tar.extractall(workPath.path)
+            if self.cache is None and self.theme_archive is not None:
+                self.theme_archive.remove()
+                self.theme_archive = None
 
-        theme = None
-        for d in workPath.listdir():
-            theme = workPath.child(d)
-            if theme.isdir():
-                theme = theme.child("source").child("themes")
-                dest = self.docPath.child("themes")
-                theme.moveTo(dest)
-                break
 
+    def _startAPIDocumentation(self):
+        """
+        Start building the API documentation with Epydoc.
+
+        Epydoc writes to a temporary directory so it doesn't interfere with
+        Sphinx, which builds the surrounding `html` directory at the same time.
 
-    def _buildAPIDocumentation(self):
+        :rtype: `subprocess.Popen`
+        :return: The running `epydoc` process.
         """
-        Build API documentation with Epydoc.
+        logging.info("\tBuilding API documentation...")
+
+        build = self.docPath.child("_build")
+        if not build.exists():
+            build.makedirs()
+
+        tmp_output = FilePath(mkdtemp(prefix="api-", dir=build.path))
+        epydoc_build = ["epydoc", "--config", "setup.cfg", "--debug",
+                        "--output", tmp_output.path, "--simple-term"]
+
+        logging.debug(" ".join(epydoc_build))
+
+        process = startCommand(epydoc_build, cwd=self.rootDirectory.path,
+                               env=self._getDocumentationEnvironment())
+        process.tmp_output = tmp_output
+
+        return process
+
+
+    def _finishAPIDocumentation(self, process):
+        """
+        Wait for Epydoc to finish and move its output into the HTML
+        documentation.
 
         :rtype: `FilePath`
         :return: File path for HTML build output directory.
         """
-
-        logging.info("\tBuilding API documentation...")
-        
         html_output = self.docPath.child("_build").child('html').child('api')
-        os.chdir(self.rootDirectory.path)
-        epydoc_build = ["epydoc", "--config", "setup.cfg", "--debug",
-                        "--output", html_output.path, "--simple-term"]
 
-        logging.debug(" ".join(epydoc_build))
-        
         try:
-            runCommand(epydoc_build)
+            waitCommand(process)
         except CommandFailed, e:
             print("\nError building API documentation with Epydoc:\n\n%s" % e[2])
             logging.error("\tError building API documentation, check Epydoc output. Skipping...")
             logging.error("")
 
+        self._recordCommand("epydoc", process)
+
+        mergeTree(process.tmp_output, html_output)
+
         return html_output
 
 
-    def _addFiles(self):
+    def _buildManifest(self):
         """
-        Add files to package.
+        Collect the files that go into the archives.
+
+        :rtype: `Manifest`
         """
         src = self.rootDirectory
+        manifest = Manifest(Filter(self.include_patterns,
+                                   self.exclude_patterns))
         files = []
         doc_output = self.buildPath()
 
@@ -289,18 +929,33 @@ class DistributionBuilder(TwistedDistributionBuilder):
             logging.debug("\t\t - doc")
 
         # add compiled documentation
-        self.package.add(self.html_docs.path, doc_output)
+        manifest.add(self.html_docs.path, doc_output)
 
         if self.examples:
             # add examples
             org = self.docPath.child("tutorials").child("examples").path
             target = doc_output + "/tutorials/examples"
-            self.package.add(org, target)
+            manifest.add(org, target)
 
         # add source files
-        for f in files:        
+        for f in files:
             logging.debug("\t\t - " + f)
-            self.package.add(src.child(f).path, self.buildPath(f))       
+            manifest.add(src.child(f).path, self.buildPath(f))
+
+        if self.deterministic:
+            manifest.sort()
+
+        return manifest
+
+
+    def _addFiles(self, writers):
+        """
+        Add files to packages.
+
+        :param writers: Open archive writers.
+        :type writers: `list`
+        """
+        self.manifest.write(writers)
 
 
     def _createZip(self, outputFile):
@@ -309,73 +964,57 @@ class DistributionBuilder(TwistedDistributionBuilder):
 
         :param outputFile: The target location for the new zip file.
         :type outputFile: `FilePath`
-        :return: `ZipFile`
-        """
-        def zip_writer(dirpath, zippath):
-            basedir = os.path.dirname(dirpath) + os.sep
-            entry = ZipInfo()
-            entry.compress_type = compression
-
-            if os.path.isdir(dirpath):
-                for root, dirs, files in os.walk(dirpath):
-                    if os.path.basename(root).startswith('.'):
-                        # skip hidden directories
-                        continue
-                    dirname = root.replace(basedir, '')
-                    for f in files:
-                        if f[-1] == '~' or f.startswith('.'):
-                            # skip backup files and all hidden files
-                            continue
-                        src = root + '/' + f
-                        entry = ZipInfo()
-                        entry.compress_type = compression
-                        entry.filename = dirname + '/' + f
-                        entry.date_time = localtime(os.path.getmtime(src))[:6]
-
-                        # hacky
-                        if dirname.startswith("html"):
-                            if self.source == True:
-                                entry.filename = dirname.replace('html', 'doc', 1) + "/" + f
-                            else:
-                                entry.filename = dirname.replace('html/', '', 1) + "/" + f
-                                entry.filename = entry.filename.replace('html/', '', 1)
-                        if entry.filename.startswith("examples"):
-                            entry.filename = "tutorials/" + entry.filename
-
-                        file_data = open( src, 'rb').read()
-                        self.package.writestr(entry, file_data)
-            else:
-                # top files
-                entry.date_time = localtime(os.path.getmtime(dirpath))[:6]
-                entry.filename = os.path.basename(zippath)
-                file_data = open( dirpath, 'rb').read()
-                self.package.writestr(entry, file_data)
-
-        zipfile = ZipFile(outputFile.path, 'w')
-        zipfile.add = zip_writer
-
-        return zipfile
+        :return: `ZipWriter`
+        """
+        return ZipWriter(outputFile.path, self.compression_levels.get("zip"),
+                         self._getArchiveTime())
 
 
-    def _createTarball(self, outputFile):
+    def _createTarball(self, outputFile, ext):
         """
         Helper method to create a tarball file.
 
+        The compression backend is picked by `release.compress.getBackend`
+        for the suffix of `ext`, eg. `gz` for `tar.gz`.
+
         :param outputFile: The target location for the new tar file.
         :type outputFile: `FilePath`
-        :return: compressed `TarFile`
+        :param ext: Export type, eg. `tar.gz`.
+        :type ext: `str`
+        :return: `TarWriter` for a compressed tarball
         """
-        comp = outputFile.path[-3:]
-        
-        if comp == ".gz": comp = "gz"
+        suffix = ext.split(".", 1)[-1]
+        backend = getBackend(suffix, self.compression_threads)
 
-        try:
-            tarball = TarFile.open(outputFile.path, mode='w:' + comp)
-        except CompressionError:
-            logging.warn("\t - Warning! Ignoring unsupported export filetype: ." + str(comp))
+        if backend is None:
+            logging.warn("\t - Warning! Ignoring unsupported export filetype: ." + suffix)
+            return
+
+        logging.debug("Compressing %s with %s" % (ext, backend.__name__))
+
+        return TarWriter(outputFile.path, backend,
+                         self.compression_levels.get(ext, 9),
+                         self.compression_threads, self._getArchiveTime())
+
+
+    def _getArchiveTime(self):
+        """
+        Modification time of the archive entries in deterministic mode, from
+        the `SOURCE_DATE_EPOCH` environment variable or `ZIP_EPOCH` when it
+        isn't set.
+
+        :rtype: `int`
+        :return: Seconds since the epoch, `None` outside deterministic mode.
+        """
+        if not self.deterministic:
             return
 
-        return tarball
+        epoch = os.environ.get("SOURCE_DATE_EPOCH")
+
+        if epoch is None:
+            return ZIP_EPOCH
+
+        return int(epoch)
 
 
     def _createEgg(self):
@@ -404,24 +1043,58 @@ class DistributionBuilder(TwistedDistributionBuilder):
         """
         Compute MD5 hash of the specified file.
 
+        When `excludeLine` or `includeLine` is given the file is hashed as
+        text: lines starting with `excludeLine` are skipped and
+        `includeLine` is added at the end.
+
         :rtype: `str`
         """
-        m = md5()
+        digests = self._getChecksums(fileName, excludeLine, includeLine)
+
+        if digests is not None:
+            return digests["md5"]
+
+
+    def _getChecksums(self, fileName, excludeLine="", includeLine=""):
+        """
+        Compute the MD5, SHA-1 and SHA-256 hashes of the specified file in a
+        single, streaming pass.
+
+        :rtype: `dict`
+        :return: Hex digest for each algorithm.
+        """
         try:
-            fd = open(fileName, "rb")
+            if excludeLine or includeLine:
+                return getTextChecksums(fileName, excludeLine, includeLine)
+
+            return getChecksums(fileName)
         except IOError:
             logging.error("Unable to open the MD5 file:" + fileName)
-            return
 
-        content = fd.readlines()
-        fd.close()
-        for eachLine in content:
-            if excludeLine and eachLine.startswith(excludeLine):
-                continue
-            m.update(eachLine)
-        m.update(includeLine)
 
-        return m.hexdigest()
+def _buildPackage(job):
+    """
+    Build a package in a worker process.
+
+    :param job: `(builder, ext)` tuple.
+    :type job: `tuple`
+    :rtype: `tuple`
+    :return: The result of `DistributionBuilder._buildPackage` and the
+        stages recorded in the worker, which go back to the parent.
+    """
+    builder, ext = job
+
+    if builder.recorder is not None:
+        # the worker's copy of the recorder still has the parent's stages
+        builder.recorder.stages = []
+
+    result = builder._buildPackage(ext)
+    stages = []
+
+    if builder.recorder is not None:
+        stages = builder.recorder.stages
+
+    return result, stages
 
 
 class BuildScript(object):
@@ -429,7 +1102,27 @@ class BuildScript(object):
     PyAMF build script.
     """
 
-    title = "PyAMF"       
+    title = "PyAMF"
+    streaming = True
+    cache = None
+    sphinxJobs = None
+    workers = 1
+    compressionThreads = 1
+    deterministic = False
+    incremental = False
+    inputHash = None
+    recorder = None
+    reportPath = None
+    writeBytecode = False
+    includePatterns = []
+    excludePatterns = list(DEFAULT_EXCLUDE)
+    exportTypes = None
+    compressionLevels = {}
+    cacheDirectory = os.path.join(os.path.expanduser("~"), ".pyamf-release",
+                                  "cache")
+    cacheSize = 512
+    doctreeDirectory = os.path.join(os.path.expanduser("~"), ".pyamf-release",
+                                    "doctrees")
 
     def main(self, args):
         """
@@ -437,14 +1130,165 @@ class BuildScript(object):
         :param args: The command line arguments to process.  This must contain
             two strings: the source URL and the path to the destination directory.
         """
+        options, args = self.getOptionParser().parse_args(args)
+
         if len(args) != 2:
             sys.exit("Must specify two arguments: "
                      "source URL and destination path")
 
+        self.configure(options)
+
+        # the stages that ran are also reported when the build fails
         try:
-            self.build(args[0], FilePath(args[1]))
-        except (KeyboardInterrupt):
-            pass
+            try:
+                self.build(args[0], FilePath(args[1]))
+            except (KeyboardInterrupt):
+                pass
+        finally:
+            self.report()
+
+
+    def report(self):
+        """
+        Log the time and resources taken by each stage, and write them to
+        `reportPath` when it is set.
+        """
+        logging.info("")
+        self.recorder.logSummary()
+
+        if self.reportPath is not None:
+            self.recorder.writeReport(self.reportPath, title=self.title,
+                                      version=str(getattr(self, "version", "")))
+            logging.info("Report: %s" % self.reportPath)
+
+
+    def getOptionParser(self):
+        """
+        :rtype: `optparse.OptionParser`
+        :return: Parser for the command line options.
+        """
+        parser = OptionParser(usage="%prog [options] SOURCE DESTINATION")
+        parser.add_option("--cache-dir", dest="cacheDirectory",
+                          default=self.cacheDirectory, metavar="DIR",
+                          help="location of the download cache [%default]")
+        parser.add_option("--cache-size", dest="cacheSize", type="int",
+                          default=self.cacheSize, metavar="MB",
+                          help="maximum size of the download cache [%default]")
+        parser.add_option("--no-cache", dest="useCache", action="store_false",
+                          default=True, help="always download the tarballs")
+        parser.add_option("--offline", action="store_true", default=False,
+                          help="only use tarballs from the download cache")
+        parser.add_option("--sphinx-jobs", dest="sphinxJobs", metavar="N",
+                          help="number of parallel Sphinx processes")
+        parser.add_option("--doctree-cache", dest="doctreeDirectory",
+                          default=self.doctreeDirectory, metavar="DIR",
+                          help="location of the Sphinx environment, doctrees "
+                               "and HTML pages, kept between builds "
+                               "[%default]")
+        parser.add_option("--no-doctree-cache", dest="doctreeDirectory",
+                          action="store_const", const=None,
+                          help="build the documentation from scratch")
+        parser.add_option("--workers", type="int", default=self.workers,
+                          metavar="N", help="number of processes that build "
+                          "the archives, one export type each; every process "
+                          "reads the whole source tree [%default]")
+        parser.add_option("--compress-threads", dest="compressionThreads",
+                          type="int", default=self.compressionThreads,
+                          metavar="N", help="number of threads used to "
+                          "compress the tarballs, picks pigz, pbzip2 or "
+                          "xz -T when installed [%default]")
+        parser.add_option("--export-types", dest="exportTypes",
+                          metavar="LIST", help="comma separated archive "
+                          "types to build instead of the default ones, eg. "
+                          "tar.gz,tar.xz,zip")
+        parser.add_option("--compression-level", dest="compressionLevels",
+                          action="append", default=[], metavar="TYPE=N",
+                          help="compression level of an archive type, eg. "
+                               "tar.xz=9, can be repeated")
+        parser.add_option("--deterministic", action="store_true",
+                          default=self.deterministic,
+                          help="build identical archives from identical "
+                               "sources, using $SOURCE_DATE_EPOCH as the "
+                               "time of every file")
+        parser.add_option("--incremental", action="store_true",
+                          default=self.incremental,
+                          help="keep the packages whose source tree and "
+                               "options haven't changed since the last build")
+        parser.add_option("--write-bytecode", dest="writeBytecode",
+                          action="store_true", default=self.writeBytecode,
+                          help="let Sphinx and Epydoc write byte code, and "
+                               "remove the files they added afterwards")
+        parser.add_option("--include", dest="includePatterns",
+                          action="append", default=list(self.includePatterns),
+                          metavar="PATTERN", help="only put files matching "
+                          "PATTERN in the archives, can be repeated")
+        parser.add_option("--exclude", dest="excludePatterns",
+                          action="append", default=list(self.excludePatterns),
+                          metavar="PATTERN", help="leave out files and "
+                          "directories matching PATTERN, can be repeated "
+                          "[%s]" % " ".join(self.excludePatterns))
+        parser.add_option("--report", dest="reportPath", metavar="FILE",
+                          help="write the time and resources taken by each "
+                               "build stage to a JSON file")
+
+        return parser
+
+
+    def configure(self, options):
+        """
+        Apply the command line options.
+
+        :param options: Options returned by the `getOptionParser` parser.
+        """
+        if options.useCache:
+            self.cache = DownloadCache(options.cacheDirectory,
+                                       options.cacheSize * 1024 * 1024,
+                                       options.offline)
+        elif options.offline:
+            sys.exit("The --offline option requires the download cache")
+
+        self.sphinxJobs = options.sphinxJobs
+        self.doctreeDirectory = options.doctreeDirectory
+        self.workers = options.workers
+        self.compressionThreads = options.compressionThreads
+        self.deterministic = options.deterministic
+        self.incremental = options.incremental
+        self.reportPath = options.reportPath
+        self.writeBytecode = options.writeBytecode
+        self.includePatterns = options.includePatterns
+        self.excludePatterns = options.excludePatterns
+
+        if options.exportTypes is not None:
+            self.exportTypes = [ext.strip() for ext in
+                                options.exportTypes.split(",") if ext.strip()]
+
+            for ext in self.exportTypes:
+                if ext != "zip" and not ext.startswith("tar."):
+                    sys.exit("Unknown export type: %s" % ext)
+
+        self.compressionLevels = {}
+
+        for value in options.compressionLevels:
+            ext, _, level = value.partition("=")
+            ext = ext.strip()
+
+            if ext not in COMPRESSION_LEVELS:
+                sys.exit("Unknown export type in --compression-level %s, "
+                         "expected one of: %s" % (value,
+                         ", ".join(sorted(COMPRESSION_LEVELS))))
+
+            lowest, highest = COMPRESSION_LEVELS[ext]
+
+            try:
+                level = int(level)
+            except ValueError:
+                level = None
+
+            if level is None or not lowest <= level <= highest:
+                sys.exit("Expected a %s compression level from %d to %d: %s"
+                         % (ext, lowest, highest, value))
+
+            self.compressionLevels[ext] = level
 
 
     def build(self, checkout, destination):
@@ -457,50 +1301,212 @@ class BuildScript(object):
         :type destination: `FilePath`
         :param destination: The directory where the output files will be placed.
         """
-        self.workPath = FilePath(mkdtemp())
-        
+        if self.recorder is None:
+            self.recorder = Recorder()
+
+        # on the file system of the output, so trees are moved with a rename
+        self.workPath = FilePath(makeWorkDirectory(destination.path))
+
+        try:
+            self._build(checkout, destination)
+        finally:
+            logging.debug("")
+            logging.debug("Removing build directory...")
+            self.workPath.remove()
+
+        logging.info("")
+        logging.info("Builder ready.")
+
+
+    def _build(self, checkout, destination):
+        """
+        Prepare the source tree in `workPath` and run the builders.
+        """
         logging.info('')
         logging.debug("Build directory: %s" % self.workPath.path)
         logging.info("Output directory: %s" % destination.path)
         logging.info("Source tarball URL: %s" % checkout)
         logging.info('')
 
+        self.export = self.workPath.child("export")
+
+        if self.streaming:
+            self._extractSource(checkout)
+        else:
+            self._downloadSource(checkout)
+        logging.info('')
+        
+        if self.incremental:
+            # hash the tree as released, updateVersion adds today's date
+            with measure(self.recorder, "hash tree"):
+                self.inputHash = hashTree(self.export.path)
+
+        project = Project(self.export)
+        self.version = project.getVersion()
+
+        logging.info("Building %s %s..." % (self.title, str(self.version)))
+
+        with measure(self.recorder, "updateVersion"):
+            project.updateVersion(self.version)
+
+        self.runBuilders(destination)
+
+
+    def runBuilders(self, destination):
+        """
+        Build the distributions from the prepared source tree.
+
+        :type destination: `FilePath`
+        :param destination: The directory where the output files will be placed.
+        """
+        self.db = self.builder(self.export, destination)
+        self.configureBuilder(self.db)
+        self.db.build(self.title, self.version)
+
+
+    def configureBuilder(self, db):
+        """
+        Pass the script options on to a builder.
+
+        :type db: `DistributionBuilder`
+        """
+        db.cache = self.cache
+        db.sphinx_jobs = self.sphinxJobs
+        db.doctree_cache = self.doctreeDirectory
+        db.workers = self.workers
+        db.compression_threads = self.compressionThreads
+        db.deterministic = self.deterministic
+        db.incremental = self.incremental
+        db.input_hash = self.inputHash
+        db.recorder = self.recorder
+        db.write_bytecode = self.writeBytecode
+        db.include_patterns = self.includePatterns
+        db.exclude_patterns = self.excludePatterns
+
+        # the egg builder doesn't create archives
+        if self.exportTypes is not None and "egg" not in db.export_types:
+            db.export_types = list(self.exportTypes)
+
+        levels = dict(db.compression_levels)
+        levels.update(self.compressionLevels)
+        db.compression_levels = levels
+
+
+    def _downloadSource(self, checkout):
+        """
+        Download the source tarball and extract it to `export`.
+
+        :type checkout: `str`
+        :param checkout: The source tarball URL.
+        """
         logging.info("Downloading source tarball...")
         sourceFile = self.workPath.child("source.tar.gz")
         
         try:
-            tarball = urlopen(checkout).read()
-            o = open(sourceFile.path , "w")
-            o.write(tarball)
-            o.close()
-        except HTTPError, e:
+            with measure(self.recorder, "download"):
+                if self.cache is not None:
+                    sourceFile = FilePath(self.cache.fetch(checkout))
+                else:
+                    download(checkout, sourceFile.path)
+        except URLError, e:
             print("%s - URL: %s" % (e, checkout))
             sys.exit(1)
 
+        if self.cache is not None:
+            self._stageSource(sourceFile.path)
+            return
+
         logging.info("Extracting tarball...")
         sourceDir = self.workPath.child("source")
-        self.export = self.workPath.child("export")
-        tar = opentar(sourceFile.path, mode='r:*')
-        tar.extractall(sourceDir.path)
+
+        with measure(self.recorder, "extract"):
+            tar = opentar(sourceFile.path, mode='r:*')
+            tar.extractall(sourceDir.path)
         dest = sourceDir.child(sourceDir.listdir()[0])
         dest.moveTo(self.export)
-        logging.info('')
-        
-        project = Project(self.export)
-        self.version = project.getVersion()
 
-        logging.info("Building %s %s..." % (self.title, str(self.version)))
-        project.updateVersion(self.version)
 
-        self.db = self.builder(self.export, destination)
-        self.db.build(self.title, self.version)
+    def _extractSource(self, checkout):
+        """
+        Extract the source tarball to `export` while it is downloaded,
+        without storing the tarball.
 
-        logging.debug("")
-        logging.debug("Removing build directory...")
-        self.workPath.remove()
+        :type checkout: `str`
+        :param checkout: The source tarball URL.
+        """
+        logging.info("Downloading and extracting source tarball...")
 
-        logging.info("")
-        logging.info("Builder ready.")
+        try:
+            if self.cache is not None:
+                with measure(self.recorder, "download"):
+                    sourceFile = self.cache.fetch(checkout)
+            else:
+                stream = openStream(checkout)
+        except URLError, e:
+            print("%s - URL: %s" % (e, checkout))
+            sys.exit(1)
+
+        if self.cache is not None:
+            self._stageSource(sourceFile)
+            return
+
+        self.export.createDirectory()
+
+        # without the cache this includes the download
+        with measure(self.recorder, "extract"):
+            try:
+                extractStream(stream, self.export.path)
+            finally:
+                stream.close()
+
+        stream.report()
+
+
+    def _stageSource(self, sourceFile):
+        """
+        Stage the source tree of a cached tarball in `export`.
+
+        The tarball is extracted once into the tree cache, next to the
+        download cache; later builds clone the extracted tree, using
+        reflinks or hard links when the cache and the work directory are
+        on the same file system. Hard links are only used when
+        `_linksSource` allows it.
+
+        :type sourceFile: `str`
+        :param sourceFile: Location of the tarball in the download cache.
+        """
+        trees = TreeCache(os.path.join(self.cache.directory, "trees"))
+        key = os.path.basename(sourceFile)
+
+        if not trees.has(key):
+            logging.info("Extracting tarball...")
+
+            def extract(path):
+                stream = open(sourceFile, "rb")
+                try:
+                    extractStream(stream, path)
+                finally:
+                    stream.close()
+
+            with measure(self.recorder, "extract"):
+                trees.add(key, extract)
+
+        with measure(self.recorder, "stage"):
+            method = trees.stage(key, self.export.path, self._linksSource())
+
+        logging.info("Staged source tree (%s)" % method)
+        trees.prune(self.cache.hashes())
+
+
+    def _linksSource(self):
+        """
+        Whether the staged source tree may share files with the tree cache
+        through hard links. `setup.py bdist_egg` rewrites files in the tree
+        it builds, so trees that eggs are built in get their own copy.
+
+        :rtype: `bool`
+        """
+        return "egg" not in self.builder.export_types
 
 
 class TarballsBuilder(DistributionBuilder):
@@ -5,10 +5,14 @@
 Scripts for basic release building in the PyAMF project.
 """
 
+import sys
 import logging
+from Queue import Empty
+from multiprocessing import Process, Queue
 
 from release import package
 from release.package import BuildScript
+from release.staging import cloneTree
 
 
 class BuildTarballsScript(BuildScript):
@@ -41,4 +45,119 @@ class BuildDocumentationScript(BuildScript):
         logging.info("Started documentation builder...")
 
 
-__all__ = ["BuildTarballsScript", "BuildEggScript", "BuildDocumentationScript"]
+class BuildReleaseScript(BuildScript):
+    """
+    Script for building the tarballs, egg and documentation of a release
+    from a single source tree.
+
+    The documentation is built once and shared by the tarballs and
+    documentation builders; the builders then run concurrently, each in its
+    own process and output directory.
+    """
+
+    builders = [("tarballs", package.TarballsBuilder),
+                ("egg", package.EggBuilder),
+                ("doc", package.DocumentationBuilder)]
+
+    def __init__(self):
+        logging.info("Started release builder...")
+
+
+    def _linksSource(self):
+        """
+        The egg builder gets its own copy of the tree, see `runBuilders`.
+        """
+        return True
+
+
+    def runBuilders(self, destination):
+        """
+        Build all distributions.
+
+        :type destination: `FilePath`
+        :param destination: The directory where the output directories of
+            the builders will be placed.
+        """
+        if not destination.exists():
+            destination.makedirs()
+
+        builders = []
+        for name, builder in self.builders:
+            root = self.export
+
+            if "egg" in builder.export_types:
+                # setup.py writes to the tree it builds, so eggs get a
+                # copy that doesn't share files through hard links
+                root = self.workPath.child(name)
+                cloneTree(self.export.path, root.path, link=False)
+
+            db = builder(root, destination.child(name))
+            self.configureBuilder(db)
+            # the doctree cache and build state use the release name,
+            # which is otherwise set by build()
+            db.releaseName = "%s-%s" % (self.title, self.version)
+            builders.append((name, db))
+
+        documented = [db for name, db in builders if db.needsDocumentation()]
+
+        if documented:
+            docs = documented[0]
+            docs.buildDocumentation()
+
+            for db in documented[1:]:
+                db.html_docs = docs.html_docs
+                db.api_docs = docs.api_docs
+
+        # the builders send their recorded stages back through the queue
+        stages = Queue()
+        processes = []
+        for name, db in builders:
+            p = Process(target=_runBuilder, args=(name, db, self.title,
+                                                  self.version, stages))
+            p.start()
+            processes.append((name, p))
+
+        received = 0
+        while received < len(processes):
+            try:
+                self.recorder.extend(stages.get(timeout=1))
+                received += 1
+            except Empty:
+                # a builder that crashed never sends its stages
+                if not [p for name, p in processes if p.is_alive()]:
+                    break
+
+        failed = []
+        for name, p in processes:
+            p.join()
+            if p.exitcode != 0:
+                failed.append("%s (exit code %s)" % (name, p.exitcode))
+
+        if failed:
+            sys.exit("Failed to build: %s" % ", ".join(failed))
+
+
+def _runBuilder(name, db, title, version, stages):
+    """
+    Run a builder of L{BuildReleaseScript} in a child process, prefixing
+    its log messages with the builder name.
+
+    The stages recorded by the builder are put on the `stages` queue, also
+    when the build fails.
+    """
+    for handler in logging.getLogger().handlers:
+        handler.setFormatter(logging.Formatter("[%s] %%(message)s" % name))
+
+    # the child's copy of the recorder still has the parent's stages
+    db.recorder.stages = []
+
+    try:
+        db.build(title, version)
+    finally:
+        for stage in db.recorder.stages:
+            stage["name"] = "[%s] %s" % (name, stage["name"])
+        stages.put(db.recorder.stages)
+
+
+__all__ = ["BuildTarballsScript", "BuildEggScript", "BuildDocumentationScript",
+           "BuildReleaseScript"]
@@ -0,0 +1,228 @@
+# Copyright (c) The PyAMF Project.
+# See LICENSE.txt for details.
+
+"""
+Staging of source trees without copying their data.
+
+Trees are put in place by renaming them within one file system, or by
+cloning them from the tree cache: with reflinks where the file system
+supports them, with hard links otherwise. Files of a tree staged with hard
+links are shared with the cache, so they must be replaced, not rewritten in
+place; see L{replaceFile}.
+"""
+
+import os
+import stat
+import errno
+import shutil
+import logging
+from tempfile import mkdtemp, mkstemp
+from subprocess import Popen, PIPE, STDOUT
+
+
+__all__ = ["makeWorkDirectory", "cloneTree", "replaceFile", "TreeCache"]
+
+
+def makeWorkDirectory(destination, prefix=".pyamf-build-"):
+    """
+    Create a temporary work directory next to `destination`, on the same
+    file system, so trees built in it can be renamed into place.
+
+    :param destination: The output directory of the build.
+    :type destination: `str`
+    :rtype: `str`
+    :return: Location of the new directory.
+    """
+    parent = os.path.dirname(os.path.abspath(destination))
+
+    if not os.path.isdir(parent):
+        os.makedirs(parent)
+
+    return mkdtemp(prefix=prefix, dir=parent)
+
+
+def cloneTree(src, dest, link=True):
+    """
+    Copy a directory tree, sharing the file data with `src` where possible.
+
+    Reflinks (copy-on-write clones made by `cp --reflink`) are tried first,
+    then hard links when `link` is set, then a plain copy for what couldn't
+    be linked, eg. across file systems.
+
+    :param src: Existing tree.
+    :type src: `str`
+    :param dest: Location of the copy, which must not exist.
+    :type dest: `str`
+    :param link: Allow hard links. Leave this off for trees whose files are
+        rewritten in place, eg. by `setup.py`.
+    :type link: `bool`
+    :rtype: `str`
+    :return: How the tree was copied: `reflink`, `link` or `copy`.
+    """
+    try:
+        process = Popen(["cp", "-a", "--reflink=always", src, dest],
+                        stdout=PIPE, stderr=STDOUT)
+        process.communicate()
+    except OSError:
+        pass
+    else:
+        if process.returncode == 0:
+            return "reflink"
+
+        if os.path.exists(dest):
+            shutil.rmtree(dest)
+
+    method = link and "link" or "copy"
+    directories = []
+
+    for root, dirs, files in os.walk(src):
+        target = os.path.join(dest, root[len(src):].lstrip(os.sep))
+        os.mkdir(target)
+        directories.append((root, target))
+
+        for name in dirs + files:
+            path = os.path.join(root, name)
+            st = os.lstat(path)
+
+            if stat.S_ISLNK(st.st_mode):
+                os.symlink(os.readlink(path), os.path.join(target, name))
+            elif stat.S_ISREG(st.st_mode):
+                if method == "link":
+                    try:
+                        os.link(path, os.path.join(target, name))
+                        continue
+                    except OSError, e:
+                        if e.errno not in (errno.EXDEV, errno.EPERM,
+                                           errno.EMLINK):
+                            raise
+                        method = "copy"
+
+                shutil.copy2(path, os.path.join(target, name))
+
+    # deepest directories first, read-only ones are complete by now
+    for root, target in reversed(directories):
+        shutil.copystat(root, target)
+
+    return method
+
+
+def replaceFile(path):
+    """
+    Open a new file that replaces `path` when it is closed, through a
+    rename. Hard links to the old file keep the old content.
+
+    :param path: Location of the file.
+    :type path: `str`
+    :return: File object opened for writing.
+    """
+    fd, tmp = mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                      prefix="." + os.path.basename(path))
+
+    if os.path.exists(path):
+        shutil.copymode(path, tmp)
+
+    return _ReplacingFile(os.fdopen(fd, "wb"), tmp, path)
+
+
+class _ReplacingFile(object):
+    """
+    File returned by L{replaceFile}.
+    """
+
+    def __init__(self, fileobj, tmp, path):
+        self.fileobj = fileobj
+        self.tmp = tmp
+        self.path = path
+
+
+    def write(self, data):
+        self.fileobj.write(data)
+
+
+    def writelines(self, lines):
+        self.fileobj.writelines(lines)
+
+
+    def close(self):
+        if self.fileobj.closed:
+            return
+
+        self.fileobj.close()
+        os.rename(self.tmp, self.path)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, type, value, tb):
+        if type is None:
+            self.close()
+        else:
+            self.fileobj.close()
+            os.unlink(self.tmp)
+
+
+class TreeCache(object):
+    """
+    Extracted source trees, keyed by the SHA-256 of their tarball in the
+    L{release.cache.DownloadCache}.
+
+    :ivar directory: Location of the trees.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+
+    def has(self, key):
+        return os.path.isdir(os.path.join(self.directory, key))
+
+
+    def add(self, key, extract):
+        """
+        Add a tree, extracted next to the cached trees and renamed into
+        place when it is complete.
+
+        :param key: SHA-256 of the tarball.
+        :type key: `str`
+        :param extract: Called with the directory to extract the tree to.
+        """
+        tmp = mkdtemp(prefix=".tmp-", dir=self.directory)
+
+        try:
+            extract(tmp)
+            os.rename(tmp, os.path.join(self.directory, key))
+        except:
+            shutil.rmtree(tmp, True)
+
+            # another build added the same tree first
+            if not self.has(key):
+                raise
+
+
+    def stage(self, key, dest, link=True):
+        """
+        Clone a cached tree to `dest`, see L{cloneTree}.
+
+        :rtype: `str`
+        :return: How the tree was copied.
+        """
+        return cloneTree(os.path.join(self.directory, key), dest, link)
+
+
+    def prune(self, keep):
+        """
+        Remove the trees of tarballs that are no longer cached.
+
+        :param keep: Keys of the trees to keep.
+        :type keep: `set`
+        """
+        for key in os.listdir(self.directory):
+            # trees being extracted start with a dot
+            if key not in keep and not key.startswith("."):
+                logging.debug("Removing cached tree %s" % key)
+                shutil.rmtree(os.path.join(self.directory, key), True)
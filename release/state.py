@@ -0,0 +1,170 @@
+# Copyright (c) The PyAMF Project.
+# See LICENSE.txt for details.
+
+"""
+Build state of earlier runs, used to skip packages whose inputs haven't
+changed.
+"""
+
+import os
+import stat
+import json
+import hashlib
+import logging
+from tempfile import mkstemp
+
+from release.checksum import BLOCK_SIZE
+
+
+__all__ = ["BuildState", "hashTree", "hashInputs"]
+
+
+def hashTree(path, blockSize=BLOCK_SIZE):
+    """
+    Content hash of a directory tree.
+
+    The hash covers the relative names, the type, the executable bit, the
+    symlink targets and the content of every file, in sorted order; times
+    and owners are left out, so two extractions of the same tarball have
+    the same hash.
+
+    :param path: Location of the tree.
+    :type path: `str`
+    :param blockSize: Size of the blocks read from disk.
+    :type blockSize: `int`
+    :rtype: `str`
+    :return: SHA-256 hex digest.
+    """
+    digest = hashlib.sha256()
+
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        prefix = root[len(path):].replace(os.sep, "/").lstrip("/")
+
+        for name in sorted(dirs + files):
+            src = os.path.join(root, name)
+            st = os.lstat(src)
+            relative = (prefix and prefix + "/" or "") + name
+
+            if stat.S_ISLNK(st.st_mode):
+                digest.update("L %s\0%s\0" % (relative, os.readlink(src)))
+            elif stat.S_ISDIR(st.st_mode):
+                digest.update("D %s\0" % relative)
+            else:
+                executable = st.st_mode & 0111 and "x" or "-"
+                digest.update("F %s\0%s\0%d\0" % (relative, executable,
+                                                  st.st_size))
+
+                fd = open(src, "rb")
+                try:
+                    while True:
+                        block = fd.read(blockSize)
+                        if not block:
+                            break
+                        digest.update(block)
+                finally:
+                    fd.close()
+
+    return digest.hexdigest()
+
+
+def hashInputs(inputs):
+    """
+    :param inputs: Everything a package depends on, JSON serializable.
+    :type inputs: `dict`
+    :rtype: `str`
+    :return: SHA-256 hex digest of `inputs`.
+    """
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True)).hexdigest()
+
+
+class BuildState(object):
+    """
+    Packages of earlier builds in an output directory, stored as JSON.
+
+    Each package is recorded with the hash of its inputs, its file name,
+    size and checksums. A package can be kept when the recorded inputs
+    match and the file is still there.
+
+    :ivar path: Location of the JSON file.
+    :ivar packages: Record for each export type.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.packages = {}
+
+        if os.path.exists(path):
+            fd = open(path, "rb")
+            try:
+                try:
+                    self.packages = json.load(fd).get("packages", {})
+                except ValueError:
+                    logging.warn("Ignoring corrupt build state: " + path)
+            finally:
+                fd.close()
+
+
+    def getPackage(self, ext, inputs, directory):
+        """
+        Find an unchanged package.
+
+        :param ext: Export type, eg. `tar.gz`.
+        :type ext: `str`
+        :param inputs: Inputs of the package, see `hashInputs`.
+        :type inputs: `dict`
+        :param directory: Output directory.
+        :type directory: `str`
+        :rtype: `dict`
+        :return: The record with `file`, `size` and `checksums` keys, or
+            `None` when the package has to be built.
+        """
+        record = self.packages.get(ext)
+
+        if record is None or record["key"] != hashInputs(inputs):
+            return
+
+        path = os.path.join(directory, record["file"])
+
+        if not os.path.isfile(path) or os.path.getsize(path) != record["size"]:
+            return
+
+        return record
+
+
+    def setPackage(self, ext, inputs, path, checksums):
+        """
+        Record a freshly built package.
+
+        :param path: Location of the package.
+        :type path: `str`
+        :param checksums: Hex digest for each algorithm.
+        :type checksums: `dict`
+        """
+        self.packages[ext] = {"key": hashInputs(inputs), "inputs": inputs,
+                              "file": os.path.basename(path),
+                              "size": os.path.getsize(path),
+                              "checksums": checksums}
+
+
+    def removePackage(self, ext):
+        """
+        Forget a package, eg. because it is being rebuilt.
+        """
+        self.packages.pop(ext, None)
+
+
+    def save(self):
+        """
+        Replace the state file atomically.
+        """
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp = mkstemp(dir=directory, suffix=".json")
+        output = os.fdopen(fd, "wb")
+        try:
+            json.dump({"packages": self.packages}, output, indent=1,
+                      sort_keys=True)
+        finally:
+            output.close()
+
+        os.rename(tmp, self.path)
@@ -0,0 +1,167 @@
+# Copyright (c) The PyAMF Project.
+# See LICENSE.txt for details.
+
+"""
+Tests for `release.archive`.
+"""
+
+import os
+import shutil
+import struct
+import tarfile
+import zipfile
+import unittest
+from tempfile import mkdtemp
+
+from release.archive import Manifest, TarWriter, ZipWriter
+from release.compress import GzipCompressor
+
+
+#: Files of the source tree.
+FILES = ["setup.py", "pyamf/__init__.py", "pyamf/util/pure.py",
+         "pyamf/adapters/_django.py", "doc/index.txt", "CHANGES.txt"]
+
+#: `SOURCE_DATE_EPOCH` of the builds.
+EPOCH = 1300000000
+
+
+class DeterministicArchiveTests(unittest.TestCase):
+    """
+    Reproducible archives of the same tree, built at different times and
+    from files created in a different order.
+    """
+
+    def setUp(self):
+        self.tmp = mkdtemp()
+
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+
+    def makeTree(self, name, files, mtime, mode):
+        root = os.path.join(self.tmp, name, "PyAMF-0.6")
+
+        for f in files:
+            path = os.path.join(root, *f.split("/"))
+
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+
+            fd = open(path, "wb")
+            fd.write("# %s\n" % f)
+            fd.close()
+
+            os.chmod(path, mode)
+            os.utime(path, (mtime, mtime))
+
+        return root
+
+
+    def build(self, root, ext):
+        """
+        Build an archive of `root` like the builders do in deterministic
+        mode.
+
+        :return: The content of the archive.
+        """
+        manifest = Manifest()
+        manifest.add(root, "PyAMF-0.6")
+        manifest.sort()
+
+        path = os.path.join(os.path.dirname(root), "PyAMF-0.6." + ext)
+
+        if ext == "zip":
+            writer = ZipWriter(path, 6, mtime=EPOCH)
+        else:
+            writer = TarWriter(path, GzipCompressor, 9, mtime=EPOCH)
+
+        manifest.write([writer])
+        writer.close()
+
+        fd = open(path, "rb")
+        try:
+            return fd.read()
+        finally:
+            fd.close()
+
+
+    def buildTwice(self, ext):
+        first = self.makeTree("first", FILES, 1000000000, 0644)
+        second = self.makeTree("second", list(reversed(FILES)), 1400000000,
+                               0600)
+
+        return self.build(first, ext), self.build(second, ext)
+
+
+    def test_tarball(self):
+        first, second = self.buildTwice("tar.gz")
+
+        self.assertEqual(first, second)
+
+
+    def test_zip(self):
+        first, second = self.buildTwice("zip")
+
+        self.assertEqual(first, second)
+
+
+    def test_gzipHeader(self):
+        """
+        The time in the gzip header is 0.
+        """
+        data = self.buildTwice("tar.gz")[0]
+
+        self.assertEqual(data[:2], "\x1f\x8b")
+        self.assertEqual(struct.unpack("<I", data[4:8])[0], 0)
+
+
+    def test_tarEntries(self):
+        """
+        Entries are sorted by name, directories before their contents, and
+        have the same time, owner and permissions.
+        """
+        self.buildTwice("tar.gz")
+
+        tar = tarfile.open(os.path.join(self.tmp, "second",
+                                        "PyAMF-0.6.tar.gz"))
+        try:
+            members = tar.getmembers()
+        finally:
+            tar.close()
+
+        names = [m.name for m in members]
+        self.assertEqual(names, sorted(names, key=lambda n: n.split("/")))
+        self.assertEqual(names[0], "PyAMF-0.6")
+
+        for member in members:
+            self.assertEqual(member.mtime, EPOCH)
+            self.assertEqual((member.uid, member.gid), (0, 0))
+            self.assertEqual((member.uname, member.gname), ("", ""))
+
+            if member.isdir():
+                self.assertEqual(member.mode, 0755)
+            else:
+                self.assertEqual(member.mode, 0644)
+
+
+    def test_zipEntries(self):
+        self.buildTwice("zip")
+
+        archive = zipfile.ZipFile(os.path.join(self.tmp, "first",
+                                               "PyAMF-0.6.zip"))
+        try:
+            infos = archive.infolist()
+        finally:
+            archive.close()
+
+        names = [info.filename for info in infos]
+        self.assertEqual(names, sorted(names, key=lambda n: n.split("/")))
+        self.assertEqual(sorted(names), sorted(FILES))
+
+        for info in infos:
+            self.assertEqual(info.date_time, (2011, 3, 13, 7, 6, 40))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+# Copyright (c) The PyAMF Project.
+# See LICENSE.txt for details.
+
+"""
+Tests for `release.cache`.
+"""
+
+import os
+import time
+import shutil
+import logging
+import unittest
+import threading
+from tempfile import mkdtemp
+from multiprocessing import Process
+
+import release
+from release import lockFile
+from release.cache import DownloadCache
+
+
+def fetchAll(directory, urls):
+    """
+    Fetch `urls` into the cache in `directory`, in a child process.
+    """
+    logging.disable(logging.CRITICAL)
+    cache = DownloadCache(directory)
+
+    for url in urls:
+        cache.fetch(url)
+
+
+class DownloadCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = mkdtemp()
+        self.directory = os.path.join(self.tmp, "cache")
+        self.cache = DownloadCache(self.directory)
+
+        logging.disable(logging.CRITICAL)
+
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+        shutil.rmtree(self.tmp)
+
+
+    def makeURL(self, name, size=100):
+        path = os.path.join(self.tmp, name)
+
+        fd = open(path, "wb")
+        fd.write(name[0] * size)
+        fd.close()
+
+        return "file://" + path
+
+
+    def test_fetch(self):
+        url = self.makeURL("a.tar.gz")
+        path = self.cache.fetch(url)
+
+        self.assertEqual(open(path, "rb").read(), "a" * 100)
+        self.assertEqual(self.cache._loadIndex().keys(), [url])
+
+
+    def test_waitForLock(self):
+        """
+        A fetch waits while another build holds the lock of the cache.
+        """
+        if release.fcntl is None:
+            raise unittest.SkipTest("Locking needs fcntl")
+
+        url = self.makeURL("a.tar.gz")
+        lock = lockFile(os.path.join(self.directory, ".lock"))
+        thread = threading.Thread(target=self.cache.fetch, args=(url,))
+
+        try:
+            thread.start()
+            time.sleep(0.2)
+
+            self.assertTrue(thread.isAlive())
+            self.assertEqual(self.cache._loadIndex(), {})
+        finally:
+            lock.close()
+
+        thread.join()
+        self.assertEqual(self.cache._loadIndex().keys(), [url])
+
+
+    def test_concurrentBuilds(self):
+        """
+        Builds that fetch at the same time keep each other's index entries.
+        """
+        urls = [self.makeURL("%s-%d.tar.gz" % (name, i))
+                for name in "ab" for i in range(10)]
+
+        processes = [Process(target=fetchAll, args=(self.directory, part))
+                     for part in (urls[:10], urls[10:])]
+
+        for p in processes:
+            p.start()
+
+        for p in processes:
+            p.join()
+            self.assertEqual(p.exitcode, 0)
+
+        self.assertEqual(sorted(self.cache._loadIndex().keys()), sorted(urls))
+
+
+    def test_keepRecentlyUsed(self):
+        """
+        Files used recently by another build aren't evicted, even when the
+        cache is too big.
+        """
+        self.cache.maxSize = 150
+        first = self.cache.fetch(self.makeURL("a.tar.gz"))
+        second = self.cache.fetch(self.makeURL("b.tar.gz"))
+
+        self.assertTrue(os.path.exists(first))
+        self.assertTrue(os.path.exists(second))
+
+        # unused for longer than inUse
+        self.cache.inUse = 0
+        self.cache.fetch(self.makeURL("c.tar.gz"))
+
+        self.assertFalse(os.path.exists(first))
+        self.assertFalse(os.path.exists(second))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,154 @@
+# Copyright (c) The PyAMF Project.
+# See LICENSE.txt for details.
+
+"""
+Tests for `release.checksum`.
+"""
+
+import os
+import shutil
+import hashlib
+import unittest
+from tempfile import mkdtemp
+
+from release.archive import Manifest, TarWriter, ZipWriter
+from release.checksum import HashingFile, getChecksums, getTextChecksums
+from release.compress import GzipCompressor, BZ2Compressor
+
+
+#: Binary content with newlines at arbitrary places, larger than the blocks
+#: used in the tests.
+DATA = "".join([chr(i % 256) for i in range(10000)]) + "\n\r\n" * 100
+
+
+class ChecksumTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = mkdtemp()
+        self.path = os.path.join(self.tmp, "PyAMF-0.6.tar.gz")
+
+        fd = open(self.path, "wb")
+        fd.write(DATA)
+        fd.close()
+
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+
+    def test_blocks(self):
+        """
+        The digests of a file read in many blocks match those of `hashlib`
+        over the whole content.
+        """
+        checksums = getChecksums(self.path, blockSize=1000)
+
+        self.assertEqual(sorted(checksums.keys()), ["md5", "sha1", "sha256"])
+
+        for name, value in checksums.items():
+            self.assertEqual(value, hashlib.new(name, DATA).hexdigest())
+
+
+    def test_blockSizes(self):
+        """
+        The block size doesn't change the digests, also when it doesn't
+        divide the size of the file.
+        """
+        expected = getChecksums(self.path)
+
+        for blockSize in (1, 7, 4096, len(DATA), len(DATA) + 1):
+            self.assertEqual(getChecksums(self.path, blockSize=blockSize),
+                             expected)
+
+
+    def test_algorithms(self):
+        self.assertEqual(getChecksums(self.path, ("sha256",)),
+                         {"sha256": hashlib.sha256(DATA).hexdigest()})
+
+
+    def test_text(self):
+        """
+        Lines starting with `excludeLine` are left out and `includeLine` is
+        added at the end, eg. for the `MD5SUMS` file.
+        """
+        fd = open(self.path, "wb")
+        fd.write("a  PyAMF-0.5.tar.gz\nb  PyAMF-0.6.tar.gz\n")
+        fd.close()
+
+        checksums = getTextChecksums(self.path, "b ", "c  PyAMF-0.6.zip\n",
+                                     ("md5",))
+        expected = "a  PyAMF-0.5.tar.gz\nc  PyAMF-0.6.zip\n"
+
+        self.assertEqual(checksums["md5"], hashlib.md5(expected).hexdigest())
+
+
+    def test_missing(self):
+        self.assertRaises(IOError, getChecksums,
+                          os.path.join(self.tmp, "missing"))
+
+
+class HashingFileTests(unittest.TestCase):
+    """
+    Checksums computed while the archives are written match those of the
+    finished files.
+    """
+
+    def setUp(self):
+        self.tmp = mkdtemp()
+        self.tree = os.path.join(self.tmp, "PyAMF-0.6")
+
+        for name in ("setup.py", "pyamf/__init__.py", "pyamf/data.bin"):
+            path = os.path.join(self.tree, *name.split("/"))
+
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+
+            fd = open(path, "wb")
+            fd.write(name + DATA)
+            fd.close()
+
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+
+    def test_write(self):
+        path = os.path.join(self.tmp, "out.bin")
+        output = HashingFile(open(path, "wb"))
+
+        for i in range(0, len(DATA), 333):
+            output.write(DATA[i:i + 333])
+
+        self.assertEqual(output.tell(), len(DATA))
+        output.close()
+
+        self.assertEqual(output.size, os.path.getsize(path))
+        self.assertEqual(output.getChecksums(), getChecksums(path))
+
+
+    def test_archives(self):
+        """
+        The checksums of every archive writer match a re-read of the
+        archive once it is closed.
+        """
+        manifest = Manifest()
+        manifest.add(self.tree, "PyAMF-0.6")
+
+        writers = [
+            TarWriter(os.path.join(self.tmp, "PyAMF-0.6.tar.gz"),
+                      GzipCompressor),
+            TarWriter(os.path.join(self.tmp, "PyAMF-0.6.tar.bz2"),
+                      BZ2Compressor),
+            ZipWriter(os.path.join(self.tmp, "PyAMF-0.6.zip"))]
+
+        manifest.write(writers)
+
+        for writer in writers:
+            writer.close()
+
+            self.assertEqual(writer.getChecksums(), getChecksums(writer.path))
+            self.assertEqual(writer.output.size, os.path.getsize(writer.path))
+
+
+if __name__ == "__main__":
+    unittest.main()
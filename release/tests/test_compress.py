@@ -0,0 +1,184 @@
+# Copyright (c) The PyAMF Project.
+# See LICENSE.txt for details.
+
+"""
+Tests for `release.compress`.
+"""
+
+import bz2
+import errno
+import gzip
+import unittest
+from cStringIO import StringIO
+from subprocess import Popen, PIPE
+
+from release import compress
+
+
+#: Compressible data that spans several blocks of the block compressors.
+DATA = "".join(["%d %s\n" % (i, "pyamf" * (i % 7)) for i in range(20000)])
+
+#: Block size used in the tests, so the output has several members.
+BLOCK_SIZE = 64 * 1024
+
+
+def gunzip(data):
+    """
+    Decompress all members of a gzip file, like `gzip -d`.
+    """
+    return gzip.GzipFile(fileobj=StringIO(data)).read()
+
+
+def bunzip2(data):
+    """
+    Decompress all concatenated streams of a bzip2 file, like `bzip2 -d`.
+    """
+    result = []
+
+    while data:
+        decompressor = bz2.BZ2Decompressor()
+        result.append(decompressor.decompress(data))
+        data = decompressor.unused_data
+
+    return "".join(result)
+
+
+def unxz(data):
+    """
+    Decompress a xz file, with `xz -d` when the `lzma` module is missing.
+    """
+    if compress.lzma is not None:
+        return compress.lzma.decompress(data)
+
+    if not compress.XZCompressor.isAvailable():
+        raise unittest.SkipTest("No xz decompressor is available")
+
+    process = Popen(["xz", "-d", "-c"], stdin=PIPE, stdout=PIPE)
+
+    return process.communicate(data)[0]
+
+
+class CatCompressor(compress.PipeCompressor):
+    """
+    Pipe backend that doesn't compress, available everywhere `cat` is.
+    """
+
+    program = "cat"
+
+    def getCommand(self):
+        return [self.program]
+
+
+class FullDisk(object):
+    """
+    File that fails like a full disk.
+    """
+
+    def write(self, data):
+        raise IOError(errno.ENOSPC, "No space left on device")
+
+
+class BackendTests(unittest.TestCase):
+    """
+    Every backend produces output that decompresses back to the input.
+    """
+
+    def compress(self, backend, level=6):
+        if not backend.isAvailable():
+            raise unittest.SkipTest("%s is not available" % backend.__name__)
+
+        output = StringIO()
+        compressor = backend(output, level, threads=2)
+
+        if isinstance(compressor, compress.BlockCompressor):
+            compressor.blockSize = BLOCK_SIZE
+
+        # writes that don't line up with the blocks
+        for i in range(0, len(DATA), 10000):
+            compressor.write(DATA[i:i + 10000])
+
+        compressor.close()
+
+        return output.getvalue()
+
+
+    def test_gzip(self):
+        self.assertEqual(gunzip(self.compress(compress.GzipCompressor)), DATA)
+
+
+    def test_parallelGzip(self):
+        data = self.compress(compress.ParallelGzipCompressor)
+
+        # one member per block
+        self.assertTrue(data.count("\x1f\x8b\x08") >= len(DATA) / BLOCK_SIZE)
+        self.assertEqual(gunzip(data), DATA)
+
+
+    def test_pigz(self):
+        self.assertEqual(gunzip(self.compress(compress.PigzCompressor)), DATA)
+
+
+    def test_bzip2(self):
+        self.assertEqual(bunzip2(self.compress(compress.BZ2Compressor)), DATA)
+
+
+    def test_parallelBZ2(self):
+        data = self.compress(compress.ParallelBZ2Compressor, level=1)
+
+        self.assertTrue(data.count("BZh1") > 1)
+        self.assertEqual(bunzip2(data), DATA)
+
+
+    def test_pbzip2(self):
+        self.assertEqual(bunzip2(self.compress(compress.PBzip2Compressor)),
+                         DATA)
+
+
+    def test_lzma(self):
+        self.assertEqual(unxz(self.compress(compress.LZMACompressor)), DATA)
+
+
+    def test_xz(self):
+        self.assertEqual(unxz(self.compress(compress.XZCompressor)), DATA)
+
+
+    def test_emptyBlocks(self):
+        """
+        An empty input still gives a valid file.
+        """
+        output = StringIO()
+        compressor = compress.ParallelGzipCompressor(output, 6, threads=2)
+        compressor.close()
+
+        self.assertEqual(gunzip(output.getvalue()), "")
+
+
+class PipeCompressorTests(unittest.TestCase):
+    """
+    Backends that run an external program.
+    """
+
+    def test_copy(self):
+        output = StringIO()
+        compressor = CatCompressor(output, 6)
+        compressor.write(DATA)
+        compressor.close()
+
+        self.assertEqual(output.getvalue(), DATA)
+
+
+    def test_writeError(self):
+        """
+        A failed write of the output in the pump thread is raised by
+        `close`, although the program exits with 0.
+        """
+        compressor = CatCompressor(FullDisk(), 6)
+        compressor.write(DATA)
+
+        self.assertRaises(IOError, compressor.close)
+        self.assertEqual(compressor.process.returncode, 0)
+        self.assertEqual(compressor.error[1].errno, errno.ENOSPC)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,144 @@
+# Copyright (c) The PyAMF Project.
+# See LICENSE.txt for details.
+
+"""
+Tests for `release.download`, offline through `file://` URLs and a HTTP
+server on localhost.
+"""
+
+import os
+import shutil
+import logging
+import unittest
+import threading
+from tempfile import mkdtemp
+from urllib2 import urlopen, URLError
+from BaseHTTPServer import HTTPServer
+from SimpleHTTPServer import SimpleHTTPRequestHandler
+
+from release.download import ProgressReader, download, openStream
+
+
+#: Binary content that spans many chunks, with bytes that text mode would
+#: change on some platforms.
+FIXTURE = "\x00\r\n\x1a\xff" + "".join([chr(i % 251) for i in range(50000)])
+
+
+class DownloadMixin:
+    """
+    Tests for the downloads of one kind of URL, see `getURL`.
+    """
+
+    def setUp(self):
+        self.tmp = mkdtemp()
+        self.source = os.path.join(self.tmp, "source.tar.gz")
+
+        fd = open(self.source, "wb")
+        fd.write(FIXTURE)
+        fd.close()
+
+        logging.disable(logging.CRITICAL)
+
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+        shutil.rmtree(self.tmp)
+
+
+    def test_download(self):
+        """
+        The file is copied byte for byte in chunks of `bufferSize`.
+        """
+        target = os.path.join(self.tmp, "download.tar.gz")
+        size = download(self.getURL("source.tar.gz"), target, bufferSize=1000)
+
+        fd = open(target, "rb")
+        data = fd.read()
+        fd.close()
+
+        self.assertEqual(size, len(FIXTURE))
+        self.assertEqual(data, FIXTURE)
+
+
+    def test_progress(self):
+        """
+        The progress reports count every byte read, up to the size of the
+        file.
+        """
+        reader = ProgressReader(urlopen(self.getURL("source.tar.gz")),
+                                interval=0)
+        reports = []
+        reader.report = lambda: reports.append(reader.bytes)
+        chunks = []
+
+        try:
+            while True:
+                chunk = reader.read(1000)
+                if not chunk:
+                    break
+                chunks.append(len(chunk))
+        finally:
+            reader.close()
+
+        self.assertEqual(reader.total, len(FIXTURE))
+        self.assertEqual(reader.bytes, len(FIXTURE))
+        self.assertEqual(sum(chunks), len(FIXTURE))
+
+        # one report after each chunk, with the running total
+        running = [sum(chunks[:i + 1]) for i in range(len(chunks))]
+        self.assertEqual(reports, running)
+
+
+    def test_missing(self):
+        """
+        A missing file raises `URLError`.
+        """
+        self.assertRaises(URLError, openStream, self.getURL("missing.tar.gz"))
+
+
+class FileDownloadTests(DownloadMixin, unittest.TestCase):
+    """
+    Downloads of `file://` URLs.
+    """
+
+    def getURL(self, name):
+        return "file://" + os.path.join(self.tmp, name)
+
+
+class HTTPDownloadTests(DownloadMixin, unittest.TestCase):
+    """
+    Downloads from a HTTP server on localhost.
+    """
+
+    def setUp(self):
+        DownloadMixin.setUp(self)
+
+        root = self.tmp
+
+        class Handler(SimpleHTTPRequestHandler):
+            def translate_path(self, path):
+                return os.path.join(root, path.lstrip("/"))
+
+            def log_message(self, *args):
+                pass
+
+        self.server = HTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+        DownloadMixin.tearDown(self)
+
+
+    def getURL(self, name):
+        return "http://127.0.0.1:%d/%s" % (self.server.server_port, name)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,194 @@
+# Copyright (c) The PyAMF Project.
+# See LICENSE.txt for details.
+
+"""
+Tests for `release.package`.
+"""
+
+import os
+import shutil
+import logging
+import unittest
+from tempfile import mkdtemp
+
+from twisted.python.filepath import FilePath
+
+import release
+from release.package import DistributionBuilder
+from release.scripts import BuildTarballsScript
+
+
+class DocumentationTests(unittest.TestCase):
+    """
+    Sphinx and Epydoc, run by `DistributionBuilder.buildDocumentation`.
+    """
+
+    def setUp(self):
+        if release.fcntl is None:
+            raise unittest.SkipTest("Needs fcntl to check the doctree lock")
+
+        self.tmp = mkdtemp()
+        self.path = os.environ["PATH"]
+
+        # a Sphinx that runs until it is killed, and no Epydoc
+        bin = os.path.join(self.tmp, "bin")
+        os.makedirs(bin)
+        script = os.path.join(bin, "sphinx-build")
+        fd = open(script, "w")
+        fd.write("#!/bin/sh\nsleep 60\n")
+        fd.close()
+        os.chmod(script, 0755)
+        os.environ["PATH"] = bin
+
+        root = FilePath(self.tmp).child("export")
+        root.child("doc").makedirs()
+
+        self.builder = DistributionBuilder(root,
+                                           FilePath(self.tmp).child("dist"))
+        self.builder.releaseName = "PyAMF-0.6"
+        self.builder.doctree_cache = os.path.join(self.tmp, "doctrees")
+        self.builder._setupTheme = lambda: None
+
+        logging.disable(logging.CRITICAL)
+
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+        os.environ["PATH"] = self.path
+        shutil.rmtree(self.tmp)
+
+
+    def test_epydocMissing(self):
+        """
+        When Epydoc can't be started, Sphinx is stopped and the doctree
+        cache is unlocked.
+        """
+        started = []
+        start = self.builder._startMainDocumentation
+
+        def startMainDocumentation():
+            started.append(start())
+            return started[0]
+
+        self.builder._startMainDocumentation = startMainDocumentation
+
+        self.assertRaises(OSError, self.builder.buildDocumentation)
+
+        sphinx = started[0]
+        self.assertNotEqual(sphinx.returncode, None)
+        self.assertTrue(sphinx.lock.closed)
+
+        lock = open(os.path.join(self.tmp, "doctrees", "PyAMF-0.6", ".lock"))
+        try:
+            flags = release.fcntl.LOCK_EX | release.fcntl.LOCK_NB
+            release.fcntl.flock(lock.fileno(), flags)
+        finally:
+            lock.close()
+
+
+    def test_cachedPages(self):
+        """
+        Sphinx writes its pages next to the doctrees, where the next build
+        of the release finds them, and they are copied into the build
+        directory.
+        """
+        # a Sphinx that notes the pages of an earlier build
+        script = os.path.join(self.tmp, "bin", "sphinx-build")
+        fd = open(script, "w")
+        fd.write('#!/bin/sh\nfor out; do :; done\n/bin/mkdir -p "$out"\n'
+                 'test -f "$out/index.html" && echo reused > "$out/reused"\n'
+                 'echo page > "$out/index.html"\n')
+        fd.close()
+
+        self.builder.docPath = self.builder.rootDirectory.child("doc")
+        html = self.builder._finishMainDocumentation(
+            self.builder._startMainDocumentation())
+
+        self.assertEqual(html.child("index.html").getContent(), "page\n")
+        self.assertFalse(html.child("reused").exists())
+
+        # a new build directory, same release
+        shutil.rmtree(html.path)
+        html = self.builder._finishMainDocumentation(
+            self.builder._startMainDocumentation())
+
+        self.assertEqual(html.child("reused").getContent(), "reused\n")
+        self.assertEqual(html.parent().parent(), self.builder.docPath)
+        self.assertTrue(os.path.exists(os.path.join(
+            self.tmp, "doctrees", "PyAMF-0.6", "html", "index.html")))
+
+
+class BuildScriptOptionsTests(unittest.TestCase):
+    """
+    Command line options of the build scripts.
+    """
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+
+    def configure(self, *args):
+        script = BuildTarballsScript()
+        options, args = script.getOptionParser().parse_args(
+            ["--no-cache"] + list(args))
+        script.configure(options)
+
+        return script
+
+
+    def test_compressionLevel(self):
+        """
+        The level of an archive type overrides the default of the builder.
+        """
+        script = self.configure("--compression-level", "tar.xz=9",
+                                "--compression-level", "tar.gz=0")
+        db = DistributionBuilder.__new__(DistributionBuilder)
+        script.configureBuilder(db)
+
+        self.assertEqual(db.compression_levels["tar.xz"], 9)
+        self.assertEqual(db.compression_levels["tar.gz"], 0)
+        self.assertEqual(db.compression_levels["tar.bz2"], 9)
+
+
+    def test_workers(self):
+        """
+        The archives are written in a single pass unless more workers are
+        asked for.
+        """
+        db = DistributionBuilder.__new__(DistributionBuilder)
+        self.configure().configureBuilder(db)
+        self.assertEqual(db._getWorkerCount(), 1)
+
+        self.configure("--workers", "3").configureBuilder(db)
+        self.assertEqual(db._getWorkerCount(), 3)
+
+
+    def test_compressionLevelOutOfRange(self):
+        """
+        Levels the backend of an archive type doesn't accept are rejected
+        before the build starts; bzip2 has no level 0.
+        """
+        self.assertRaises(SystemExit, self.configure,
+                          "--compression-level", "tar.bz2=0")
+        self.assertRaises(SystemExit, self.configure,
+                          "--compression-level", "zip=10")
+        self.assertRaises(SystemExit, self.configure,
+                          "--compression-level", "tar.gz=fast")
+
+
+    def test_compressionLevelUnknownType(self):
+        """
+        Levels for unknown archive types, eg. typos, are rejected.
+        """
+        self.assertRaises(SystemExit, self.configure,
+                          "--compression-level", "tar.gzz=5")
+        self.assertRaises(SystemExit, self.configure,
+                          "--compression-level", "egg=5")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,149 @@
+# Copyright (c) The PyAMF Project.
+# See LICENSE.txt for details.
+
+"""
+Tests for `release.builds.results`, which needs Buildbot.
+"""
+
+import os
+import shutil
+import unittest
+from tempfile import mkdtemp
+from cStringIO import StringIO
+
+try:
+    from release.builds import results, runtests
+except ImportError:
+    results = runtests = None
+
+
+#: Report of a run with a failure, an error and a skipped test.
+JUNIT = """<?xml version="1.0" encoding="utf-8"?>
+<testsuite name="pyamf" tests="4" failures="1" errors="1" skipped="1" time="1.250">
+  <testcase classname="pyamf.tests.test_amf0.EncoderTestCase" name="test_number" time="0.010"/>
+  <testcase classname="pyamf.tests.test_amf0.EncoderTestCase" name="test_string" time="0.020">
+    <failure>Traceback (most recent call last):
+AssertionError: 'a' != 'b'
+</failure>
+  </testcase>
+  <testcase classname="pyamf.tests.test_gateway.DjangoTestCase" name="test_request" time="1.200">
+    <error>ImportError: No module named django</error>
+  </testcase>
+  <testcase classname="pyamf.tests.test_sqlalchemy.SATestCase" name="test_load" time="0.000">
+    <skipped>SQLAlchemy is not installed</skipped>
+  </testcase>
+</testsuite>
+"""
+
+
+class ResultsTests(unittest.TestCase):
+
+    def setUp(self):
+        if results is None:
+            raise unittest.SkipTest("Buildbot is not installed")
+
+
+    def test_parseJUnit(self):
+        records = list(results.parseJUnit(StringIO(JUNIT)))
+
+        self.assertEqual([r[:4] for r in records], [
+            ("pyamf.tests.test_amf0.EncoderTestCase", "test_number",
+             "success", 0.01),
+            ("pyamf.tests.test_amf0.EncoderTestCase", "test_string",
+             "failure", 0.02),
+            ("pyamf.tests.test_gateway.DjangoTestCase", "test_request",
+             "error", 1.2),
+            ("pyamf.tests.test_sqlalchemy.SATestCase", "test_load",
+             "skipped", 0.0)])
+
+        self.assertTrue("AssertionError" in records[1][4])
+        self.assertEqual(records[2][4], "ImportError: No module named django")
+
+
+    def test_parseJUnitChunks(self):
+        """
+        The report is parsed from the chunks of a build log.
+        """
+        chunks = [JUNIT[i:i + 50] for i in range(0, len(JUNIT), 50)]
+        reader = results._ChunkReader(chunks)
+
+        self.assertEqual(len(list(results.parseJUnit(reader))), 4)
+
+
+    def test_parseJUnitRunner(self):
+        """
+        The reports of the parallel test runner can be parsed.
+        """
+        tmp = mkdtemp()
+        path = os.path.join(tmp, "junit.xml")
+
+        try:
+            runtests.writeJUnit(path, [
+                ("a.B.test_one", "a.B", "success", 0.5, ""),
+                ("a.B.test_two", "a.B", "failure", 0.25, "x < y & z"),
+                ("a.C.test_three", "a.C", "unexpectedSuccess", 0.0, "")],
+                0.75)
+
+            fd = open(path)
+            try:
+                records = list(results.parseJUnit(fd))
+            finally:
+                fd.close()
+        finally:
+            shutil.rmtree(tmp)
+
+        self.assertEqual(records, [
+            ("a.B", "test_one", "success", 0.5, ""),
+            ("a.B", "test_two", "failure", 0.25, "x < y & z"),
+            ("a.C", "test_three", "failure", 0.0, "")])
+
+
+    def test_parseSummaryTrial(self):
+        output = ["PyAMF tests", "-" * 70, "Ran 99 tests in 12.345s", "",
+                  "FAILED (failures=2, errors=1, successes=96)"]
+
+        self.assertEqual(results.parseSummary(output), (99, 3, 96))
+
+
+    def test_parseSummaryRunner(self):
+        """
+        The summary of the parallel test runner, without skipped tests.
+        """
+        output = ["Ran 24 tests in 0.800s", "",
+                  "FAILED (failures=1, errors=1, successes=22)"]
+
+        self.assertEqual(results.parseSummary(output), (24, 2, 22))
+
+
+    def test_parseSummaryUnittest(self):
+        self.assertEqual(results.parseSummary(
+            ["Ran 10 tests in 1.0s", "", "FAILED (failures=1, errors=2)"]),
+            (10, 3, 7))
+        self.assertEqual(results.parseSummary(
+            ["Ran 5 tests in 1s", "OK (skipped=1)"]), (5, 0, 4))
+        self.assertEqual(results.parseSummary(
+            ["Ran 3 tests in 1s", "", "OK"]), (3, 0, 3))
+
+
+    def test_parseSummaryPassed(self):
+        self.assertEqual(results.parseSummary(["PASSED (successes=3)"]),
+                         (3, 0, 3))
+
+
+    def test_parseSummaryMissing(self):
+        self.assertEqual(results.parseSummary(["Traceback", "ImportError"]),
+                         None)
+
+
+    def test_iterLines(self):
+        """
+        Lines split over log chunks are joined again.
+        """
+        chunks = ["Ran 3 te", "sts in 1s\n\nFAI", "LED (failures=1)"]
+
+        self.assertEqual(list(results.iterLines(chunks)),
+                         ["Ran 3 tests in 1s", "", "FAILED (failures=1)"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,174 @@
+# Copyright (c) The PyAMF Project.
+# See LICENSE.txt for details.
+
+"""
+Tests for `release.staging` and the source trees staged from the cache.
+"""
+
+import os
+import shutil
+import tarfile
+import logging
+import unittest
+from tempfile import mkdtemp
+
+from release.scripts import BuildEggScript
+from release.staging import cloneTree
+
+
+#: Files of a minimal PyAMF source tree. Like `setup.py bdist_egg`, the
+#: setup script changes a file of the tree in place.
+SOURCE = {
+    "pyamf/__init__.py": 'version = "0.6"\n',
+    "pyamf/a.py": "a = 1\n",
+    "CHANGES.txt": "0.6 (unreleased)\n----------------\n\n- stuff\n",
+    "setup.cfg": "[egg_info]\ntag_build = dev\n",
+    "setup.py": "import os, sys\n"
+                "dist = sys.argv[sys.argv.index('--dist-dir') + 1]\n"
+                "open('pyamf/a.py', 'a').write('# changed by setup.py\\n')\n"
+                "open(os.path.join(dist, 'PyAMF-0.6.egg'), 'w').write('egg')\n",
+}
+
+
+def writeTree(path, files):
+    for name, content in files.items():
+        target = os.path.join(path, *name.split("/"))
+
+        if not os.path.isdir(os.path.dirname(target)):
+            os.makedirs(os.path.dirname(target))
+
+        fd = open(target, "w")
+        try:
+            fd.write(content)
+        finally:
+            fd.close()
+
+
+def readTree(path):
+    files = {}
+
+    for root, dirs, names in os.walk(path):
+        for name in names:
+            src = os.path.join(root, name)
+            relative = src[len(path) + 1:].replace(os.sep, "/")
+
+            fd = open(src)
+            try:
+                files[relative] = fd.read()
+            finally:
+                fd.close()
+
+    return files
+
+
+class CloneTreeTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = mkdtemp()
+        self.src = os.path.join(self.tmp, "src")
+        writeTree(self.src, SOURCE)
+
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+
+    def test_copy(self):
+        """
+        Without links the clone doesn't share files with the original.
+        """
+        dest = os.path.join(self.tmp, "dest")
+        method = cloneTree(self.src, dest, link=False)
+
+        self.assertTrue(method in ("reflink", "copy"))
+        self.assertEqual(readTree(dest), SOURCE)
+
+        fd = open(os.path.join(dest, "pyamf", "a.py"), "a")
+        fd.write("b = 2\n")
+        fd.close()
+
+        self.assertEqual(readTree(self.src), SOURCE)
+
+
+class CachedEggBuildTests(unittest.TestCase):
+    """
+    Eggs built from a source tree in the tree cache.
+    """
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = mkdtemp()
+        self.cache = os.path.join(self.tmp, "cache")
+        self.tarball = os.path.join(self.tmp, "source.tar.gz")
+
+        src = os.path.join(self.tmp, "src", "hydralabs-pyamf-abc123")
+        writeTree(src, SOURCE)
+
+        tar = tarfile.open(self.tarball, "w:gz")
+        tar.add(src, "hydralabs-pyamf-abc123")
+        tar.close()
+
+        logging.disable(logging.CRITICAL)
+
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+        # the egg builder changes to the source tree
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp)
+
+
+    def build(self, name):
+        BuildEggScript().main(["--cache-dir", self.cache,
+                               "file://" + self.tarball,
+                               os.path.join(self.tmp, name)])
+
+
+    def getWorkDirectories(self):
+        return [name for name in os.listdir(self.tmp)
+                if name.startswith(".pyamf-build-")]
+
+
+    def getCachedTrees(self):
+        trees = os.path.join(self.cache, "trees")
+
+        return [os.path.join(trees, name) for name in os.listdir(trees)
+                if not name.startswith(".")]
+
+
+    def test_cachedTreeUnchanged(self):
+        """
+        setup.py changes the staged tree, not the cached one.
+        """
+        self.build("dist")
+
+        trees = self.getCachedTrees()
+        self.assertEqual(len(trees), 1)
+        self.assertEqual(readTree(trees[0]), SOURCE)
+
+        # the next build starts from the pristine tree again
+        self.build("dist2")
+        self.assertEqual(readTree(trees[0]), SOURCE)
+        self.assertTrue(os.path.exists(os.path.join(self.tmp, "dist2",
+                                                    "PyAMF-0.6.egg")))
+
+
+    def test_removeWorkDirectoryOnFailure(self):
+        """
+        The work directory next to the output is removed when a builder
+        fails.
+        """
+        self.build("dist")
+
+        trees = self.getCachedTrees()
+        fd = open(os.path.join(trees[0], "setup.py"), "w")
+        fd.write("raise SystemExit(1)\n")
+        fd.close()
+
+        self.assertRaises(Exception, self.build, "dist2")
+        self.assertEqual(self.getWorkDirectories(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()